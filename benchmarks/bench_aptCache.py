@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Benchmark a fleet's package installs with and without an apt caching proxy.
+# Exercises:
+#    from doUtils: distroImages makeAptCacheDroplet makeUserData makeDroplet
+#    isUp SshConn waitUntilCloudInitDone
+#
+# Per node, the install time is how long cloud-init's "final" stage ran
+# (that's where package_update / packages happen), as reported in
+# /run/cloud-init/status.json.  Run as:
+#
+#    python benchmarks/bench_aptCache.py --nodes 3
+#
+# NB: this makes (2 * nodes + 2) real droplets, and destroys them (and
+# their keys) afterwards.
+
+import sys
+import time
+import logging
+import argparse
+import statistics
+import doUtils
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger('bench_aptCache')
+
+Repos = ['ppa:kelleyk/emacs']
+Pkgs = ['emacs25', 'build-essential', 'texlive-latex-base']
+
+
+def finalStageSecs(dParms):
+    """Wait for cloud-init on a droplet; return how many seconds its
+    final (package installing) stage took, or None if it failed."""
+    if not doUtils.isUp(dParms['ip address'], nTries=7):
+        return None
+    time.sleep(15)
+    sConn = doUtils.SshConn(dParms['ip address'], dParms['username'], keyFname=dParms['pemFilePathname'])
+    isDone = doUtils.waitUntilCloudInitDone(sConn, nTries=12)
+    if not isDone['done']:
+        return None
+    final = isDone['phasesResults']['v1']['modules-final']
+    return final['finished'] - final['start']
+
+
+def launchFleet(imageID, nNodes, droplets, keys, aptProxy=None):
+    """Launch nNodes droplets installing Pkgs, all at once (adding them
+    to droplets, and their SshKeypairs to keys, to clean up); then
+    return each one's install time."""
+    fleet = []
+    for _ in range(nNodes):
+        uData, uKeys = doUtils.makeUserData(sudoUserKeys=[], customRepos=Repos, installPkgs=Pkgs, aptProxy=aptProxy)
+        keys += uKeys
+        fleet.append(doUtils.makeDroplet(imageID, sudoUserKeys=uKeys, userData=uData))
+        droplets.append(fleet[-1])
+    return [finalStageSecs(dParms) for dParms in fleet]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-node package install time, with and without an apt cache droplet.")
+    parser.add_argument('--nodes', type=int, default=3, help="droplets in each fleet")
+    args = parser.parse_args(argv)
+
+    ubuntuImages = [img for img in doUtils.distroImages() if img[1] == 'Ubuntu']
+    iId = ubuntuImages[0][0]
+    droplets, keys = [], []
+    try:
+        log.info("fleet fetching directly from upstream...")
+        directSecs = launchFleet(iId, args.nodes, droplets, keys)
+
+        log.info("bring up the apt cache droplet...")
+        cacheParms = doUtils.makeAptCacheDroplet(iId)
+        droplets.append(cacheParms)
+        keys += cacheParms['sudoUserKeys']
+        if not cacheParms['apt proxy']:
+            log.info("apt cache never came up; giving up")
+            return 1
+
+        log.info("warm the cache with one node...")
+        warmSecs = launchFleet(iId, 1, droplets, keys, aptProxy=cacheParms['apt proxy'])
+
+        log.info("fleet fetching through {}...".format(cacheParms['apt proxy']))
+        cachedSecs = launchFleet(iId, args.nodes, droplets, keys, aptProxy=cacheParms['apt proxy'])
+    finally:
+        for dParms in droplets:
+            dParms['droplet'].destroy()
+        for k in keys:
+            k.destroy()
+
+    directSecs = [t for t in directSecs if t is not None]
+    cachedSecs = [t for t in cachedSecs if t is not None]
+    if not directSecs or not cachedSecs:
+        log.info("too many nodes failed cloud-init to compare")
+        return 1
+    direct = statistics.mean(directSecs)
+    cached = statistics.mean(cachedSecs)
+    print("per-node install secs, direct:       {:7.1f}  (n={})".format(direct, len(directSecs)))
+    print("per-node install secs, cold cache:   {:7.1f}".format(warmSecs[0] or float('nan')))
+    print("per-node install secs, warm cache:   {:7.1f}  (n={})".format(cached, len(cachedSecs)))
+    print("per-node install secs saved:         {:7.1f}  ({:.0%})".format(direct - cached, (direct - cached) / direct))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Benchmark the doutils command: each command run in-process (a fresh
+# python, importing doUtils, a new API session and ssh connection each
+# time) against the same command answered by the daemon.
+# Exercises:
+#    doUtils/cli.py and doUtils/daemon.py: ls, images, exec, put, get
+#
+# Runs against a fake Digital Ocean API (fakeDoApi.py, with --latency
+# added to each request) and a local ssh server (localSshServer.py), in
+# a scratch $HOME.  Reported per command and mode are the p50 and max
+# wall-clock milliseconds of --runs runs of "python -m doUtils ...".
+# Run as:
+#
+#    python benchmarks/bench_cli.py --runs 10 --latency 0.05
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+BenchDir = os.path.dirname(os.path.abspath(__file__))
+RepoDir = os.path.dirname(BenchDir)
+sys.path.insert(0, RepoDir)
+sys.path.insert(0, BenchDir)
+import fakeDoApi          # noqa: E402
+import localSshServer     # noqa: E402
+
+logging.basicConfig(level=logging.WARNING)
+log = logging.getLogger('bench_cli')
+logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+
+
+def doutils(*args):
+    """Run the doutils command; return (seconds, stdout)."""
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-W', 'ignore', '-m', 'doUtils'] + list(args), cwd=RepoDir,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    secs = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError("doutils {} failed: {}".format(' '.join(args), proc.stderr.strip()))
+    return secs, proc.stdout
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="The doutils command, in-process vs through the daemon.")
+    parser.add_argument('--runs', type=int, default=10, help="times to run each command")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to each API request")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='bench_cli-') as home:
+        os.environ['HOME'] = home
+        os.environ['XDG_CACHE_HOME'] = os.path.join(home, 'cache')
+        os.makedirs(os.path.join(home, 'Downloads'))
+        api = fakeDoApi.FakeDoApi(latency=args.latency, actionDelay=0)
+        sshd = localSshServer.LocalSshServer()
+        os.environ['DigitalOceanApiKey'] = 'x' * 64
+        os.environ['DigitalOceanApiEndpoint'] = api.start()
+        os.environ['DIGITALOCEAN_END_POINT'] = api.endPoint
+        sshd.start()
+        port = str(sshd.port)
+        payload = os.path.join(home, 'payload.bin')
+        with open(payload, 'wb') as f:
+            f.write(os.urandom(64 * 1024))
+        try:
+            dropletId = str(json.loads(doutils('--no-daemon', 'up', '1001', '--json')[1])[0]['id'])
+            commands = [('ls', ['ls']),
+                        ('images', ['images']),
+                        ('exec', ['exec', '--port', port, dropletId, 'true']),
+                        ('put 64 kB', ['put', '--port', port, dropletId, payload, 'payload.bin']),
+                        ('get 64 kB', ['get', '--port', port, dropletId, 'payload.bin', payload + '.back'])]
+            results = {}
+            for mode in ('in-process', 'daemon'):
+                if mode == 'daemon':
+                    doutils('daemon', 'start')
+                    doutils('exec', '--port', port, dropletId, 'true')    # let it log in once
+                for name, cmd in commands:
+                    results[name, mode] = [doutils(*((['--no-daemon'] if mode == 'in-process' else []) + cmd))[0]
+                                           for _ in range(args.runs)]
+            doutils('daemon', 'stop')
+        finally:
+            sshd.stop()
+            api.stop()
+
+    print("{:<12} {:>16} {:>16} {:>12} {:>12}".format('command', 'in-process p50', 'daemon p50', 'daemon max', 'speedup'))
+    for name, _cmd in commands:
+        inProc, viaDaemon = results[name, 'in-process'], results[name, 'daemon']
+        print("{:<12} {:>13.1f} ms {:>13.1f} ms {:>9.1f} ms {:>11.1f}x".format(
+            name, statistics.median(inProc) * 1000, statistics.median(viaDaemon) * 1000, max(viaDaemon) * 1000,
+            statistics.median(inProc) / statistics.median(viaDaemon)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# Benchmark the controller's cost of watching a fleet: a Collector (one
+# channel per droplet, compressed batches, one select() thread) against
+# polling each droplet with a command every interval, as the fleet grows.
+# Exercises:
+#    from doUtils: Collector, runOnAll, SshConnPool
+#
+# The "droplets" are one local ssh server (localSshServer.py, in its own
+# process, so its CPU isn't counted) answering on 127.0.0.2, .3, ...; each
+# has a log file getting --lines-per-sec lines.  Reported per fleet size
+# are the controller's CPU (percent of one core, and ms per host per
+# second), and what arrived.  Run as:
+#
+#    python benchmarks/bench_collector.py --hosts 1,10,50 --secs 10
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+import threading
+
+BenchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BenchDir))
+sys.path.insert(0, BenchDir)
+import localSshServer     # noqa: E402
+
+logging.basicConfig(level=logging.WARNING)
+log = logging.getLogger('bench_collector')
+logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+
+LogName = 'bench.log'
+ProcFiles = '/proc/stat /proc/meminfo /proc/vmstat /proc/net/dev /proc/loadavg'
+
+
+def writeLog(fpath, linesPerSec, stopping):
+    n = 0
+    while not stopping.is_set():
+        with open(fpath, 'a') as f:
+            for _ in range(max(1, linesPerSec // 10)):
+                f.write("2018-04-01 12:00:00 INFO job: step {} done, all fine\n".format(n))
+                n += 1
+        stopping.wait(0.1)
+
+
+def cpuWhile(secs):
+    """Sleep secs; return this process's CPU seconds meanwhile."""
+    cpu = time.process_time()
+    time.sleep(secs)
+    return time.process_time() - cpu
+
+
+def benchCollector(doUtils, pool, hosts, port, outDir, args):
+    coll = doUtils.Collector(hosts, files=[LogName], outDir=outDir, user='bench', port=port,
+                             intervalSecs=args.interval, batchSecs=args.batch, pool=pool)
+    coll.start()
+    time.sleep(args.interval * 2)    # channels open, first batches in
+    before = coll.stats()
+    cpu = cpuWhile(args.secs)
+    after = coll.stats()
+    coll.stop()
+    return cpu, after['records'] - before['records'], after['wireBytes'] - before['wireBytes'], after['rawBytes'] - before['rawBytes']
+
+
+def benchPolling(doUtils, pool, hosts, port, args):
+    """Each interval, every host: cat the /proc files, and the log (the
+    by-hand way: the whole file each time)."""
+    stopping = threading.Event()
+    received = [0]
+
+    def poll():
+        while not stopping.is_set():
+            start = time.time()
+            for r in doUtils.runOnAll(hosts, "cat {} {}".format(ProcFiles, LogName),
+                                      user='bench', port=port, pool=pool, timeout=30):
+                received[0] += len(r['stdout'])
+            stopping.wait(max(0.0, args.interval - (time.time() - start)))
+
+    poller = threading.Thread(target=poll, daemon=True)
+    poller.start()
+    time.sleep(args.interval * 2)
+    received[0] = 0
+    cpu = cpuWhile(args.secs)
+    nBytes = received[0]
+    stopping.set()
+    poller.join()
+    return cpu, nBytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Controller CPU to watch a fleet: Collector vs polling.")
+    parser.add_argument('--hosts', default='1,10,50', help="fleet sizes to try")
+    parser.add_argument('--secs', type=float, default=10.0, help="measuring time per fleet size")
+    parser.add_argument('--interval', type=float, default=1.0, help="seconds between samples/polls")
+    parser.add_argument('--batch', type=float, default=2.0, help="Collector's seconds between batches")
+    parser.add_argument('--lines-per-sec', type=int, default=100, help="log lines written per second")
+    parser.add_argument('--no-polling', action='store_true', help="skip the polling comparison")
+    args = parser.parse_args(argv)
+
+    import doUtils
+    server, port, root = localSshServer.spawn('--host', '0.0.0.0')
+    stopping = threading.Event()
+    writer = threading.Thread(target=writeLog, args=(os.path.join(root, LogName), args.lines_per_sec, stopping), daemon=True)
+    writer.start()
+    try:
+        print("{:>6} {:>10} {:>8} {:>10} {:>8} {:>10} {:>7}".format('hosts', 'method', 'CPU %', 'ms/host/s', 'rec/s', 'KB/s wire', 'zlib x'))
+        for nHosts in [int(n) for n in args.hosts.split(',')]:
+            hosts = ['127.0.0.{}'.format(i + 2) for i in range(nHosts)]
+            pool = doUtils.SshConnPool()
+            for h in hosts:    # the server takes any password; the pool then has the connections
+                pool.get(h, 'bench', passwd='x', port=port)
+            with tempfile.TemporaryDirectory(prefix='bench_collector-') as outDir:
+                cpu, nRecs, wire, raw = benchCollector(doUtils, pool, hosts, port, outDir, args)
+            print("{:6d} {:>10} {:8.2f} {:10.3f} {:8.0f} {:10.1f} {:7.1f}".format(
+                nHosts, 'collector', 100 * cpu / args.secs, 1000 * cpu / args.secs / nHosts, nRecs / args.secs, wire / 1024 / args.secs,
+                raw / max(wire, 1)))
+            if not args.no_polling:
+                cpu, nBytes = benchPolling(doUtils, pool, hosts, port, args)
+                print("{:6d} {:>10} {:8.2f} {:10.3f} {:>8} {:10.1f} {:>7}".format(
+                    nHosts, 'polling', 100 * cpu / args.secs, 1000 * cpu / args.secs / nHosts, '-', nBytes / 1024 / args.secs, '-'))
+            pool.closeAll()
+    finally:
+        stopping.set()
+        server.kill()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
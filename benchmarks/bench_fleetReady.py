@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# Benchmark bringing a fleet to ready: the serial way (isUp(), SshConn,
+# waitUntilCloudInitDone() per droplet, in turn) against waitForFleet()
+# (all droplets at once, from one event loop).
+# Exercises:
+#    from doUtils: waitForFleet isUp waitUntilCloudInitDone SshConnPool
+#
+# The "droplets" are one local ssh server (localSshServer.py, in its own
+# process) answering on 127.0.0.2, .3, ...; its cloud-init finishes
+# --cloud-init-delay seconds after it starts.  Reported per method are
+# the seconds (from the server starting) until the first, the
+# --min-ready'th, and the last droplet was ready.  Run as:
+#
+#    python benchmarks/bench_fleetReady.py --hosts 20 --cloud-init-delay 5
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+BenchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BenchDir))
+sys.path.insert(0, BenchDir)
+import localSshServer     # noqa: E402
+
+logging.basicConfig(level=logging.WARNING)
+log = logging.getLogger('bench_fleetReady')
+logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+
+
+def serial(doUtils, hosts, port, pool, start):
+    """Ready one droplet after another; return seconds until each was."""
+    readySecs = []
+    for h in hosts:
+        assert doUtils.isUp(h, port=port, nTries=7)
+        sConn = pool.get(h, 'bench', port=port)
+        assert doUtils.waitUntilCloudInitDone(sConn)['done']
+        readySecs.append(time.time() - start)
+    return readySecs
+
+
+def together(doUtils, hosts, port, pool, start):
+    """waitForFleet(); return seconds until each was ready."""
+    status = doUtils.waitForFleet(hosts, user='bench', port=port, pool=pool, pollSecs=0.5)
+    return sorted(time.time() - start - status['secs'] + secs for secs in status['readySecs'].values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serial readiness checks vs waitForFleet().")
+    parser.add_argument('--hosts', type=int, default=20, help="droplets in the fleet")
+    parser.add_argument('--min-ready', type=int, default=None, help="how many to report the time to (default: 3/4)")
+    parser.add_argument('--cloud-init-delay', type=float, default=5.0, help="seconds until cloud-init is done")
+    args = parser.parse_args(argv)
+    minReady = args.min_ready or max(1, args.hosts * 3 // 4)
+
+    import doUtils
+    hosts = ['127.0.0.{}'.format(i + 2) for i in range(args.hosts)]
+    print("{:>14} {:>10} {:>10} {:>10}".format('method', 'first s', '{} ready s'.format(minReady), 'all s'))
+    for name, fn in (('serial', serial), ('waitForFleet', together)):
+        start = time.time()
+        server, port, _root = localSshServer.spawn('--host', '0.0.0.0', '--cloud-init-delay', str(args.cloud_init_delay))
+        pool = doUtils.SshConnPool()
+        try:
+            for h in hosts:    # the server takes any password; the pool then has the connections
+                pool.get(h, 'bench', passwd='x', port=port)
+            readySecs = fn(doUtils, hosts, port, pool, start)
+        finally:
+            pool.closeAll()
+            server.kill()
+        print("{:>14} {:10.2f} {:10.2f} {:10.2f}".format(name, readySecs[0], readySecs[minReady - 1], readySecs[-1]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+# Benchmark how long "import doUtils" takes, using python -X importtime.
+#
+# Each statement is run in a few fresh interpreters; reported is the
+# median of the cumulative microseconds spent importing doUtils
+# modules (and whatever they pulled in).  Run as:
+#
+#    python benchmarks/bench_importTime.py
+#    python benchmarks/bench_importTime.py --threshold-ms 50
+#
+# Exits nonzero if "import doUtils" takes longer than the threshold,
+# or if it drags in any of the heavy packages.
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+RepoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Packages that "import doUtils" alone shouldn't load.
+HeavyModules = ['digitalocean', 'paramiko', 'cryptography', 'yaml']
+
+# Statements to time.  The second is what a simple CLI listing pays
+# before it talks to the API.
+Stmts = ["import doUtils",
+         "import doUtils; doUtils.myDroplets"]
+
+DefaultThresholdMs = 50
+
+
+def runPython(stmt, *xOpts):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([RepoDir] + [p for p in [env.get('PYTHONPATH')] if p])
+    xArgs = [a for x in xOpts for a in ('-X', x)]
+    return subprocess.run([sys.executable] + xArgs + ['-c', stmt], cwd=RepoDir, env=env,
+                          check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+
+def importTimeUs(stmt="import doUtils", nRuns=5):
+    """Median, over nRuns fresh interpreters, of the cumulative
+    microseconds spent in doUtils' top-level imports while running stmt."""
+    times = []
+    for _ in range(nRuns):
+        proc = runPython(stmt, 'importtime')
+        total = 0
+        for line in proc.stderr.splitlines():
+            # 'import time:  self [us] | cumulative | imported package'
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _self, cumulative, name = line[len('import time:'):].split('|')
+            if name.startswith(' doUtils'):    # top level only, not nested
+                total += int(cumulative)
+        times.append(total)
+    return statistics.median(times)
+
+
+def heavyModulesLoaded(stmt="import doUtils"):
+    """Which of HeavyModules are in sys.modules after running stmt."""
+    proc = runPython(stmt + "; import sys, json; print(json.dumps(sorted(sys.modules)))")
+    loaded = json.loads(proc.stdout.splitlines()[-1])
+    return [m for m in HeavyModules if m in loaded]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time 'import doUtils' with -X importtime.")
+    parser.add_argument('--threshold-ms', type=float, default=DefaultThresholdMs, help="fail if 'import doUtils' takes longer")
+    parser.add_argument('--runs', type=int, default=5, help="fresh interpreters per statement")
+    args = parser.parse_args(argv)
+
+    for stmt in Stmts:
+        print("{:40} {:8.1f} ms".format(stmt, importTimeUs(stmt, args.runs) / 1000))
+    failed = False
+    importMs = importTimeUs(Stmts[0], args.runs) / 1000
+    if importMs > args.threshold_ms:
+        print("REGRESSION: 'import doUtils' took {:.1f} ms > {:.1f} ms".format(importMs, args.threshold_ms))
+        failed = True
+    heavy = heavyModulesLoaded()
+    if heavy:
+        print("REGRESSION: 'import doUtils' loaded {}".format(", ".join(heavy)))
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
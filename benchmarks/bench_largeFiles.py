@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Benchmark big-file transfers: SshConn's put/get against putLarge/getLarge
+# (mmap'd reads; preallocated, in-place writes).
+# Exercises:
+#    from doUtils: SshConn put get putLarge getLarge
+#
+# The ssh server (localSshServer.py) runs as a separate process, so the
+# CPU time measured -- this process's, all threads -- is the
+# controller's alone.  Reported per method are the throughput and the
+# CPU-seconds per GB moved (best of --repeats).  Run as:
+#
+#    python benchmarks/bench_largeFiles.py --size-mb 512
+
+import os
+import sys
+import time
+import logging
+import argparse
+import tempfile
+
+BenchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BenchDir))
+sys.path.insert(0, BenchDir)
+import localSshServer     # noqa: E402
+
+logging.basicConfig(level=logging.WARNING)
+log = logging.getLogger('bench_largeFiles')
+logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+
+
+def measure(fn, *args):
+    """Run fn(*args); return (wall seconds, CPU seconds)."""
+    wall, cpu = time.perf_counter(), time.process_time()
+    fn(*args)
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="put/get vs putLarge/getLarge: throughput and controller CPU per GB.")
+    parser.add_argument('--size-mb', type=int, default=256, help="size of the file moved")
+    parser.add_argument('--repeats', type=int, default=3, help="runs of each method (best is reported)")
+    args = parser.parse_args(argv)
+
+    import doUtils
+    server, port, _root = localSshServer.spawn()
+    try:
+        with tempfile.TemporaryDirectory(prefix='bench_largeFiles-') as workDir:
+            localFpath = os.path.join(workDir, 'payload.bin')
+            with open(localFpath, 'wb') as f:
+                for _ in range(args.size_mb):
+                    f.write(os.urandom(1024 * 1024))
+            sConn = doUtils.SshConn('127.0.0.1', 'bench', passwd='x', port=port)
+            remoteFpath = 'payload{}.bin'.format(os.getpid())
+            methods = [('put', sConn.put, localFpath, remoteFpath),
+                       ('putLarge', sConn.putLarge, localFpath, remoteFpath),
+                       ('get', sConn.get, remoteFpath, localFpath + '.back'),
+                       ('getLarge', sConn.getLarge, remoteFpath, localFpath + '.back')]
+            gb = args.size_mb / 1024
+            print("{:10} {:>10} {:>12}".format('method', 'MB/s', 'CPU s/GB'))
+            for name, fn, src, dst in methods:
+                runs = [measure(fn, src, dst) for _ in range(args.repeats)]
+                wall = min(r[0] for r in runs)
+                cpu = min(r[1] for r in runs)
+                print("{:10} {:10.1f} {:12.2f}".format(name, args.size_mb / wall, cpu / gb))
+            sConn.do('rm -f {}'.format(remoteFpath))[1].channel.recv_exit_status()
+            sConn.close()
+    finally:
+        server.kill()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
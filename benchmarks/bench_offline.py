@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+# Benchmark doUtils' own overhead, offline: against a fake Digital Ocean
+# API (fakeDoApi.py) and a local ssh server (localSshServer.py), so no
+# account, droplets, or network are needed, and runs are repeatable.
+# Exercises:
+#    from doUtils: makeUserData makeDroplet isUp SshConn
+#    waitUntilCloudInitDone runOnAll deployAgent, SshConn's do, put, get,
+#    and AgentConn's run, stat, and connecting through SshConn.forwardLocal
+#
+# Each operation is run --iterations times; reported are its p50, p90,
+# p99 and mean latency, and for put/get the throughput.  Latency,
+# rate limiting, and action and cloud-init delays can be injected, to
+# see how doUtils copes.  Run as:
+#
+#    python benchmarks/bench_offline.py --iterations 20
+#    python benchmarks/bench_offline.py --save-baseline
+#    python benchmarks/bench_offline.py --compare --tolerance 0.25
+#    python benchmarks/bench_offline.py --tuning fast
+#    python benchmarks/bench_offline.py --backend openssh
+#    python benchmarks/bench_offline.py --profile profile.json
+#
+# With --compare, exits nonzero if any operation's p50 is more than
+# tolerance slower than in the baseline file.
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import statistics
+
+BenchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BenchDir))
+sys.path.insert(0, BenchDir)
+import fakeDoApi          # noqa: E402
+import localSshServer     # noqa: E402
+
+logging.basicConfig(level=logging.WARNING)
+log = logging.getLogger('bench_offline')
+# isUp()'s port probes look like failed handshakes to the ssh server.
+logging.getLogger('paramiko.transport').setLevel(logging.CRITICAL)
+
+DefaultBaselineFpath = os.path.join(BenchDir, 'baseline.json')
+
+
+def percentile(samples, pct):
+    """
+    >>> percentile([1, 2, 3, 4], 50)
+    2.5
+    >>> percentile([5], 99)
+    5
+    """
+    samples = sorted(samples)
+    if len(samples) == 1:
+        return samples[0]
+    k = (len(samples) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(samples) - 1)
+    return samples[lo] + (samples[hi] - samples[lo]) * (k - lo)
+
+
+def summarize(samples):
+    return {'n': len(samples),
+            'p50': percentile(samples, 50),
+            'p90': percentile(samples, 90),
+            'p99': percentile(samples, 99),
+            'mean': statistics.mean(samples)}
+
+
+def timed(results, name, fn, *args, **kwargs):
+    start = time.perf_counter()
+    out = fn(*args, **kwargs)
+    results.setdefault(name, []).append(time.perf_counter() - start)
+    return out
+
+
+def runCmd(sConn, cmd):
+    """Run cmd, and wait for it to finish."""
+    _in, out, _err = sConn.do(cmd)
+    return out.channel.recv_exit_status()
+
+
+def greeter():
+    """A server, in a thread, that greets each connection and closes
+    it; returns its port."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(100)
+
+    def serve():
+        while True:
+            client, _addr = sock.accept()
+            client.sendall(b'hello\n')
+            client.close()
+    threading.Thread(target=serve, daemon=True).start()
+    return sock.getsockname()[1]
+
+
+def readGreeting(port):
+    """Connect to port, here, and read the greeting."""
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        return sock.recv(256)
+
+
+def runBenchmarks(args, workDir):
+    """Run each operation args.iterations times; return {name: [secs]}."""
+    import doUtils
+
+    api = fakeDoApi.FakeDoApi(latency=args.latency, rateLimit=args.rate_limit, actionDelay=args.action_delay)
+    sshd = localSshServer.LocalSshServer(cloudInitDelay=args.cloud_init_delay)
+    os.environ['DigitalOceanApiKey'] = 'x' * 64
+    os.environ['DigitalOceanApiEndpoint'] = api.start()
+    # For the objects python-digitalocean makes itself (eg Droplet.get_actions()'s).
+    os.environ['DIGITALOCEAN_END_POINT'] = api.endPoint
+    sshd.start()
+
+    payloadFpath = os.path.join(workDir, 'payload.bin')
+    with open(payloadFpath, 'wb') as f:
+        f.write(os.urandom(args.file_mb * 1024 * 1024))
+
+    backendArgs = {}
+    if args.backend == 'openssh':
+        # The server's host key is new each run; keep it out of known_hosts.
+        backendArgs['sshOptions'] = {'UserKnownHostsFile': '/dev/null', 'StrictHostKeyChecking': 'no', 'LogLevel': 'ERROR'}
+
+    pool = doUtils.SshConnPool(tuning=args.tuning, backend=args.backend)
+    agentPids = set()
+    greeterPort = greeter()
+    results = {}
+    try:
+        for i in range(args.iterations):
+            sshd.resetCloudInit()
+            uData, uKeys = timed(results, 'makeUserData', doUtils.makeUserData, sudoUserKeys=[])
+            dParms = timed(results, 'makeDroplet', doUtils.makeDroplet, '1001', sudoUserKeys=uKeys, userData=uData)
+            assert timed(results, 'isUp', doUtils.isUp, dParms['ip address'], port=sshd.port)
+            sConn = timed(results, 'SshConn', doUtils.SshConn, dParms['ip address'], dParms['username'],
+                          keyFname=dParms['pemFilePathname'], port=sshd.port, tuning=args.tuning, backend=args.backend, **backendArgs)
+            with sConn:
+                assert timed(results, 'waitUntilCloudInitDone', doUtils.waitUntilCloudInitDone, sConn)['done']
+                for _ in range(args.commands):
+                    timed(results, 'do', runCmd, sConn, 'true')
+                timed(results, 'put', sConn.put, payloadFpath, 'payload{}.bin'.format(i))
+                timed(results, 'get', sConn.get, 'payload{}.bin'.format(i), payloadFpath + '.back')
+                with timed(results, 'deployAgent', doUtils.deployAgent, sConn) as agent:    # in the server's root
+                    agentPids.add(agent.ping()['pid'])
+                    for _ in range(args.commands):
+                        timed(results, 'agent run', agent.run, 'true')
+                        timed(results, 'agent stat', agent.stat, ['payload{}.bin'.format(i)])
+                for name, warm in (('tunnel connect', 0), ('tunnel connect, warm', 2)):
+                    with sConn.forwardLocal(0, remotePort=greeterPort, warm=warm) as tunnel:
+                        for _ in range(args.commands):
+                            if warm:
+                                time.sleep(0.01)    # let it top up
+                            timed(results, name, readGreeting, tunnel.localPort)
+            fleet = [dParms] * args.fanout
+            timed(results, 'runOnAll x{}'.format(args.fanout), lambda: list(doUtils.runOnAll(fleet, 'true', port=sshd.port, pool=pool)))
+            dParms['droplet'].destroy()
+    finally:
+        for pid in agentPids:
+            os.kill(pid, signal.SIGTERM)
+        sshd.stop()
+        api.stop()
+    log.warning("fake API: {}".format(api.stats()))
+    return results
+
+
+def report(stats, fileMb):
+    print("{:24} {:>5} {:>10} {:>10} {:>10} {:>10}".format('operation', 'n', 'p50 ms', 'p90 ms', 'p99 ms', 'mean ms'))
+    for name, s in stats.items():
+        line = "{:24} {:5d} {:10.2f} {:10.2f} {:10.2f} {:10.2f}".format(name, s['n'], s['p50'] * 1000, s['p90'] * 1000, s['p99'] * 1000, s['mean'] * 1000)
+        if name in ('put', 'get'):
+            line += "   {:.1f} MB/s".format(fileMb / s['p50'])
+        print(line)
+
+
+def compare(stats, baseline, tolerance):
+    """
+    Returns : list of string
+        The operations whose p50 is more than tolerance slower than the
+        baseline's.
+
+    >>> compare({'do': {'p50': 1.3}}, {'do': {'p50': 1.0}}, 0.25)
+    ['do']
+    >>> compare({'do': {'p50': 1.2}}, {'do': {'p50': 1.0}, 'put': {'p50': 1.0}}, 0.25)
+    []
+    """
+    regressed = []
+    for name, s in stats.items():
+        if name in baseline and s['p50'] > baseline[name]['p50'] * (1 + tolerance):
+            regressed.append(name)
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="doUtils' overhead per operation, against a fake API and a local ssh server.")
+    parser.add_argument('--iterations', type=int, default=10, help="droplets to 'make' and use")
+    parser.add_argument('--commands', type=int, default=20, help="commands run per droplet")
+    parser.add_argument('--fanout', type=int, default=20, help="hosts (all the same one) for runOnAll")
+    parser.add_argument('--file-mb', type=int, default=8, help="size of the file put and got")
+    parser.add_argument('--backend', default='paramiko', help="ssh backend: paramiko or openssh")
+    parser.add_argument('--tuning', default=None, help="ssh tuning profile (see doUtils/sshTuning.py)")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to each API request")
+    parser.add_argument('--rate-limit', type=int, default=None, help="API requests allowed per second")
+    parser.add_argument('--action-delay', type=float, default=0.0, help="seconds until a droplet's create action completes")
+    parser.add_argument('--cloud-init-delay', type=float, default=0.0, help="seconds until cloud-init 'finishes'")
+    parser.add_argument('--baseline', default=DefaultBaselineFpath, help="baseline file for --save-baseline and --compare")
+    parser.add_argument('--save-baseline', action='store_true', help="save this run's results as the baseline")
+    parser.add_argument('--compare', action='store_true', help="compare this run's results with the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="fraction slower than baseline that counts as a regression")
+    parser.add_argument('--profile', default=None, help="profile doUtils' entry points (see doUtils/profiling.py), "
+                        "print the totals, and save them in this file (adds some overhead)")
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        from doUtils import profiling
+        profiling.enable()
+
+    with tempfile.TemporaryDirectory(prefix='bench_offline-') as workDir:
+        # Key files go in $HOME/Downloads (see keypair.py); keep them out of the real one.
+        os.environ['HOME'] = workDir
+        os.makedirs(os.path.join(workDir, 'Downloads'))
+        results = runBenchmarks(args, workDir)
+    stats = {name: summarize(samples) for name, samples in results.items()}
+    report(stats, args.file_mb)
+    if args.profile:
+        profiling.disable()
+        print(profiling.report())
+        profiling.writeJson(args.profile)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(stats, f, indent=1, sort_keys=True)
+        print("baseline saved in {}".format(args.baseline))
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressed = compare(stats, baseline, args.tolerance)
+        for name in regressed:
+            print("REGRESSION: {} p50 {:.2f} ms vs baseline {:.2f} ms".format(name, stats[name]['p50'] * 1000, baseline[name]['p50'] * 1000))
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+
+# A local stand-in for the Digital Ocean REST API, for benchmarking
+# doUtils without an account, droplets, or network.
+#
+# It keeps droplets, keys, tags, volumes, snapshots and actions in memory, and serves the
+# subset of the v2 API that python-digitalocean uses for doUtils'
+# operations.  Knobs:
+#
+#    latency -- seconds added to every request
+#    rateLimit -- requests allowed per second (beyond that, 429s, as
+#        the real API does per hour)
+#    actionDelay -- seconds until a droplet's create action completes
+#    dropletIp -- the address every droplet gets (eg that of a local
+#        ssh server, see localSshServer.py)
+#
+# Point doUtils at it with the DigitalOceanApiEndpoint environment
+# variable (see utils.getApiEndpoint()).  Run standalone as:
+#
+#    python benchmarks/fakeDoApi.py --port 8080 --latency 0.05
+
+import re
+import sys
+import json
+import time
+import uuid
+import argparse
+import datetime
+import threading
+import itertools
+import http.server
+import urllib.parse
+
+DistroImages = [
+    {'id': 1001, 'name': '16.04.4 x64', 'distribution': 'Ubuntu', 'slug': 'ubuntu-16-04-x64'},
+    {'id': 1002, 'name': '18.04 x64', 'distribution': 'Ubuntu', 'slug': 'ubuntu-18-04-x64'},
+    {'id': 1003, 'name': '9 x64', 'distribution': 'Debian', 'slug': 'debian-9-x64'},
+]
+Regions = ['nyc1', 'nyc3', 'sfo2', 'ams3', 'lon1', 'fra1', 'sgp1', 'tor1', 'blr1']
+Sizes = [
+    {'slug': '512mb', 'memory': 512, 'vcpus': 1, 'disk': 20, 'transfer': 1.0, 'price_monthly': 5.0, 'price_hourly': 0.00744},
+    {'slug': 's-2vcpu-4gb', 'memory': 4096, 'vcpus': 2, 'disk': 80, 'transfer': 4.0, 'price_monthly': 20.0, 'price_hourly': 0.02976},
+    {'slug': 'c-8', 'memory': 16384, 'vcpus': 8, 'disk': 100, 'transfer': 6.0, 'price_monthly': 160.0, 'price_hourly': 0.238},
+]
+
+
+def isoNow():
+    return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class FakeDoState:
+    """What the fake API knows: droplets, keys, tags, volumes, snapshots, actions."""
+
+    def __init__(self, actionDelay=1.0, dropletIp='127.0.0.1', rateLimit=None):
+        self.actionDelay = actionDelay
+        self.dropletIp = dropletIp
+        self.rateLimit = rateLimit
+        self.ids = itertools.count(5000)
+        self.droplets = {}
+        self.keys = {}
+        self.actions = {}
+        self.tags = set()
+        self.volumes = {}
+        self.snapshots = {}
+        self.lock = threading.Lock()
+        self.requestTimes = []
+        self.nRequests = 0
+        self.nRateLimited = 0
+
+    def overRateLimit(self):
+        """Count a request; is it one too many for this second?"""
+        with self.lock:
+            self.nRequests += 1
+            if not self.rateLimit:
+                return False
+            now = time.time()
+            self.requestTimes = [t for t in self.requestTimes if now - t < 1.0]
+            if len(self.requestTimes) >= self.rateLimit:
+                self.nRateLimited += 1
+                return True
+            self.requestTimes.append(now)
+            return False
+
+    def actionJson(self, action):
+        done = time.time() - action['started'] >= action['delay']
+        return {'id': action['id'], 'status': 'completed' if done else 'in-progress', 'type': action['type'],
+                'started_at': action['started_at'], 'completed_at': isoNow() if done else None,
+                'resource_id': action['resource_id'], 'resource_type': 'droplet', 'region_slug': 'sfo2'}
+
+    def dropletJson(self, d):
+        createAction = self.actions[d['createAction']]
+        active = time.time() - createAction['started'] >= createAction['delay']
+        networks = {'v4': [], 'v6': []}
+        if active:
+            networks['v4'] = [{'ip_address': self.dropletIp, 'type': 'public', 'netmask': '255.255.255.0', 'gateway': ''},
+                              {'ip_address': '10.0.0.{}'.format(d['id'] % 250 + 2), 'type': 'private', 'netmask': '255.255.0.0', 'gateway': ''}]
+        return {'id': d['id'], 'name': d['name'], 'memory': 512, 'vcpus': 1, 'disk': 20, 'locked': False,
+                'status': 'active' if active else 'new', 'created_at': d['created_at'],
+                'features': [], 'backup_ids': [], 'snapshot_ids': [], 'volume_ids': d['volumes'],
+                'image': {'id': d['image']}, 'size_slug': d['size'], 'region': {'slug': d['region']},
+                'networks': networks, 'tags': sorted(d['tags']), 'kernel': None, 'next_backup_window': None}
+
+    def volumeJson(self, v):
+        return dict(v, tags=sorted(v['tags']),
+                    droplet_ids=[d['id'] for d in self.droplets.values() if v['id'] in d['volumes']])
+
+    def newAction(self, resourceId, type, delay):
+        action = {'id': next(self.ids), 'type': type, 'resource_id': resourceId,
+                  'started': time.time(), 'started_at': isoNow(), 'delay': delay}
+        self.actions[action['id']] = action
+        return action
+
+
+class FakeDoHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=None, headers=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def readBody(self):
+        n = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(n) if n else b''
+        try:
+            return json.loads(raw.decode('utf-8')) if raw else {}
+        except ValueError:
+            return {}
+
+    def handle(self):
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        server = self.server
+        url = urllib.parse.urlparse(self.path)
+        path = url.path.rstrip('/')
+        query = urllib.parse.parse_qs(url.query)
+        body = self.readBody() if method in ('POST', 'DELETE') else {}
+        time.sleep(server.latency)
+        state = server.state
+        if state.overRateLimit():
+            self.reply(429, {'id': 'too_many_requests', 'message': 'API Rate limit exceeded.'},
+                       {'Ratelimit-Limit': str(state.rateLimit), 'Ratelimit-Remaining': '0', 'Ratelimit-Reset': str(int(time.time()) + 1)})
+            return
+        with state.lock:
+            status, reply = self.route(state, method, path, query, body)
+        self.reply(status, reply, {'Ratelimit-Limit': str(state.rateLimit or 5000), 'Ratelimit-Remaining': '4999'})
+
+    def route(self, state, method, path, query, body):
+        m = re.match(r'^/v2/(.*)$', path)
+        if not m:
+            return 404, {'id': 'not_found', 'message': 'The resource you were accessing could not be found.'}
+        parts = m.group(1).split('/')
+        notFound = (404, {'id': 'not_found', 'message': 'The resource you were accessing could not be found.'})
+
+        if parts == ['account', 'keys'] and method == 'POST':
+            key = {'id': next(state.ids), 'name': body.get('name'), 'public_key': body.get('public_key'), 'fingerprint': '00:00'}
+            state.keys[key['id']] = key
+            return 201, {'ssh_key': key}
+        if parts == ['account', 'keys'] and method == 'GET':
+            return 200, {'ssh_keys': list(state.keys.values()), 'links': {}, 'meta': {'total': len(state.keys)}}
+        if len(parts) == 3 and parts[:2] == ['account', 'keys'] and method == 'DELETE':
+            return (204, None) if state.keys.pop(int(parts[2]), None) else notFound
+
+        if parts == ['droplets'] and method == 'POST':
+            d = {'id': next(state.ids), 'name': body.get('name'), 'image': body.get('image'), 'size': body.get('size'),
+                 'region': body.get('region'), 'tags': set(body.get('tags') or []), 'volumes': body.get('volumes') or [],
+                 'created_at': isoNow()}
+            action = state.newAction(d['id'], 'create', state.actionDelay)
+            d['createAction'] = action['id']
+            d['actionIds'] = [action['id']]
+            state.droplets[d['id']] = d
+            return 202, {'droplet': state.dropletJson(d),
+                         'links': {'actions': [{'id': action['id'], 'rel': 'create', 'href': ''}]}}
+        if parts == ['droplets'] and method == 'GET':
+            tag = query.get('tag_name', [None])[0]
+            ds = [state.dropletJson(d) for d in state.droplets.values() if tag is None or tag in d['tags']]
+            return 200, {'droplets': ds, 'links': {}, 'meta': {'total': len(ds)}}
+        if parts == ['droplets'] and method == 'DELETE':
+            tag = query.get('tag_name', [None])[0]
+            for dId in [i for i, d in state.droplets.items() if tag in d['tags']]:
+                del state.droplets[dId]
+            return 204, None
+        if len(parts) >= 2 and parts[0] == 'droplets':
+            d = state.droplets.get(int(parts[1]))
+            if d is None:
+                return notFound
+            if len(parts) == 2 and method == 'GET':
+                return 200, {'droplet': state.dropletJson(d)}
+            if len(parts) == 2 and method == 'DELETE':
+                del state.droplets[d['id']]
+                return 204, None
+            if parts[2:] == ['actions'] and method == 'GET':
+                return 200, {'actions': [state.actionJson(state.actions[a]) for a in d['actionIds']], 'links': {}, 'meta': {'total': len(d['actionIds'])}}
+            if parts[2:] == ['actions'] and method == 'POST':
+                action = state.newAction(d['id'], body.get('type', 'unknown'), 0)
+                d['actionIds'].append(action['id'])
+                return 201, {'action': state.actionJson(action)}
+            if len(parts) == 4 and parts[2] == 'actions' and method == 'GET':
+                action = state.actions.get(int(parts[3]))
+                return (200, {'action': state.actionJson(action)}) if action else notFound
+        if len(parts) == 2 and parts[0] == 'actions' and method == 'GET':
+            action = state.actions.get(int(parts[1]))
+            return (200, {'action': state.actionJson(action)}) if action else notFound
+
+        if parts == ['volumes'] and method == 'POST':
+            snapshot = state.snapshots.get(body.get('snapshot_id'))
+            if not body.get('size_gigabytes'):
+                return 422, {'id': 'unprocessable_entity', 'message': 'size_gigabytes is required'}
+            if body.get('snapshot_id') and snapshot is None:
+                return 422, {'id': 'unprocessable_entity', 'message': 'snapshot {} not found'.format(body['snapshot_id'])}
+            if snapshot is not None and body['size_gigabytes'] < snapshot['min_disk_size']:
+                return 422, {'id': 'unprocessable_entity', 'message': 'size_gigabytes is smaller than the snapshot'}
+            v = {'id': str(uuid.uuid4()), 'name': body.get('name'), 'region': {'slug': body.get('region')},
+                 'size_gigabytes': body.get('size_gigabytes'), 'description': body.get('description'),
+                 'filesystem_type': body.get('filesystem_type') or (snapshot or {}).get('filesystem_type'),
+                 'snapshot_id': body.get('snapshot_id'), 'tags': set(body.get('tags') or []), 'created_at': isoNow()}
+            state.volumes[v['id']] = v
+            return 201, {'volume': state.volumeJson(v)}
+        if parts == ['volumes'] and method == 'GET':
+            region = query.get('region', [None])[0]
+            vs = [state.volumeJson(v) for v in state.volumes.values() if region is None or v['region']['slug'] == region]
+            return 200, {'volumes': vs, 'links': {}, 'meta': {'total': len(vs)}}
+        if len(parts) >= 2 and parts[0] == 'volumes':
+            v = state.volumes.get(parts[1])
+            if v is None:
+                return notFound
+            if len(parts) == 2 and method == 'GET':
+                return 200, {'volume': state.volumeJson(v)}
+            if len(parts) == 2 and method == 'DELETE':
+                if state.volumeJson(v)['droplet_ids']:
+                    return 409, {'id': 'conflict', 'message': 'volume is attached to a droplet'}
+                del state.volumes[v['id']]
+                return 204, None
+            if parts[2:] == ['snapshots'] and method == 'POST':
+                snap = {'id': str(uuid.uuid4()), 'name': body.get('name'), 'resource_id': v['id'], 'resource_type': 'volume',
+                        'min_disk_size': v['size_gigabytes'], 'size_gigabytes': 0, 'filesystem_type': v['filesystem_type'],
+                        'regions': [v['region']['slug']], 'created_at': isoNow()}
+                state.snapshots[snap['id']] = snap
+                return 201, {'snapshot': snap}
+        if len(parts) == 2 and parts[0] == 'snapshots' and method == 'GET':
+            snap = state.snapshots.get(parts[1])
+            return (200, {'snapshot': snap}) if snap else notFound
+
+        if parts == ['images'] and method == 'GET':
+            imgType = query.get('type', [None])[0]
+            private = query.get('private', [None])[0] == 'true'
+            images = [] if private or imgType == 'application' else DistroImages
+            images = [dict(i, type='snapshot', public=True, regions=Regions, min_disk_size=20, created_at=isoNow()) for i in images]
+            return 200, {'images': images, 'links': {}, 'meta': {'total': len(images)}}
+        if len(parts) == 2 and parts[0] == 'images' and method == 'GET':
+            for i in DistroImages:
+                if str(i['id']) == parts[1] or i['slug'] == parts[1]:
+                    return 200, {'image': dict(i, regions=Regions)}
+            return notFound
+        if parts == ['regions'] and method == 'GET':
+            regions = [{'slug': r, 'name': r, 'available': True, 'sizes': [s['slug'] for s in Sizes], 'features': ['private_networking']} for r in Regions]
+            return 200, {'regions': regions, 'links': {}, 'meta': {'total': len(regions)}}
+        if parts == ['sizes'] and method == 'GET':
+            sizes = [dict(s, regions=Regions, available=True) for s in Sizes]
+            return 200, {'sizes': sizes, 'links': {}, 'meta': {'total': len(sizes)}}
+
+        if parts == ['tags'] and method == 'GET':
+            names = state.tags.union(*(d['tags'] for d in state.droplets.values()))
+            tags = [{'name': n, 'resources': {'count': sum(n in d['tags'] for d in state.droplets.values())}} for n in sorted(names)]
+            return 200, {'tags': tags, 'links': {}, 'meta': {'total': len(tags)}}
+        if parts == ['tags'] and method == 'POST':
+            state.tags.add(body.get('name'))
+            return 201, {'tag': {'name': body.get('name'), 'resources': {}}}
+        if len(parts) == 2 and parts[0] == 'tags' and method == 'DELETE':
+            state.tags.discard(parts[1])
+            for d in state.droplets.values():
+                d['tags'].discard(parts[1])
+            return 204, None
+        if len(parts) == 3 and parts[0] == 'tags' and parts[2] == 'resources' and method in ('POST', 'DELETE'):
+            for r in body.get('resources', []):
+                d = state.droplets.get(int(r['resource_id']))
+                if d is not None:
+                    (d['tags'].add if method == 'POST' else d['tags'].discard)(parts[1])
+            return 204, None
+
+        return notFound
+
+
+class FakeDoApi:
+    """
+    The fake API server, run in a background thread.
+
+    Operations:
+        start -- start serving; returns the endpoint URL
+        stop
+        stats -- how many requests, how many rate-limited
+    """
+
+    def __init__(self, port=0, latency=0.0, rateLimit=None, actionDelay=1.0, dropletIp='127.0.0.1'):
+        self.state = FakeDoState(actionDelay=actionDelay, dropletIp=dropletIp, rateLimit=rateLimit)
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), FakeDoHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = self.state
+        self.httpd.latency = latency
+        self.thread = None
+
+    @property
+    def endPoint(self):
+        return "http://127.0.0.1:{}/v2/".format(self.httpd.server_address[1])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.endPoint
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        return {'requests': self.state.nRequests, 'rateLimited': self.state.nRateLimited}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="A local stand-in for the Digital Ocean API.")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to each request")
+    parser.add_argument('--rate-limit', type=int, default=None, help="requests allowed per second")
+    parser.add_argument('--action-delay', type=float, default=1.0, help="seconds until a create action completes")
+    parser.add_argument('--droplet-ip', default='127.0.0.1', help="address every droplet gets")
+    args = parser.parse_args(argv)
+    api = FakeDoApi(args.port, args.latency, args.rate_limit, args.action_delay, args.droplet_ip)
+    print("serving on {}  (export DigitalOceanApiEndpoint={})".format(api.endPoint, api.endPoint))
+    try:
+        api.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+
+# A local stand-in for a droplet's ssh server, for benchmarking doUtils
+# without droplets or network.
+#
+# It accepts any user, password or key; runs exec'd commands in a
+# scratch directory (its "root"); serves sftp within that root; and
+# connects direct-tcpip channels (ssh -L) to local ports, and listens
+# for tcpip-forward requests (ssh -R) on local ports.
+# It pretends to be a freshly made droplet running cloud-init: paths
+# under /run/cloud-init/ and /var/log/cloud-init-output.log are mapped
+# into the root, where the result.json and status.json files appear
+# cloudInitDelay seconds after the server starts (see resetCloudInit()).
+# Listening on all of 127.0.0.0/8, an address can be given its own
+# cloud-init run, which finishes with errors or never does (see
+# cloudInitErrors).
+#
+# Run standalone as:
+#
+#    python benchmarks/localSshServer.py --port 2222
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import paramiko
+
+CloudInitPaths = ['/run/cloud-init/', '/var/log/cloud-init-output.log']
+
+
+class SshServerInterface(paramiko.ServerInterface):
+    """Let anyone in, to run commands and sftp."""
+
+    def __init__(self, server):
+        self.server = server
+        self.forwards = {}      # channel id -> (host, port), for direct-tcpip channels
+        self.sessions = {}      # channel id -> channel, for sessions not yet given a command
+        self.listeners = {}     # (address, port) -> socket, for tcpip-forward requests
+        self.transport = None
+
+    def check_auth_none(self, username):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'publickey,password,none'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self.forwards[chanid] = destination
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_port_forward_request(self, address, port):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            listener.bind((address or '127.0.0.1', port))
+        except OSError:
+            return False
+        listener.listen(100)
+        port = listener.getsockname()[1]
+        self.listeners[(address, port)] = listener
+        threading.Thread(target=self.server.acceptRemoteForward, args=(self.transport, listener, address, port),
+                         daemon=True).start()
+        return port
+
+    def cancel_port_forward_request(self, address, port):
+        listener = self.listeners.pop((address, port), None)
+        if listener is not None:
+            listener.close()
+
+    def check_channel_env_request(self, channel, name, value):
+        channel.envDict = dict(getattr(channel, 'envDict', {}), **{name.decode() if isinstance(name, bytes) else name:
+                                                                   value.decode() if isinstance(value, bytes) else value})
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        cmd = command.decode('utf-8') if isinstance(command, bytes) else command
+        self.sessions.pop(channel.get_id(), None)
+        threading.Thread(target=self.server.runCommand, args=(channel, cmd), daemon=True).start()
+        return True
+
+
+class RootedSftpHandle(paramiko.SFTPHandle):
+
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+
+class RootedSftpServer(paramiko.SFTPServerInterface):
+    """sftp within the server's root directory."""
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = server.server.root
+
+    def local(self, path):
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self.local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def list_folder(self, path):
+        try:
+            out = []
+            for fname in os.listdir(self.local(path)):
+                attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(self.local(path), fname)))
+                attr.filename = fname
+                out.append(attr)
+            return out
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        path = self.local(path)
+        try:
+            fd = os.open(path, flags, getattr(attr, 'st_mode', None) or 0o666)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        f = os.fdopen(fd, mode)
+        handle = RootedSftpHandle(flags)
+        handle.filename = path
+        handle.readfile = f
+        handle.writefile = f
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self.local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self.local(oldpath), self.local(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self.local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self.local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def chattr(self, path, attr):
+        return paramiko.SFTP_OK
+
+
+class SftpSubsystem(paramiko.SFTPServer):
+    """paramiko's sftp server, plus the exit status OpenSSH's scp and
+    sftp clients wait for."""
+
+    def start_subsystem(self, name, transport, channel):
+        super().start_subsystem(name, transport, channel)
+        try:
+            channel.send_exit_status(0)
+        except (OSError, EOFError):
+            pass
+
+
+class LocalSshServer:
+    """
+    The ssh server, run in a background thread.
+
+    Operations:
+        start -- start serving; returns the port
+        stop
+        resetCloudInit -- start cloud-init's pretend run over
+    """
+
+    def __init__(self, port=0, cloudInitDelay=0.0, root=None, host='127.0.0.1'):
+        self.root = root or tempfile.mkdtemp(prefix='localSshServer-')
+        self.ownsRoot = root is None
+        self.cloudInitDelay = cloudInitDelay
+        self.cloudInitErrors = {}    # address -> the errors its own cloud-init finishes with; None: it never finishes
+        self.hostKey = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))    # eg '0.0.0.0', to answer on all of 127.0.0.0/8 (see serve())
+        self.sock.listen(100)
+        self.port = self.sock.getsockname()[1]
+        self.stopping = threading.Event()
+        self.transports = []
+        self.thread = None
+        self.resetCloudInit()
+
+    def resetCloudInit(self):
+        """Clear cloud-init's results; they'll reappear after
+        cloudInitDelay seconds."""
+        self.cloudInitDoneAt = time.time() + self.cloudInitDelay
+        ciDir = os.path.join(self.root, 'run', 'cloud-init')
+        shutil.rmtree(ciDir, ignore_errors=True)
+        shutil.rmtree(os.path.join(self.root, 'hosts'), ignore_errors=True)
+        os.makedirs(ciDir)
+        os.makedirs(os.path.join(self.root, 'var', 'log'), exist_ok=True)
+        with open(os.path.join(self.root, 'var', 'log', 'cloud-init-output.log'), 'w') as f:
+            f.write("Cloud-init v. 17.2 running 'modules:final'\n")
+
+    def cloudInitRoot(self, address):
+        """Where the cloud-init paths are mapped, for a command run
+        by a client that connected to address."""
+        if address not in self.cloudInitErrors:
+            return self.root
+        return os.path.join(self.root, 'hosts', address)
+
+    def writeCloudInitResults(self, address=None):
+        ciRoot = self.cloudInitRoot(address)
+        ciDir = os.path.join(ciRoot, 'run', 'cloud-init')
+        errors = self.cloudInitErrors.get(address, [])
+        if errors is None or time.time() < self.cloudInitDoneAt or os.path.exists(os.path.join(ciDir, 'result.json')):
+            return ciRoot
+        os.makedirs(ciDir, exist_ok=True)
+        now = time.time()
+        stage = {'errors': list(errors), 'start': now - 1.0, 'finished': now}
+        with open(os.path.join(ciDir, 'status.json'), 'w') as f:
+            json.dump({'v1': {'datasource': 'DataSourceDigitalOcean', 'stage': None, 'init': stage,
+                              'init-local': stage, 'modules-config': stage, 'modules-final': stage}}, f)
+        with open(os.path.join(ciDir, 'result.json'), 'w') as f:
+            json.dump({'v1': {'datasource': 'DataSourceDigitalOcean', 'errors': list(errors)}}, f)
+        return ciRoot
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.stopping.set()
+        self.sock.close()
+        for t in self.transports:
+            t.close()
+        if self.ownsRoot:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def serve(self):
+        while not self.stopping.is_set():
+            try:
+                client, addr = self.sock.accept()
+            except OSError:
+                break
+            if not addr[0].startswith('127.'):
+                client.close()    # only ever serve this machine
+                continue
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.hostKey)
+            transport.set_subsystem_handler('sftp', SftpSubsystem, RootedSftpServer)
+            transport.server = self
+            self.transports.append(transport)
+            interface = SshServerInterface(self)
+            interface.transport = transport
+            try:
+                transport.start_server(server=interface)
+            except (paramiko.SSHException, EOFError, OSError):
+                continue
+            threading.Thread(target=self.acceptForwards, args=(transport, interface), daemon=True).start()
+
+    def acceptForwards(self, transport, interface):
+        """Connect each direct-tcpip channel (ssh -L) to its destination."""
+        while transport.is_active() and not self.stopping.is_set():
+            channel = transport.accept(1)
+            if channel is None:
+                continue
+            destination = interface.forwards.pop(channel.get_id(), None)
+            if destination is None:
+                # A session; its exec request is handled as it comes.  Hold
+                # on to it till then: paramiko closes unreferenced channels.
+                interface.sessions[channel.get_id()] = channel
+                continue
+            try:
+                sock = socket.create_connection(destination)
+            except OSError:
+                channel.close()
+                continue
+            threading.Thread(target=self.connect, args=(channel, sock), daemon=True).start()
+
+    def acceptRemoteForward(self, transport, listener, address, port):
+        """Send each connection to a tcpip-forward's port (ssh -R) back
+        over a forwarded-tcpip channel."""
+        while transport.is_active() and not self.stopping.is_set():
+            try:
+                sock, origin = listener.accept()
+            except OSError:
+                break
+            try:
+                channel = transport.open_forwarded_tcpip_channel(origin, (address, port))
+            except (paramiko.SSHException, EOFError, OSError):
+                sock.close()
+                continue
+            threading.Thread(target=self.connect, args=(channel, sock), daemon=True).start()
+        listener.close()
+
+    @classmethod
+    def connect(cls, channel, sock):
+        """Relay between a channel and a socket, both ways, until both
+        ways have ended; then close them."""
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        inward = threading.Thread(target=cls.relay, args=(channel, sock), daemon=True)
+        inward.start()
+        cls.relay(sock, channel)
+        inward.join()
+        for end in (channel, sock):
+            try:
+                end.close()
+            except (OSError, EOFError):
+                pass
+
+    @staticmethod
+    def relay(src, dst):
+        """Copy src to dst; at src's end, half-close dst (the other way
+        may still have more to say)."""
+        try:
+            for data in iter(lambda: src.recv(65536), b''):
+                dst.sendall(data)
+            if isinstance(dst, socket.socket):
+                dst.shutdown(socket.SHUT_WR)
+            else:
+                dst.shutdown_write()
+        except (OSError, EOFError):
+            for end in (src, dst):
+                try:
+                    end.close()
+                except (OSError, EOFError):
+                    pass
+
+    @staticmethod
+    def pumpIn(channel, pipe):
+        try:
+            while True:
+                data = channel.recv(65536)
+                if not data:
+                    break
+                pipe.write(data)
+                pipe.flush()    # for commands that answer what they're sent
+        except (OSError, EOFError):
+            pass
+        finally:
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def pumpOut(pipe, send):
+        try:
+            for data in iter(lambda: pipe.read1(65536), b''):
+                send(data)
+        except (OSError, EOFError):
+            pass
+
+    def runCommand(self, channel, cmd):
+        ciRoot = self.writeCloudInitResults(channel.get_transport().sock.getsockname()[0])
+        for path in CloudInitPaths:
+            cmd = cmd.replace(path, os.path.join(ciRoot, path.lstrip('/')))
+        env = dict(os.environ, **getattr(channel, 'envDict', {}))
+        try:
+            proc = subprocess.Popen(cmd, shell=True, cwd=self.root, env=env, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            threading.Thread(target=self.pumpIn, args=(channel, proc.stdin), daemon=True).start()
+            pumps = [threading.Thread(target=self.pumpOut, args=(proc.stdout, channel.sendall)),
+                     threading.Thread(target=self.pumpOut, args=(proc.stderr, channel.sendall_stderr))]
+            for t in pumps:
+                t.start()
+            for t in pumps:
+                t.join()
+            channel.send_exit_status(proc.wait())
+        except Exception as e:
+            try:
+                channel.sendall_stderr(str(e).encode('utf-8'))
+                channel.send_exit_status(255)
+            except (OSError, EOFError):
+                pass    # the client's gone
+        finally:
+            try:
+                channel.close()
+            except (OSError, EOFError):
+                pass
+
+
+def spawn(*args):
+    """Run the server in a child process (so its CPU time isn't the
+    caller's), with command-line args.
+
+    Returns : tuple (Popen, port, root directory)
+    """
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--port', '0'] + list(args),
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    line = proc.stdout.readline()
+    m = re.search(r':(\d+) rooted at (\S+)', line)
+    if not m:
+        proc.kill()
+        raise RuntimeError("ssh server didn't start: {!r}".format(line))
+    return proc, int(m.group(1)), m.group(2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="A local stand-in for a droplet's ssh server.")
+    parser.add_argument('--port', type=int, default=2222)
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on (0.0.0.0: all loopback addresses)")
+    parser.add_argument('--cloud-init-delay', type=float, default=0.0, help="seconds until cloud-init 'finishes'")
+    args = parser.parse_args(argv)
+    # Port probes (isUp(), waitForFleet()) look like failed handshakes.
+    logging.getLogger('paramiko.transport').setLevel(logging.CRITICAL)
+    server = LocalSshServer(args.port, args.cloud_init_delay, host=args.host)
+    print("serving ssh on {}:{} rooted at {}".format(args.host, server.port, server.root), flush=True)
+    server.start()
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
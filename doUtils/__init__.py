@@ -5,14 +5,73 @@
 
 .. moduleauthor:: John Kimball <jjkimball@acm.org>
 
-This module consists of the classes and routines defined in:  cloudConfig, droplet, sshConn, and utils.
+This module consists of the classes and routines defined in:  agent, cloudConfig, collector, droplet, dropletPool, fleetReady, journal, parallelSsh, placement, reaper, remoteJob, resultCache, scheduler, sshConn, sshTuning, tunnel, utils, and volumes.
+
+The names below are imported from their submodules on first use, so
+"import doUtils" stays quick: the heavy packages (python-digitalocean,
+paramiko, cryptography, pyyaml) only get loaded when something needs
+them.
 
 (Only exercised on Unix so far.)
 """
 
-from doUtils.cloudConfig import makeUserData, waitUntilCloudInitDone
-from doUtils.droplet import isUp, myDroplets, myImages, appImages, distroImages, makeDroplet, shutdownAllDroplets, destroyAllDroplets
+import importlib
+
+# Each public name, and the submodule it lives in.
+LazyNames = {
+    'AgentConn': 'agent',
+    'deployAgent': 'agent',
+    'makeUserData': 'cloudConfig',
+    'waitUntilCloudInitDone': 'cloudConfig',
+    'Collector': 'collector',
+    'isUp': 'droplet',
+    'myDroplets': 'droplet',
+    'myImages': 'droplet',
+    'appImages': 'droplet',
+    'distroImages': 'droplet',
+    'makeDroplet': 'droplet',
+    'waitUntilReady': 'droplet',
+    'makeAptCacheDroplet': 'droplet',
+    'releaseDroplet': 'droplet',
+    'renewLease': 'droplet',
+    'resumeLaunches': 'droplet',
+    'shutdownAllDroplets': 'droplet',
+    'destroyAllDroplets': 'droplet',
+    'waitForFleet': 'fleetReady',
+    'choosePlacement': 'placement',
+    'LaunchJournal': 'journal',
+    'SshConn': 'sshConn',    # SshConn: do, get, put
+    'SshConnPool': 'sshConn',
+    'runOnAll': 'parallelSsh',
+    'summarizeResults': 'parallelSsh',
+    'RemoteJob': 'remoteJob',
+    'reap': 'reaper',
+    'formatReport': 'reaper',
+    'ResultCache': 'resultCache',
+    'runCached': 'resultCache',
+    'FleetScheduler': 'scheduler',
+    'DropletPool': 'dropletPool',
+    'SshKeypair': 'utils',
+    'getApiToken': 'utils',
+    'getManager': 'utils',
+    'getCacheDir': 'utils',
+    'ApiTokenIsMissingError': 'utils',
+    'snapshotVolume': 'volumes',
+    'destroyVolumes': 'volumes',
+}
+
+__all__ = list(LazyNames)
+
+
+def __getattr__(name):
+    try:
+        submodule = LazyNames[name]
+    except KeyError:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name)) from None
+    value = getattr(importlib.import_module(__name__ + '.' + submodule), name)
+    globals()[name] = value    # later lookups don't come through here
+    return value
 
-from doUtils.sshConn import SshConn    # SshConn: do, get, put
 
-from doUtils.utils import SshKeypair, getApiToken, getManager, ApiTokenIsMissingError
+def __dir__():
+    return sorted(set(globals()) | set(LazyNames))
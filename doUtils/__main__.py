@@ -0,0 +1,9 @@
+"""
+"python -m doUtils ..." runs the doutils command (see cli.py).
+"""
+
+import sys
+from doUtils.cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.agent
+   :platform: Unix
+   :synopsis: class AgentConn -- talk to the doUtils agent on a droplet, for quick remote operations.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+class AgentConn -- talk to the doUtils agent on a droplet, for quick remote operations.
+
+Each SshConn.do() opens a channel, starts a shell, and forks; for a job
+that does thousands of tiny remote operations, that overhead is most of
+the time.  The agent (agentServer.py) is a small long-lived server on
+the droplet.  An AgentConn talks to it over one ssh channel, opened
+once (through a relay to the agent's private Unix socket, see
+agentServer.py), with framed requests, so each operation costs a round
+trip plus well under a millisecond:
+
+EG:
+
+    uData, uKeys = makeUserData(agent=True)      # installed as a service
+    dParms = makeDroplet(imageID, sudoUserKeys=uKeys, userData=uData)
+    sConn = waitUntilReady(dParms)
+    agent = AgentConn(sConn)
+    print(agent.run('uname -a')['stdout'])
+    results = agent.batch(['./step.sh {}'.format(i) for i in range(1000)], parallel=8)
+    sizes = [st['size'] for st in agent.stat(['a.out', 'b.out'])]
+    agent.startWorker('calc', 'python3 -u calc.py')
+    answers = agent.callWorker('calc', ['1 + 2', '3 * 4'])
+
+For a droplet made without agent=True, deployAgent() copies the agent
+over and starts it.  Either SshConn backend will do, though only with
+paramiko's do AgentConn's timeouts work.
+
+"""
+
+import os
+import sys
+import time
+import shlex
+import base64
+import logging
+import threading
+from doUtils.agentServer import AgentSocketPath, RelaySource, sendFrame, recvFrame
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+AgentInstallFpath = '/usr/local/lib/doutils/agentServer.py'
+AgentUnitFpath = '/etc/systemd/system/doutils-agent.service'
+AgentUnitTpl = """[Unit]
+Description=doUtils agent
+After=network.target
+
+[Service]
+User={username}
+WorkingDirectory=~
+ExecStart=/usr/bin/python3 {installFpath} --socket {socketPath}
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+"""
+DeployedAgentFpath = '.doutils/agentServer.py'
+
+
+class AgentError(Exception):
+    message = "The agent couldn't do what was asked."
+
+
+def agentSource():
+    """agentServer.py's source, to copy to a droplet."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'agentServer.py')) as f:
+        return f.read()
+
+
+def agentUserData(username, socketPath=AgentSocketPath):
+    """What makeUserData(agent=True) adds, to install the agent as a
+    systemd service running as username.
+
+    socketPath : string
+        Where the agent listens, relative to username's home.
+
+    Returns : tuple (list of dict, list of string)
+        Files for write_files, and commands for runcmd.
+
+    >>> files, cmds = agentUserData('adminutil')
+    >>> [f['path'] for f in files]
+    ['/usr/local/lib/doutils/agentServer.py', '/etc/systemd/system/doutils-agent.service']
+    >>> 'User=adminutil' in files[1]['content'] and '--socket .doutils/agent.sock' in files[1]['content']
+    True
+    """
+    unit = AgentUnitTpl.format(username=username, installFpath=AgentInstallFpath, socketPath=shlex.quote(socketPath))
+    files = [{'path': AgentInstallFpath, 'content': agentSource(), 'permissions': '0755'},
+             {'path': AgentUnitFpath, 'content': unit}]
+    cmds = ['systemctl daemon-reload', 'systemctl enable --now doutils-agent']
+    return files, cmds
+
+###############################################################################
+
+
+class RelayedSocket:
+    """
+    The sendall() and recv() that frames need (see agentServer.py),
+    over a relay to the agent's socket, run with sConn.do().
+    """
+
+    def __init__(self, sConn, socketPath):
+        cmd = 'python3 -c {} {}'.format(shlex.quote(RelaySource), shlex.quote(socketPath))
+        self.stdin, self.stdout, self.stderr = sConn.do(cmd)
+        self.channel = self.stdout.channel
+
+    def settimeout(self, timeout):
+        if hasattr(self.channel, 'settimeout'):    # paramiko's
+            self.channel.settimeout(timeout)
+
+    def sendall(self, data):
+        self.stdin.write(data)
+        self.stdin.flush()
+
+    def recv(self, n):
+        return self.stdout.read(n)
+
+    def whyClosed(self):
+        """What the relay said, if anything, on its way out."""
+        return self.stderr.read().decode('utf-8', 'replace').strip().splitlines()[-1:]
+
+    def close(self):
+        self.channel.close()
+
+
+class AgentConn:
+    """
+    A connection to the agent on a droplet, over an ssh channel.
+
+    Operations:
+        call -- send a request, return its result
+        ping -- the agent's pid, version and uptime
+        run -- run a command
+        batch -- run many commands
+        stat -- stat paths
+        read -- read a file's bytes
+        startWorker, callWorker, stopWorker, workers -- long-lived worker processes
+        close
+    """
+
+    def __init__(self, sConn, socketPath=AgentSocketPath, timeout=None):
+        """
+        sConn : SshConn (see sshConn.py)
+            A connection to the droplet, as the agent's user.
+
+        socketPath : string
+            Where the agent listens, relative to the user's home.
+
+        timeout : number
+            Seconds to wait for any reply; None for no limit.
+            (Ignored with the openssh backend.)
+        """
+        self.channel = RelayedSocket(sConn, socketPath)
+        self.channel.settimeout(timeout)
+        self.lock = threading.Lock()
+        self.nextId = 0
+        self.broken = None      # what went wrong mid-call, after which the channel's out of step
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self.channel.close()
+
+    def call(self, op, **args):
+        """Send request op (see agentServer.py) with args; wait for its
+        reply.
+
+        Returns : its result
+
+        Raises : AgentError, if the agent couldn't do it.  If sending
+            or receiving fails (eg a timeout), the reply may yet turn
+            up, so the connection is closed, and later calls raise
+            ConnectionError; make a new AgentConn.
+        """
+        with self.lock:
+            if self.broken is not None:
+                raise ConnectionError("the connection to the agent broke earlier ({}); make a new AgentConn".format(self.broken))
+            self.nextId += 1
+            try:
+                sendFrame(self.channel, dict(args, op=op, id=self.nextId))
+                reply = recvFrame(self.channel)
+                if reply is not None and reply.get('id') != self.nextId:
+                    raise ConnectionError("the agent answered request {} with reply {}".format(self.nextId, reply.get('id')))
+            except Exception as e:
+                self.broken = "{}: {}".format(type(e).__name__, e)
+                self.channel.close()
+                raise
+        if reply is None:
+            raise EOFError("the agent closed the connection {}".format(self.channel.whyClosed()))
+        if not reply['ok']:
+            raise AgentError(reply['error'])
+        return reply['result']
+
+    def ping(self):
+        return self.call('ping')
+
+    def run(self, cmd, timeout=None, cwd=None, env=None, input=None):
+        """Run a shell command on the droplet.
+
+        input : string
+            Given to the command on stdin.
+
+        Returns : dict
+            'status' (exit status, or None if it timed out), 'stdout',
+            'stderr', 'secs', and 'error' (None, or 'timeout').
+        """
+        return self.call('run', cmd=cmd, timeout=timeout, cwd=cwd, env=env, input=input)
+
+    def batch(self, cmds, parallel=1, timeout=None, cwd=None, env=None):
+        """Run many commands, up to parallel at once, in one round trip.
+
+        Returns : list of dict
+            Their results (see run()), in order.
+        """
+        return self.call('batch', cmds=list(cmds), parallel=parallel, timeout=timeout, cwd=cwd, env=env)
+
+    def stat(self, paths):
+        """
+        Returns : list of dict
+            For each path, 'size', 'mode', 'mtime' and 'isDir'; or None
+            if it doesn't exist.
+        """
+        return self.call('stat', paths=list(paths))
+
+    def read(self, path, offset=0, length=None):
+        """
+        Returns : bytes
+            Up to length bytes (default: to the end) of the file at
+            path, from offset.
+        """
+        chunks = []
+        while True:
+            want = None if length is None else length - sum(len(c) for c in chunks)
+            if want == 0:
+                break
+            args = {'path': path, 'offset': offset} if want is None else {'path': path, 'offset': offset, 'length': want}
+            reply = self.call('read', **args)
+            data = base64.b64decode(reply['data'])
+            chunks.append(data)
+            offset += len(data)
+            if reply['eof'] or not data:
+                break
+        return b''.join(chunks)
+
+    def startWorker(self, name, cmd, cwd=None, env=None):
+        """Start a long-lived worker: cmd, taking requests as lines on
+        its stdin, and answering each with a line on its stdout (so it
+        should flush per line, eg python3 -u).
+
+        Returns : int
+            The worker's pid.
+        """
+        return self.call('startWorker', name=name, cmd=cmd, cwd=cwd, env=env)['pid']
+
+    def callWorker(self, name, lines):
+        """Send lines to worker name.
+
+        Returns : list of string
+            Its answers, one per line sent.
+        """
+        return self.call('callWorker', name=name, lines=list(lines))
+
+    def stopWorker(self, name, timeout=5):
+        """Close the worker's stdin, and wait (up to timeout seconds,
+        then kill it).
+
+        Returns : int
+            Its exit status.
+        """
+        return self.call('stopWorker', name=name, timeout=timeout)
+
+    def workers(self):
+        return self.call('workers')
+
+###############################################################################
+
+
+def pingedAgent(sConn, socketPath):
+    """An AgentConn, if the agent answers a ping."""
+    agent = AgentConn(sConn, socketPath)
+    try:
+        agent.ping()
+    except BaseException:
+        agent.close()
+        raise
+    return agent
+
+
+def deployAgent(sConn, socketPath=AgentSocketPath, timeout=20):
+    """Copy the agent to a droplet (not made with makeUserData(agent=True))
+    and start it, unless it's already running there.
+
+    sConn : SshConn (see sshConn.py)
+
+    socketPath : string
+        Where the agent listens, relative to the user's home.
+
+    Returns : AgentConn
+        Connected to the agent.
+    """
+    try:
+        return pingedAgent(sConn, socketPath)
+    except Exception as e:
+        log.info("no agent running yet: {}".format(e))
+    agentDir = shlex.quote(os.path.dirname(DeployedAgentFpath))
+    sConn.do('mkdir -p {0} && chmod 700 {0}'.format(agentDir))[1].channel.recv_exit_status()
+    sConn.put(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'agentServer.py'), DeployedAgentFpath)
+    sConn.do('nohup python3 {0} --socket {1} > {0}.log 2>&1 < /dev/null &'.format(DeployedAgentFpath, shlex.quote(socketPath)))[1].channel.recv_exit_status()
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return pingedAgent(sConn, socketPath)
+        except Exception as e:
+            if time.time() > deadline:
+                raise AgentError("the agent didn't start: {}".format(e))
+            time.sleep(0.2)
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
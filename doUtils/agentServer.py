@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.agentServer
+   :platform: Unix
+   :synopsis: The doUtils agent: a small server on a droplet that runs commands, reads files, and keeps workers, on request.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+The doUtils agent: a small server on a droplet that runs commands, reads files, and keeps workers, on request.
+
+This file is copied to droplets (see agent.py), so it uses nothing but
+python3's standard library, and imports nothing from doUtils.  It
+listens on a Unix socket, in a directory only its user can get into
+(the user's ~/.doutils by default): the agent runs commands as that
+user, who can sudo, so it mustn't take requests from anyone else on
+the droplet.  doUtils reaches it over ssh, logged in as that user, by
+running a small relay (RelaySource) that joins the ssh channel to the
+socket.  (Rather than a direct-streamlocal channel, like "ssh -L
+PORT:SOCKET", which paramiko can't open.)
+
+Requests and replies are frames: a 4-byte big-endian length, then that
+many bytes of JSON.  A request is {'id': N, 'op': NAME, ...arguments};
+its reply is {'id': N, 'ok': true, 'result': ...} or {'id': N, 'ok':
+false, 'error': "..."}.  A connection's requests are handled in order.
+The ops:
+
+    * ping -- the agent's pid, version and uptime
+    * run -- run a shell command; its status, stdout and stderr
+    * batch -- run several commands, some at once; their results
+    * stat -- stat some paths
+    * read -- bytes from a file (base64)
+    * startWorker, callWorker, stopWorker, workers -- long-lived
+      processes that take a line on stdin and answer with a line on
+      stdout, so a command's startup is paid once, not per call
+
+Run as::
+
+    python3 agentServer.py --socket .doutils/agent.sock
+
+"""
+
+import os
+import sys
+import json
+import stat
+import time
+import base64
+import struct
+import socket
+import logging
+import argparse
+import threading
+import subprocess
+import socketserver
+import concurrent.futures
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+AgentSocketPath = '.doutils/agent.sock'    # relative to the agent user's home
+Version = 2
+MaxFrameBytes = 64 * 1024 * 1024
+MaxReadBytes = 16 * 1024 * 1024
+FrameHeader = struct.Struct('>I')
+
+
+# Run over ssh, as "python3 -c RelaySource SOCKET": joins its stdin and
+# stdout to the agent's socket, until either end closes.
+RelaySource = """
+import os, sys, socket, threading
+sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+sock.connect(sys.argv[1])
+def inward():
+    while True:
+        data = os.read(0, 65536)
+        if not data:
+            break
+        sock.sendall(data)
+    sock.shutdown(socket.SHUT_WR)
+threading.Thread(target=inward, daemon=True).start()
+while True:
+    data = sock.recv(65536)
+    if not data:
+        break
+    sys.stdout.buffer.write(data)
+    sys.stdout.buffer.flush()
+"""
+
+
+def sendFrame(sock, obj):
+    """Send obj as a frame on sock (a socket, or an ssh channel)."""
+    data = json.dumps(obj).encode('utf-8')
+    sock.sendall(FrameHeader.pack(len(data)) + data)
+
+
+def recvExactly(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 1024 * 1024))
+        if not chunk:
+            if chunks:
+                raise EOFError("connection closed mid-frame")
+            return None
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+def recvFrame(sock):
+    """
+    Returns : the object in the next frame on sock, or None at the end.
+    """
+    header = recvExactly(sock, FrameHeader.size)
+    if header is None:
+        return None
+    (n,) = FrameHeader.unpack(header)
+    if n > MaxFrameBytes:
+        raise ValueError("frame of {} bytes is too big".format(n))
+    return json.loads(recvExactly(sock, n).decode('utf-8'))
+
+###############################################################################
+
+
+class Agent:
+    """
+    What the agent does for each request.
+
+    Operations:
+        handle -- a request's reply
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.workers = {}       # name -> {'proc', 'lock', 'cmd'}
+        self.workersLock = threading.Lock()
+        self.ops = {'ping': self.ping, 'run': self.run, 'batch': self.batch, 'stat': self.stat, 'read': self.read,
+                    'startWorker': self.startWorker, 'callWorker': self.callWorker, 'stopWorker': self.stopWorker,
+                    'workers': self.listWorkers}
+
+    def handle(self, request):
+        reqId = request.pop('id', None)
+        try:
+            op = self.ops[request.pop('op')]
+        except KeyError as e:
+            return {'id': reqId, 'ok': False, 'error': "no such op: {}".format(e)}
+        try:
+            return {'id': reqId, 'ok': True, 'result': op(**request)}
+        except Exception as e:
+            return {'id': reqId, 'ok': False, 'error': "{}: {}".format(type(e).__name__, e)}
+
+    def ping(self):
+        return {'pid': os.getpid(), 'version': Version, 'uptime': time.time() - self.started}
+
+    def run(self, cmd, timeout=None, cwd=None, env=None, input=None):
+        start = time.time()
+        try:
+            proc = subprocess.run(cmd, shell=True, cwd=cwd, env=dict(os.environ, **env) if env else None,
+                                  input=input.encode('utf-8') if input is not None else None,
+                                  stdin=None if input is not None else subprocess.DEVNULL,
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            return {'status': None, 'stdout': (e.stdout or b'').decode('utf-8', 'replace'),
+                    'stderr': (e.stderr or b'').decode('utf-8', 'replace'), 'secs': time.time() - start, 'error': 'timeout'}
+        return {'status': proc.returncode, 'stdout': proc.stdout.decode('utf-8', 'replace'),
+                'stderr': proc.stderr.decode('utf-8', 'replace'), 'secs': time.time() - start, 'error': None}
+
+    def batch(self, cmds, parallel=1, timeout=None, cwd=None, env=None):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+            return list(executor.map(lambda cmd: self.run(cmd, timeout=timeout, cwd=cwd, env=env), cmds))
+
+    def stat(self, paths):
+        out = []
+        for path in paths:
+            try:
+                st = os.stat(os.path.expanduser(path))
+            except OSError:
+                out.append(None)
+                continue
+            out.append({'size': st.st_size, 'mode': st.st_mode, 'mtime': st.st_mtime, 'isDir': stat.S_ISDIR(st.st_mode)})
+        return out
+
+    def read(self, path, offset=0, length=MaxReadBytes):
+        with open(os.path.expanduser(path), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            f.seek(offset)
+            data = f.read(min(length, MaxReadBytes))
+        return {'data': base64.b64encode(data).decode('ascii'), 'size': size, 'eof': offset + len(data) >= size}
+
+    def startWorker(self, name, cmd, cwd=None, env=None):
+        with self.workersLock:
+            if name in self.workers and self.workers[name]['proc'].poll() is None:
+                raise ValueError("worker {} is already running".format(name))
+            proc = subprocess.Popen(cmd, shell=True, cwd=cwd, env=dict(os.environ, **env) if env else None,
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            self.workers[name] = {'proc': proc, 'lock': threading.Lock(), 'cmd': cmd}
+        return {'pid': proc.pid}
+
+    def callWorker(self, name, lines):
+        worker = self.workers[name]
+        proc = worker['proc']
+        with worker['lock']:
+            # Fed from another thread, so a big batch can't fill both pipes and deadlock.
+            feeder = threading.Thread(target=self.feedWorker, args=(proc, lines), daemon=True)
+            feeder.start()
+            replies = []
+            for _ in lines:
+                reply = proc.stdout.readline()
+                if not reply:
+                    raise EOFError("worker {} exited (status {})".format(name, proc.wait()))
+                replies.append(reply.decode('utf-8', 'replace').rstrip('\n'))
+            feeder.join()
+        return replies
+
+    @staticmethod
+    def feedWorker(proc, lines):
+        try:
+            proc.stdin.write(b''.join(line.rstrip('\n').encode('utf-8') + b'\n' for line in lines))
+            proc.stdin.flush()
+        except OSError:
+            pass    # it exited; callWorker notices
+
+    def stopWorker(self, name, timeout=5):
+        with self.workersLock:
+            worker = self.workers.pop(name)
+        proc = worker['proc']
+        proc.stdin.close()
+        try:
+            return proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            return proc.wait()
+
+    def listWorkers(self):
+        return {name: {'pid': w['proc'].pid, 'cmd': w['cmd'], 'status': w['proc'].poll()} for name, w in self.workers.items()}
+
+###############################################################################
+
+
+class AgentHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                request = recvFrame(self.request)
+            except (OSError, EOFError, ValueError) as e:
+                log.info("dropping connection: {}".format(e))
+                return
+            if request is None:
+                return
+            try:
+                sendFrame(self.request, self.server.agent.handle(request))
+            except OSError:
+                return
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socketPath=AgentSocketPath):
+        """
+        socketPath : string
+            Where to listen.  Its directory is made if need be, and
+            kept private to this user.
+        """
+        socketDir = os.path.dirname(os.path.abspath(socketPath))
+        os.makedirs(socketDir, mode=0o700, exist_ok=True)
+        os.chmod(socketDir, 0o700)
+        if os.path.exists(socketPath):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(socketPath)
+                    raise OSError("an agent is already listening on {}".format(socketPath))
+                except ConnectionRefusedError:
+                    os.unlink(socketPath)    # left by one that died
+        oldUmask = os.umask(0o077)    # only this user can connect
+        try:
+            super().__init__(socketPath, AgentHandler)
+        finally:
+            os.umask(oldUmask)
+        self.agent = Agent()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="The doUtils agent.")
+    parser.add_argument('--socket', default=AgentSocketPath, help="where to listen (default: %(default)s)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    server = AgentServer(args.socket)
+    log.info("doUtils agent serving on {}".format(args.socket))
+    try:
+        server.serve_forever()
+    finally:
+        os.unlink(args.socket)
+    return 0
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
+    else:
+        sys.exit(main())
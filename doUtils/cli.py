@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.cli
+   :platform: Unix
+   :synopsis: The doutils command: list, make, destroy, and run things on droplets, from the shell.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+The doutils command: list, make, destroy, and run things on droplets, from the shell.
+
+Each command is sent to the doUtils daemon (see daemon.py) if one's
+running -- which answers from its warm API session, caches and pooled
+ssh connections, in milliseconds -- and otherwise done in-process, as
+a script would (with --no-daemon, always).
+
+EG:
+
+    alias doutils='python -m doUtils'
+    doutils daemon start
+    doutils up 34567 --count 2 --wait
+    doutils ls
+    doutils exec 203.0.113.7 uname -a
+    doutils put 203.0.113.7 data.csv data.csv
+    doutils get 203.0.113.7 results.tgz ./results.tgz
+    doutils down 203.0.113.7
+    doutils daemon stop
+
+A host is a droplet's id, address, or (if no other droplet has it)
+name; options for it go before it (eg "doutils exec --user root HOST
+CMD").  Who to log in as, and with what key, are found from the launch
+journal (see journal.py) for droplets doUtils made; --user and --key
+say otherwise.
+
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+from doUtils import daemon
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+
+def call(args, op, **opArgs):
+    """Do op: through the daemon if it's running, else in-process."""
+    if not args.no_daemon:
+        try:
+            client = daemon.DaemonClient(args.socket)
+        except OSError:
+            log.debug("no daemon on {}; working in-process".format(args.socket or daemon.defaultSocketPath()))
+        else:
+            with client:
+                return client.call(op, **opArgs)
+    controller = daemon.Controller()
+    try:
+        reply = controller.handle(dict(opArgs, op=op))
+    finally:
+        controller.close()
+    if not reply['ok']:
+        raise daemon.DaemonError(reply['error'])
+    return reply['result']
+
+
+def printTable(rows, columns):
+    """Print rows (dictionaries) as columns, each as wide as need be."""
+    cells = [[str(c) for c in columns]] + [[' '.join(v) if isinstance(v, list) else str(v) for v in (r.get(c, '') for c in columns)]
+                                           for r in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+    for row in cells:
+        print('  '.join(cell.ljust(w) for cell, w in zip(row, widths)).rstrip())
+
+
+def hostArgs(args):
+    return {'user': args.user, 'keyFname': os.path.abspath(args.key) if args.key else None, 'port': args.port}
+
+
+###############################################################################
+# The commands.
+
+
+def cmdLs(args):
+    droplets = call(args, 'ls', refresh=args.refresh)
+    if args.json:
+        print(json.dumps(droplets, indent=1))
+    else:
+        printTable(droplets, ['id', 'name', 'ip', 'status', 'region', 'size', 'tags'])
+    return 0
+
+
+def cmdImages(args):
+    images = call(args, 'images', refresh=args.refresh)
+    if args.json:
+        print(json.dumps(images, indent=1))
+    else:
+        printTable([{'id': i, 'distribution': dist, 'name': name} for i, dist, name in images], ['id', 'distribution', 'name'])
+    return 0
+
+
+def cmdExec(args):
+    result = call(args, 'exec', host=args.host, cmd=' '.join(args.cmd), timeout=args.timeout, **hostArgs(args))
+    sys.stdout.write(result['stdout'])
+    sys.stderr.write(result['stderr'])
+    if result['status'] is None:
+        print("doutils: {}: {}".format(args.host, result['error']), file=sys.stderr)
+        return 255    # as ssh does
+    return result['status']
+
+
+def cmdPut(args):
+    result = call(args, 'put', host=args.host, localFpath=os.path.abspath(args.local), remoteFpath=args.remote, **hostArgs(args))
+    log.info("put {} bytes in {:.2f} s".format(result['bytes'], result['secs']))
+    return 0
+
+
+def cmdGet(args):
+    result = call(args, 'get', host=args.host, remoteFpath=args.remote, localFpath=os.path.abspath(args.local), **hostArgs(args))
+    log.info("got {} bytes in {:.2f} s".format(result['bytes'], result['secs']))
+    return 0
+
+
+def cmdUp(args):
+    made = call(args, 'up', imageID=args.image, count=args.count, region=args.region, sizeSlug=args.size,
+                wait=args.wait, timeout=args.timeout)
+    if args.json:
+        print(json.dumps(made, indent=1))
+    else:
+        printTable(made, ['id', 'ip', 'username', 'pemFilePathname'] + (['ready'] if args.wait else []))
+    return 0 if not args.wait or all(m['ready'] for m in made) else 1
+
+
+def cmdDown(args):
+    for dropletId in call(args, 'down', hosts=args.hosts):
+        print("destroyed {}".format(dropletId))
+    return 0
+
+
+def cmdDaemon(args):
+    socketPath = args.socket or daemon.defaultSocketPath()
+    if args.action == 'run':
+        logging.getLogger('paramiko.transport').setLevel(logging.WARNING)
+        daemon.DaemonServer(socketPath, idleExitSecs=args.idle_exit_secs).run()
+    elif args.action == 'start':
+        print("daemon started, pid {}, on {}".format(daemon.startDaemon(socketPath, args.idle_exit_secs), socketPath))
+    elif args.action == 'stop':
+        try:
+            print("daemon stopped, pid {}".format(daemon.stopDaemon(socketPath)))
+        except OSError:
+            print("no daemon on {}".format(socketPath))
+            return 1
+    else:
+        try:
+            with daemon.DaemonClient(socketPath, timeout=5) as client:
+                status = client.call('ping')
+        except OSError:
+            print("no daemon on {}".format(socketPath))
+            return 1
+        print("daemon pid {}, up {:.0f} s, {} requests, {} ssh connections, on {}".format(
+            status['pid'], status['uptime'], status['requests'], status['connections'], socketPath))
+    return 0
+
+
+###############################################################################
+
+
+def makeParser():
+    parser = argparse.ArgumentParser(prog='doutils', description="Digital Ocean droplets, from the shell.")
+    parser.add_argument('--socket', default=None, help="the daemon's socket (default: $DoUtilsDaemonSocket, or one in doUtils' cache dir)")
+    parser.add_argument('--no-daemon', action='store_true', help="work in-process, even if a daemon is running")
+    parser.add_argument('-v', '--verbose', action='count', default=0)
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    def hostOptions(p):
+        p.add_argument('host', help="droplet id, address, or name")
+        p.add_argument('--user', default=None, help="user to log in as (default: the droplet's sudo user)")
+        p.add_argument('--key', default=None, help="private key file (default: the droplet's)")
+        p.add_argument('--port', type=int, default=22)
+
+    p = commands.add_parser('ls', help="list droplets")
+    p.add_argument('--refresh', action='store_true', help="don't use the daemon's cached list")
+    p.add_argument('--json', action='store_true')
+    p.set_defaults(func=cmdLs)
+
+    p = commands.add_parser('images', help="list distro images")
+    p.add_argument('--refresh', action='store_true', help="don't use the daemon's cached list")
+    p.add_argument('--json', action='store_true')
+    p.set_defaults(func=cmdImages)
+
+    p = commands.add_parser('exec', help="run a command on a droplet")
+    hostOptions(p)
+    p.add_argument('cmd', nargs=argparse.REMAINDER, help="the command")
+    p.add_argument('--timeout', type=float, default=None, help="seconds to give up after")
+    p.set_defaults(func=cmdExec)
+
+    p = commands.add_parser('put', help="copy a file to a droplet")
+    hostOptions(p)
+    p.add_argument('local')
+    p.add_argument('remote')
+    p.set_defaults(func=cmdPut)
+
+    p = commands.add_parser('get', help="copy a file from a droplet")
+    hostOptions(p)
+    p.add_argument('remote')
+    p.add_argument('local')
+    p.set_defaults(func=cmdGet)
+
+    p = commands.add_parser('up', help="make droplets")
+    p.add_argument('image', help="image id (see 'doutils images')")
+    p.add_argument('--count', type=int, default=1)
+    p.add_argument('--region', default=None)
+    p.add_argument('--size', default=None, help="size slug")
+    p.add_argument('--wait', action='store_true', help="wait until they're ready (ssh up, cloud-init done)")
+    p.add_argument('--timeout', type=float, default=600, help="seconds to wait, with --wait")
+    p.add_argument('--json', action='store_true')
+    p.set_defaults(func=cmdUp)
+
+    p = commands.add_parser('down', help="destroy droplets")
+    p.add_argument('hosts', nargs='+', help="droplet ids, addresses, or names")
+    p.set_defaults(func=cmdDown)
+
+    p = commands.add_parser('daemon', help="start, stop, or check on the daemon")
+    p.add_argument('action', choices=['start', 'stop', 'status', 'run'], help="run: serve in the foreground")
+    p.add_argument('--idle-exit-secs', type=float, default=daemon.IdleExitSecs, help="exit after this long with no requests")
+    p.set_defaults(func=cmdDaemon)
+    return parser
+
+
+def main(argv=None):
+    args = makeParser().parse_args(argv)
+    verbosity = args.verbose + (args.command == 'daemon')    # the daemon's log says what it's been doing
+    logging.basicConfig(level=[logging.WARNING, logging.INFO, logging.DEBUG][min(verbosity, 2)],
+                        format='%(asctime)s %(name)s %(levelname)s: %(message)s' if args.command == 'daemon' else '%(message)s')
+    if args.command == 'exec' and not args.cmd:
+        makeParser().error("exec needs a command")
+    try:
+        return args.func(args)
+    except (daemon.DaemonError, ValueError, OSError) as e:
+        print("doutils: {}".format(e), file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 130
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
+    else:
+        sys.exit(main())
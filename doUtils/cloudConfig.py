@@ -35,9 +35,13 @@ import sys
 import os
 import time
 import logging
+import copy
+import shlex
 import json
-import yaml
+import hashlib
 import doUtils
+from doUtils import timeline
+from doUtils.journal import finishLaunch
 
 
 
@@ -73,6 +77,18 @@ AddCustomReposCCTpl = {'apt_sources': []}
 # each package in the list is either 'package_1' or
 # ['package_3', 'version_num']
 InstallPackagesCCTpl = {'packages': []}
+# Point apt at a caching proxy (eg apt-cacher-ng) and/or a mirror.
+# Uses the newer 'apt:' form; cloud-init refuses to mix that with the
+# older 'apt_sources' key, so custom repos move in here too:
+# apt:
+#   proxy: http://10.0.0.5:3142
+#   primary:
+#     - arches: [default]
+#       uri: http://mirrors.example.com/ubuntu/
+#   sources:
+#     doUtilsRepo0: {source: 'ppa:example/random-ng'}
+AptCCTpl = {'apt': {}}
+AptPrimaryCCTpl = {'arches': ['default'], 'uri': None}
 # Run arbitrary commands.
 # Each command in the list either looks like 'touch /tmp/test.txt'
 # or [ sed, -i, -e, 's/here/there/g', some_file]
@@ -97,10 +113,17 @@ WriteFileCCTpl = {
     ]
 }
 
+# Mount filesystems (eg data volumes, see volumes.py).
+# Each entry is like a line of /etc/fstab:
+# [device, mount point, fs type, options, dump, pass]
+MountsCCTpl = {'mounts': []}
+MountOptions = 'defaults,nofail,discard,noatime'
+
 ###############################################################################
 
 
-def makeUserData(sudoUserKeys=[], customRepos=None, installPkgs=None, files=None):
+def makeUserData(sudoUserKeys=[], customRepos=None, installPkgs=None, files=None, aptProxy=None, aptMirror=None, agent=False,
+                 volumes=None, runCmds=None, keyless=False):
     """Create textual cloud-config user data for initializing a VPS.
 
     sudoUserKeys : list of SshKeypairs (see utils.py and keypair.py)
@@ -118,6 +141,35 @@ def makeUserData(sudoUserKeys=[], customRepos=None, installPkgs=None, files=None
         "contents of file"}
         List of files to be created.
 
+    aptProxy : string
+        URL of an apt caching proxy, eg 'http://10.0.0.5:3142', as
+        returned in the 'apt proxy' entry from makeAptCacheDroplet()
+        (see droplet.py).  Packages (including from customRepos) are
+        then fetched through the proxy, so a fleet of droplets
+        downloads each .deb from upstream just once.
+
+    aptMirror : string
+        URL of a primary archive mirror to use instead of the
+        distro's default.
+
+    agent : bool
+        Install the doUtils agent as a service, running as the first
+        sudo user, for quick remote operations (see agent.py).
+
+    volumes : list of dict
+        Volumes to mount, as from makeVolumes() (see volumes.py):
+        'device', 'mountPoint', and optionally 'fsType' and
+        'readOnly'.  (makeDroplet(volumes=...) adds these itself.)
+
+    runCmds : list of string
+        Shell commands to run as root at the end of the first boot
+        (after packages are installed).
+
+    keyless : bool
+        Leave out the users' ssh keys, and don't make any: user data
+        just for userDataFingerprint(), eg to look for a droplet to
+        acquire (see makeDroplet() in droplet.py).
+
     returns : string, list of SshKeypairs
         Return userData string created, and list of sudoUserKeys used.
 
@@ -145,35 +197,145 @@ def makeUserData(sudoUserKeys=[], customRepos=None, installPkgs=None, files=None
     >>> "\\nwrite_files:\\n- {content: 'Tis but a scratch.\\n" in udata2
     True
 
+    EG: Install packages through an apt caching proxy:
+
+    >>> udata3,ukeys3 = makeUserData(customRepos=Repos, installPkgs=PkgsToInstall, aptProxy='http://10.0.0.5:3142')
+    >>> "proxy: http://10.0.0.5:3142" in udata3 and "apt_sources" not in udata3
+    True
+
+    EG: Mount a data volume:
+
+    >>> Vols = [{'device': '/dev/disk/by-id/scsi-0DO_Volume_data-1', 'mountPoint': '/data', 'readOnly': True}]
+    >>> udata4,ukeys4 = makeUserData(volumes=Vols)
+    >>> "scsi-0DO_Volume_data-1" in udata4 and "noatime,ro" in udata4 and "mount /data" in udata4
+    True
+
     """
+    import yaml    # here rather than at top, to keep "import doUtils" quick
     ccParms = {}
-    if not sudoUserKeys:
-        sudoUserKeys.append(doUtils.SshKeypair(username='adminutil'))
-    sudoUserListCC = dict(SudoUserListCCTpl)
-    for k in sudoUserKeys:
-        sudoUserListCC['users'].append(dict(SudoUserCCTpl))
-        sudoUserListCC['users'][-1]['name'] = k.username
-        sudoUserListCC['users'][-1]['ssh-authorized-keys'].append(k.doSshKey.public_key)
+    if not sudoUserKeys and not keyless:
+        sudoUserKeys = [doUtils.SshKeypair(username='adminutil')]
+    usernames = [k.username for k in sudoUserKeys] or ['adminutil']
+    # deepcopy: the templates' lists mustn't collect this call's entries.
+    sudoUserListCC = copy.deepcopy(SudoUserListCCTpl)
+    for i, username in enumerate(usernames):
+        sudoUserListCC['users'].append(copy.deepcopy(SudoUserCCTpl))
+        sudoUserListCC['users'][-1]['name'] = username
+        if not keyless:
+            sudoUserListCC['users'][-1]['ssh-authorized-keys'].append(sudoUserKeys[i].doSshKey.public_key)
     ccParms.update(sudoUserListCC)
     if customRepos or installPkgs:
         ccParms.update(UpdatePkgInfoCCTpl)
-    if customRepos:
+    if aptProxy or aptMirror:
+        aptCC = copy.deepcopy(AptCCTpl)
+        if aptProxy:
+            aptCC['apt']['proxy'] = aptProxy
+        if aptMirror:
+            aptPrimaryCC = copy.deepcopy(AptPrimaryCCTpl)
+            aptPrimaryCC['uri'] = aptMirror
+            aptCC['apt']['primary'] = [aptPrimaryCC]
+        if customRepos:
+            aptCC['apt']['sources'] = {'doUtilsRepo{}'.format(i): {'source': r} for i, r in enumerate(customRepos)}
+        ccParms.update(aptCC)
+    elif customRepos:
         customReposCC = [{'source': r} for r in customRepos]
-        addCustomReposCC = dict(AddCustomReposCCTpl)
+        addCustomReposCC = copy.deepcopy(AddCustomReposCCTpl)
         addCustomReposCC['apt_sources'] = customReposCC
         ccParms.update(addCustomReposCC)
     if installPkgs:
-        installPackagesCC = dict(InstallPackagesCCTpl)
+        installPackagesCC = copy.deepcopy(InstallPackagesCCTpl)
         installPackagesCC['packages'] = installPkgs
         ccParms.update(installPackagesCC)
+    files = list(files or [])
+    runCmds = list(runCmds or [])
+    if volumes:
+        ccParms.update(volumeMountsCC(volumes))
+        runCmds = volumeMountCmds(volumes) + runCmds
+    if agent:
+        from doUtils.agent import agentUserData
+        agentFiles, agentCmds = agentUserData(usernames[0])
+        files += agentFiles
+        runCmds += agentCmds
+    if runCmds:
+        runCmdsCC = copy.deepcopy(RunCmdsCCTpl)
+        runCmdsCC['runcmd'] = runCmds
+        ccParms.update(runCmdsCC)
     if files:
-        writeFileCC = dict(WriteFileCCTpl)
+        writeFileCC = copy.deepcopy(WriteFileCCTpl)
         writeFileCC['write_files'] = files
         ccParms.update(writeFileCC)
     userData = CloudConfigHdr + yaml.dump(ccParms)
     return userData, sudoUserKeys
 
 ###############################################################################
+# Data volumes.
+
+
+def volumeMountsCC(volumes):
+    """The cloud-config mounts entries for volumes (see makeUserData())."""
+    mountsCC = copy.deepcopy(MountsCCTpl)
+    for v in volumes:
+        options = MountOptions + (',ro' if v.get('readOnly') else '')
+        mountsCC['mounts'].append([v['device'], v['mountPoint'], v.get('fsType') or 'ext4', options, '0', '2'])
+    return mountsCC
+
+
+def volumeMountCmds(volumes):
+    """Commands to mount volumes that weren't there yet when cloud-init's
+    mounts ran (attaching can lag the boot)."""
+    return ["for i in $(seq 60); do [ -e {dev} ] && break; sleep 1; done; mountpoint -q {mp} || mount {mp}".format(
+        dev=shlex.quote(v['device']), mp=shlex.quote(v['mountPoint'])) for v in volumes]
+
+
+def addVolumeMounts(userData, volumes):
+    """
+    Add mounts for volumes to cloud-config user data made earlier (eg by
+    makeUserData()).
+
+    Returns : string
+        The new user data.
+    """
+    import yaml    # here rather than at top, to keep "import doUtils" quick
+    if not userData.startswith(CloudConfigHdr):
+        raise ValueError("can only add volume mounts to #cloud-config user data")
+    ccParms = yaml.safe_load(userData[len(CloudConfigHdr):]) or {}
+    ccParms.setdefault('mounts', []).extend(volumeMountsCC(volumes)['mounts'])
+    ccParms['runcmd'] = volumeMountCmds(volumes) + ccParms.get('runcmd', [])
+    return CloudConfigHdr + yaml.dump(ccParms)
+
+###############################################################################
+
+
+def userDataFingerprint(userData):
+    """A short hash of what cloud-config user data sets up -- the same
+    for user data that differ only in the users' ssh keys.  Droplets
+    made with the same fingerprint (and image) are interchangeable:
+    see makeDroplet(acquire=True) in droplet.py.
+
+    userData : string
+        As from makeUserData().
+
+    Returns : string
+        16 hex digits.
+
+    >>> u1, _k1 = makeUserData(installPkgs=['jq'])
+    >>> u2, _k2 = makeUserData(installPkgs=['jq'])
+    >>> u3, _k3 = makeUserData(installPkgs=['jq', 'htop'])
+    >>> userDataFingerprint(u1) == userDataFingerprint(u2) != userDataFingerprint(u3)
+    True
+    >>> userDataFingerprint(makeUserData(installPkgs=['jq'], keyless=True)[0]) == userDataFingerprint(u1)
+    True
+
+    """
+    import yaml    # here rather than at top, to keep "import doUtils" quick
+    ccParms = yaml.safe_load(userData) or {}
+    for user in ccParms.get('users', []):
+        if isinstance(user, dict):
+            user.pop('ssh-authorized-keys', None)
+    canonical = json.dumps(ccParms, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+###############################################################################
 
 
 def waitUntilCloudInitDone(sshConn, nTries=10):
@@ -192,28 +354,58 @@ def waitUntilCloudInitDone(sshConn, nTries=10):
             'passesResults': contents of /run/cloud-init/status.json
         If failure, 'done' is False and MORE is
             'log': contents of /var/log/cloud-init-output.log
+
+    If the droplet's launch is being timed (see timeline.py), the wait
+    is its last phase: the launch's timeline is finished here.  So is
+    its launch's record in the journal, if any (see journal.py):
+    'ready' or 'failed'.
     """
+    host = getattr(sshConn, 'host', None)
+    with timeline.span(host, 'cloud-init'):
+        result = pollCloudInit(sshConn, nTries)
+    timeline.finishHost(host, cloudInitDone=result['done'])
+    if result['done']:
+        finishLaunch(host, 'ready')
+    else:
+        finishLaunch(host, 'failed', error='cloud-init not done')
+    return result
+
+
+def pollCloudInit(sshConn, nTries):
     triesLeft = nTries
     while triesLeft:
         time.sleep((nTries-triesLeft)**2)
         triesLeft -= 1
-        # How do we know if cloud init is done, and whether it succeeded?
-        # https://github.com/number5/cloud-init/blob/master/doc/status.txt
-        # Besides checking for nonzero (ie fail) exit status from cat,
-        # could also do errLines = resErr.readlines(), and check for
-        # (errLines and "No such file or directory" in errLines[0])
-        _in, resOut, _err = sshConn.do('cat /run/cloud-init/result.json')
-        if resOut.channel.recv_exit_status() != 0:
-            log.info("Cloud init not done ({} tries left)...".format(triesLeft))
-        else:
-            resContents = resOut.read()
-            if type(resContents) == bytes:
-                resContents = resContents.decode('utf-8')
-            _in, statOut, _err = sshConn.do('cat /run/cloud-init/status.json')
-            statContents = statOut.read()
-            if type(statContents) == bytes:
-                statContents = statContents.decode('utf-8')
-            return {'done': True, 'summaryResult': json.loads(resContents), 'phasesResults': json.loads(statContents)}
+        result = checkCloudInit(sshConn)
+        if result is not None:
+            return result
+        log.info("Cloud init not done ({} tries left)...".format(triesLeft))
+    return cloudInitFailure(sshConn)
+
+
+def checkCloudInit(sshConn):
+    """Check once: waitUntilCloudInitDone()'s result if cloud-init is
+    done, else None."""
+    # How do we know if cloud init is done, and whether it succeeded?
+    # https://github.com/number5/cloud-init/blob/master/doc/status.txt
+    # Besides checking for nonzero (ie fail) exit status from cat,
+    # could also do errLines = resErr.readlines(), and check for
+    # (errLines and "No such file or directory" in errLines[0])
+    _in, resOut, _err = sshConn.do('cat /run/cloud-init/result.json')
+    if resOut.channel.recv_exit_status() != 0:
+        return None
+    resContents = resOut.read()
+    if type(resContents) == bytes:
+        resContents = resContents.decode('utf-8')
+    _in, statOut, _err = sshConn.do('cat /run/cloud-init/status.json')
+    statContents = statOut.read()
+    if type(statContents) == bytes:
+        statContents = statContents.decode('utf-8')
+    return {'done': True, 'summaryResult': json.loads(resContents), 'phasesResults': json.loads(statContents)}
+
+
+def cloudInitFailure(sshConn):
+    """waitUntilCloudInitDone()'s result when it's given up."""
     _in, logOut, _err = sshConn.do('cat /var/log/cloud-init-output.log')
     logContents = logOut.readlines()
     return {'done': False, 'log': logContents}
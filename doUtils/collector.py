@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.collector
+   :platform: Unix
+   :synopsis: class Collector -- stream logs and resource usage from droplets into local files.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+class Collector -- stream logs and resource usage from droplets into local files.
+
+Gathering logs with SshConn.do('cat ...') reads the whole file each
+time, and a command per droplet per poll costs more as the fleet
+grows.  A Collector keeps one ssh channel open to each droplet,
+running collectorRemote.py there; that tails the chosen files and
+samples CPU, memory, paging and network usage from /proc, and sends
+what's new in zlib-compressed batches.  Here, one thread select()s
+over all the channels, so the controller's cost is about the data
+that arrives, not the number of droplets.  Records go to rotating,
+gzip'd JSON-lines files:
+
+EG:
+
+    coll = Collector(fleet, files=['/var/log/syslog', 'job.log'], outDir='./collected')
+    coll.start()
+    ...
+    print(coll.stats())
+    coll.stop()
+
+Each line of output is a record with 'host', 't' and 'kind': a 'log'
+record has 'path' and 'line'; a 'sample' record has 'cpuPct',
+'memUsedMb', 'memPct', 'load1', 'pageInKBps', 'pageOutKBps',
+'netRxBps' and 'netTxBps'.  Files are named collect-TIME.jsonl.gz, and
+a new one is started when the current one gets to maxFileBytes.
+
+If a droplet's channel drops, it's reopened (after retrySecs), and its
+files' tails pick up where they left off.  Needs SshConn's paramiko
+backend (its channels can be select()ed).
+
+"""
+
+import os
+import sys
+import json
+import gzip
+import time
+import zlib
+import shlex
+import select
+import logging
+import threading
+from doUtils.sshConn import SshConnPool
+from doUtils.parallelSsh import hostParms, DefaultUser
+from doUtils.collectorRemote import FrameHeader
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+DefaultMaxFileBytes = 64 * 1024 * 1024
+
+
+def remoteSource():
+    """collectorRemote.py's source, to run on a droplet."""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'collectorRemote.py')) as f:
+        return f.read()
+
+
+class RotatingJsonlWriter:
+    """
+    Write records as gzip'd JSON lines, to a series of files in a
+    directory, starting a new one when the current one is big enough.
+
+    Operations:
+        write -- write records
+        close
+    """
+
+    def __init__(self, outDir, prefix='collect', maxFileBytes=DefaultMaxFileBytes, maxFiles=None):
+        """
+        maxFileBytes : int
+            Uncompressed bytes per file.
+
+        maxFiles : int
+            If given, only the newest maxFiles files are kept.
+        """
+        self.outDir = outDir
+        self.prefix = prefix
+        self.maxFileBytes = maxFileBytes
+        self.maxFiles = maxFiles
+        self.f = None
+        self.nBytes = 0
+        self.fpaths = []
+        os.makedirs(outDir, exist_ok=True)
+
+    def rotate(self):
+        self.close()
+        now = time.time()
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(now)) + "-{:06d}".format(int(now * 1e6) % 1000000)
+        fpath = os.path.join(self.outDir, "{}-{}.jsonl.gz".format(self.prefix, stamp))
+        self.f = gzip.open(fpath, 'wt', compresslevel=6)
+        self.nBytes = 0
+        self.fpaths.append(fpath)
+        if self.maxFiles:
+            while len(self.fpaths) > self.maxFiles:
+                os.remove(self.fpaths.pop(0))
+
+    def write(self, records):
+        if self.f is None or self.nBytes >= self.maxFileBytes:
+            self.rotate()
+        data = "".join(json.dumps(r) + "\n" for r in records)
+        self.f.write(data)
+        self.nBytes += len(data)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+###############################################################################
+
+
+class CollectedHost:
+    """A droplet being collected from: its channel, and what's come back."""
+
+    def __init__(self, host, user, keyFname, port):
+        self.host, self.user, self.keyFname, self.port = host, user, keyFname, port
+        self.channel = None
+        self.buffer = b''
+        self.offsets = {}       # path -> where its tail is up to
+        self.retryAt = 0.0
+        self.batches = 0
+        self.records = 0
+        self.wireBytes = 0
+        self.rawBytes = 0
+        self.lastSeen = None
+        self.error = None
+
+
+class Collector:
+    """
+    Collect logs and /proc samples from droplets, over one ssh channel
+    each, into local files.
+
+    Operations:
+        start -- open the channels, and start collecting
+        addHost, removeHost -- change the fleet while collecting
+        stop
+        stats -- per host, and overall
+    """
+
+    def __init__(self, hosts, files=(), outDir='collected', user=DefaultUser, keyFname=None, port=22,
+                 intervalSecs=5.0, batchSecs=10.0, maxFileBytes=DefaultMaxFileBytes, maxFiles=None,
+                 retrySecs=10.0, pool=None):
+        """
+        hosts : list of string or dictionary
+            Addresses; or dictionaries from makeDroplet().
+
+        files : list of string
+            Files to tail on each droplet (from their current ends).
+
+        outDir : string
+            Where the collected records go (see RotatingJsonlWriter).
+
+        user, keyFname : string
+            Who to log in as, with what key, where hosts are addresses.
+
+        intervalSecs : number
+            Seconds between samples, and between reads of the files.
+
+        batchSecs : number
+            Seconds between batches sent from each droplet.
+
+        retrySecs : number
+            Seconds to wait before reopening a dropped channel.
+
+        pool : SshConnPool (see sshConn.py)
+            Where connections live; defaults to a new pool, closed by
+            stop().
+        """
+        self.files = list(files)
+        self.user, self.keyFname, self.port = user, keyFname, port
+        self.intervalSecs, self.batchSecs, self.retrySecs = intervalSecs, batchSecs, retrySecs
+        self.ownPool = pool is None
+        self.pool = pool or SshConnPool()
+        self.writer = RotatingJsonlWriter(outDir, maxFileBytes=maxFileBytes, maxFiles=maxFiles)
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        for h in hosts:
+            self.addHost(h)
+
+    def addHost(self, host):
+        host, user, keyFname = hostParms(host, self.user, self.keyFname)
+        with self.lock:
+            self.hosts.setdefault(host, CollectedHost(host, user, keyFname, self.port))
+
+    def removeHost(self, host):
+        host = host['ip address'] if isinstance(host, dict) else host
+        with self.lock:
+            h = self.hosts.pop(host, None)
+        if h is not None and h.channel is not None:
+            h.channel.close()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='Collector', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            for h in self.hosts.values():
+                if h.channel is not None:
+                    h.channel.close()
+                    h.channel = None
+        if self.ownPool:
+            self.pool.closeAll()
+        self.writer.close()
+
+    def remoteCmd(self, h):
+        args = ['--interval', str(self.intervalSecs), '--batch', str(self.batchSecs),
+                '--files', json.dumps(self.files), '--offsets', json.dumps(h.offsets)]
+        return "python3 -u -c {} {}".format(shlex.quote(remoteSource()), " ".join(shlex.quote(a) for a in args))
+
+    def connect(self, h):
+        try:
+            sConn = self.pool.get(h.host, h.user, keyFname=h.keyFname, port=h.port)
+            _in, out, _err = sConn.do(self.remoteCmd(h))
+            h.channel = out.channel
+            h.channel.setblocking(0)
+            h.buffer = b''
+            h.error = None
+            log.info("collecting from {}".format(h.host))
+        except Exception as e:
+            h.error = "{}: {}".format(type(e).__name__, e)
+            h.retryAt = time.time() + self.retrySecs
+            self.pool.discard(h.host, h.user, h.keyFname, h.port)
+            log.info("can't collect from {}: {}".format(h.host, h.error))
+
+    def dropped(self, h, why):
+        log.info("lost {} ({}); retrying in {}s".format(h.host, why, self.retrySecs))
+        try:
+            h.channel.close()
+        except Exception:
+            pass
+        h.channel = None
+        h.error = why
+        h.retryAt = time.time() + self.retrySecs
+
+    def receive(self, h):
+        """Read what's arrived on h's channel; write out its whole frames."""
+        try:
+            while h.channel.recv_stderr_ready():
+                log.info("{}: {}".format(h.host, h.channel.recv_stderr(65536).decode('utf-8', 'replace').strip()))
+            data = h.channel.recv(1024 * 1024)
+        except Exception as e:    # socket.timeout when nothing's there yet
+            if h.channel.closed or h.channel.exit_status_ready():
+                self.dropped(h, "{}: {}".format(type(e).__name__, e))
+            return
+        if not data:
+            self.dropped(h, 'channel closed')
+            return
+        h.buffer += data
+        h.lastSeen = time.time()
+        records = []
+        while len(h.buffer) >= FrameHeader.size:
+            (n,) = FrameHeader.unpack_from(h.buffer)
+            if len(h.buffer) < FrameHeader.size + n:
+                break
+            frame, h.buffer = h.buffer[FrameHeader.size:FrameHeader.size + n], h.buffer[FrameHeader.size + n:]
+            try:
+                raw = zlib.decompress(frame)
+                batch = json.loads(raw.decode('utf-8'))
+            except (zlib.error, ValueError) as e:     # a bad frame: the stream's out of step, so start it over
+                self.dropped(h, "bad frame: {}: {}".format(type(e).__name__, e))
+                break
+            h.batches += 1
+            h.wireBytes += FrameHeader.size + n
+            h.rawBytes += len(raw)
+            for rec in batch:
+                if rec['kind'] == 'log':
+                    h.offsets[rec['path']] = rec['offset']
+                    records.extend({'host': h.host, 't': rec['t'], 'kind': 'log', 'path': rec['path'], 'line': line}
+                                   for line in rec['lines'])
+                else:
+                    records.append(dict(rec, host=h.host))
+        if records:
+            h.records += len(records)
+            self.writer.write(records)
+
+    def run(self):
+        while not self.stopping.is_set():
+            now = time.time()
+            with self.lock:
+                hosts = list(self.hosts.values())
+            for h in hosts:
+                if h.channel is None and now >= h.retryAt:
+                    self.connect(h)
+            channels = {h.channel: h for h in hosts if h.channel is not None}
+            if not channels:
+                self.stopping.wait(1.0)
+                continue
+            ready, _w, _x = select.select(list(channels), [], [], 1.0)
+            for channel in ready:
+                self.receive(channels[channel])
+
+    def stats(self):
+        """
+        Returns : dict
+            Per host ('hosts': host -> 'batches', 'records', 'wireBytes'
+            (compressed), 'rawBytes', 'lastSeen', 'error'), and totals.
+        """
+        with self.lock:
+            hosts = {h.host: {'batches': h.batches, 'records': h.records, 'wireBytes': h.wireBytes, 'rawBytes': h.rawBytes,
+                              'lastSeen': h.lastSeen, 'error': h.error} for h in self.hosts.values()}
+        totals = {k: sum(h[k] for h in hosts.values()) for k in ('batches', 'records', 'wireBytes', 'rawBytes')}
+        return dict(totals, hosts=hosts, files=list(self.writer.fpaths))
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.collectorRemote
+   :platform: Unix
+   :synopsis: The droplet's end of a Collector: tails files, samples /proc, and sends compressed batches.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+The droplet's end of a Collector: tails files, samples /proc, and sends compressed batches.
+
+collector.py runs this on each droplet (as "python3 -c SOURCE ARGS",
+over an ssh channel), so it uses nothing but python3's standard library,
+and imports nothing from doUtils.  Every interval it reads what's been
+added to each tailed file (starting over if the file was truncated or
+replaced, as by logrotate), and samples CPU, memory, paging and network
+counters from /proc.  Every batch interval (or sooner, if a lot has
+piled up) it writes the records to stdout as one frame: a 4-byte
+big-endian length, then zlib-compressed JSON -- a list of records:
+
+    {'t': TIME, 'kind': 'log', 'path': PATH, 'offset': END, 'lines': [...]}
+    {'t': TIME, 'kind': 'sample', 'cpuPct': ..., 'memUsedMb': ..., 'memPct': ...,
+     'load1': ..., 'pageInKBps': ..., 'pageOutKBps': ..., 'netRxBps': ..., 'netTxBps': ...}
+
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import logging
+import argparse
+
+###############################################################################
+
+# (Run as "python3 -c SOURCE", there's no __file__.)
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(globals().get('__file__', 'collectorRemote.py'))
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+FrameHeader = struct.Struct('>I')
+MaxReadBytes = 1024 * 1024      # per file, per interval
+MaxBatchBytes = 256 * 1024      # send early when this much has piled up
+
+
+def readCounters():
+    """The raw /proc counters samples are made from."""
+    counters = {}
+    with open('/proc/stat') as f:
+        fields = [int(x) for x in f.readline().split()[1:]]
+    counters['cpuTotal'] = sum(fields[:8])
+    counters['cpuIdle'] = fields[3] + (fields[4] if len(fields) > 4 else 0)    # idle + iowait
+    with open('/proc/meminfo') as f:
+        mem = {line.split(':')[0]: int(line.split()[1]) for line in f}
+    counters['memTotalKb'] = mem.get('MemTotal', 0)
+    counters['memAvailableKb'] = mem.get('MemAvailable', mem.get('MemFree', 0))
+    with open('/proc/vmstat') as f:
+        vm = dict(line.split() for line in f)
+    counters['pageInKb'] = int(vm.get('pgpgin', 0))
+    counters['pageOutKb'] = int(vm.get('pgpgout', 0))
+    rx = tx = 0
+    with open('/proc/net/dev') as f:
+        for line in f.readlines()[2:]:
+            name, data = line.split(':', 1)
+            if name.strip() != 'lo':
+                fields = data.split()
+                rx += int(fields[0])
+                tx += int(fields[8])
+    counters['netRx'], counters['netTx'] = rx, tx
+    with open('/proc/loadavg') as f:
+        counters['load1'] = float(f.read().split()[0])
+    counters['t'] = time.time()
+    return counters
+
+
+def sample(prev, cur):
+    """A sample record, from two readCounters()."""
+    secs = max(cur['t'] - prev['t'], 1e-6)
+    cpuTotal = cur['cpuTotal'] - prev['cpuTotal']
+    cpuBusy = cpuTotal - (cur['cpuIdle'] - prev['cpuIdle'])
+    memUsedKb = cur['memTotalKb'] - cur['memAvailableKb']
+    return {'t': cur['t'],
+            'kind': 'sample',
+            'cpuPct': round(100.0 * cpuBusy / cpuTotal, 2) if cpuTotal else 0.0,
+            'memUsedMb': round(memUsedKb / 1024, 1),
+            'memPct': round(100.0 * memUsedKb / cur['memTotalKb'], 2) if cur['memTotalKb'] else 0.0,
+            'load1': cur['load1'],
+            'pageInKBps': round((cur['pageInKb'] - prev['pageInKb']) / secs, 1),
+            'pageOutKBps': round((cur['pageOutKb'] - prev['pageOutKb']) / secs, 1),
+            'netRxBps': round((cur['netRx'] - prev['netRx']) / secs, 1),
+            'netTxBps': round((cur['netTx'] - prev['netTx']) / secs, 1)}
+
+
+class Tail:
+    """What's been added to a file since last time, a line at a time."""
+
+    def __init__(self, path, offset=0):
+        self.path = path
+        self.offset = offset
+        self.inode = None
+
+    def read(self):
+        """
+        Returns : a log record, or None if there's nothing new.
+        """
+        try:
+            f = open(os.path.expanduser(self.path), 'rb')
+        except OSError:
+            return None
+        with f:
+            st = os.fstat(f.fileno())
+            if (self.inode is not None and st.st_ino != self.inode) or st.st_size < self.offset:
+                self.offset = 0    # rotated or truncated
+            self.inode = st.st_ino
+            if st.st_size == self.offset:
+                return None
+            f.seek(self.offset)
+            data = f.read(MaxReadBytes)
+        end = data.rfind(b'\n') + 1    # just whole lines; the rest waits
+        if end == 0:
+            if len(data) < MaxReadBytes:
+                return None
+            end = len(data)    # one enormous line
+        self.offset += end
+        return {'t': time.time(), 'kind': 'log', 'path': self.path, 'offset': self.offset,
+                'lines': data[:end].decode('utf-8', 'replace').splitlines()}
+
+
+def sendBatch(out, records):
+    data = zlib.compress(json.dumps(records).encode('utf-8'))
+    out.write(FrameHeader.pack(len(data)) + data)
+    out.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tail files and sample /proc, for a doUtils Collector.")
+    parser.add_argument('--interval', type=float, default=5.0, help="seconds between reads and samples")
+    parser.add_argument('--batch', type=float, default=10.0, help="seconds between batches sent")
+    parser.add_argument('--files', default='[]', help="JSON list of files to tail")
+    parser.add_argument('--offsets', default='{}', help="JSON {file: offset} to start from (else the end)")
+    args = parser.parse_args(argv)
+    offsets = json.loads(args.offsets)
+    tails = []
+    for path in json.loads(args.files):
+        offset = offsets.get(path)
+        if offset is None:
+            try:
+                offset = os.path.getsize(os.path.expanduser(path))
+            except OSError:
+                offset = 0
+        tails.append(Tail(path, offset))
+    out = sys.stdout.buffer
+    prev = readCounters()
+    records, pendingBytes, lastSent = [], 0, time.time()
+    while True:
+        time.sleep(args.interval)
+        cur = readCounters()
+        records.append(sample(prev, cur))
+        prev = cur
+        for tail in tails:
+            rec = tail.read()
+            if rec is not None:
+                records.append(rec)
+                pendingBytes += sum(len(line) for line in rec['lines'])
+        if time.time() - lastSent >= args.batch or pendingBytes >= MaxBatchBytes:
+            try:
+                sendBatch(out, records)
+            except (BrokenPipeError, OSError):
+                return 0    # the collector's gone
+            records, pendingBytes, lastSent = [], 0, time.time()
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
+    else:
+        sys.exit(main())
@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.daemon
+   :platform: Unix
+   :synopsis: The doUtils daemon: a local server that keeps API sessions, caches and ssh connections warm for the CLI.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+The doUtils daemon: a local server that keeps API sessions, caches and ssh connections warm for the CLI.
+
+A script that imports doUtils, lists droplets, and runs a command on
+one pays, every time, for loading python-digitalocean and paramiko, a
+new HTTPS session to the API, and an ssh handshake and login -- a
+second or more before any work is done.  The daemon pays them once: it
+holds a Controller, which keeps
+
+    * the Manager (see utils.getManager()), whose HTTPS session stays
+      open between requests,
+    * the droplet list (for DropletCacheSecs) and image list (for
+      ImageCacheSecs), dropped when droplets are made or destroyed,
+    * an SshConnPool, so each droplet's connection is made once, and
+    * what it knows of the droplets it made (user, key file),
+
+and answers requests on a Unix socket (in getCacheDir(), readable by
+this user only), in the same frames as the agent (see agentServer.py):
+a request is {'id': N, 'op': NAME, ...arguments}, and its reply {'id':
+N, 'ok': true, 'result': ...} or {'id': N, 'ok': false, 'error':
+"..."}.  The ops are the Controller's: ping, ls, images, exec, put,
+get, up, down, and shutdown.
+
+The CLI (see cli.py) uses the daemon if it's running, and otherwise
+does the work itself, in-process.  Run it with:
+
+    python -m doUtils daemon start      # in the background
+    python -m doUtils daemon status
+    python -m doUtils daemon stop
+
+It takes the API key and endpoint from the environment it's started
+in, and exits after IdleExitSecs with no requests.
+
+"""
+
+import os
+import sys
+import time
+import socket
+import logging
+import threading
+import subprocess
+import socketserver
+import doUtils
+from doUtils.agentServer import sendFrame, recvFrame
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+DropletCacheSecs = 15
+ImageCacheSecs = 3600
+IdleExitSecs = 4 * 3600
+StartTimeoutSecs = 20
+
+
+def defaultSocketPath():
+    """Where the daemon listens: the environment variable
+    DoUtilsDaemonSocket, or daemon.sock in getCacheDir()."""
+    return os.environ.get('DoUtilsDaemonSocket') or os.path.join(doUtils.getCacheDir(), 'daemon.sock')
+
+
+class DaemonError(Exception):
+    """The daemon couldn't do what was asked (the message says why)."""
+
+
+###############################################################################
+
+
+class Controller:
+    """
+    What the daemon does for each request; the CLI uses one directly
+    when there's no daemon.
+
+    Operations:
+        handle -- a request's reply
+        ping, ls, images, exec, put, get, up, down -- the ops
+    """
+
+    def __init__(self, tuning=None):
+        self.started = time.time()
+        self.tuning = tuning
+        self.sshPool = None
+        self.launched = {}      # droplet id -> makeDroplet()'s dictionary, less the objects
+        self.resolved = {}      # host, as given -> (droplet id, address, user, key file)
+        self.caches = {}        # name -> (time, value)
+        self.lock = threading.Lock()    # for launched, resolved, caches and the counts
+        self.requests = 0
+        self.lastRequest = time.time()
+        self.shutdownRequested = False
+        self.ops = {'ping': self.ping, 'ls': self.ls, 'images': self.images, 'exec': self.exec, 'put': self.put,
+                    'get': self.get, 'up': self.up, 'down': self.down, 'shutdown': self.shutdown}
+
+    def handle(self, request):
+        reqId = request.pop('id', None)
+        with self.lock:
+            self.requests += 1
+            self.lastRequest = time.time()
+        try:
+            op = self.ops[request.pop('op')]
+        except KeyError as e:
+            return {'id': reqId, 'ok': False, 'error': "no such op: {}".format(e)}
+        try:
+            return {'id': reqId, 'ok': True, 'result': op(**request)}
+        except Exception as e:
+            log.info("{} failed: {}: {}".format(op.__name__, type(e).__name__, e))
+            return {'id': reqId, 'ok': False, 'error': "{}: {}".format(type(e).__name__, e)}
+
+    @property
+    def pool(self):
+        """The SshConnPool (made on first use, so ops without ssh don't load paramiko)."""
+        with self.lock:
+            if self.sshPool is None:
+                from doUtils.sshConn import SshConnPool
+                self.sshPool = SshConnPool(tuning=self.tuning)
+            return self.sshPool
+
+    def cached(self, name, maxAgeSecs, fetch, refresh=False):
+        with self.lock:
+            entry = self.caches.get(name)
+        if entry is None or refresh or time.time() - entry[0] > maxAgeSecs:
+            entry = (time.time(), fetch())
+            with self.lock:
+                self.caches[name] = entry
+        return entry[1]
+
+    def forget(self, name):
+        with self.lock:
+            self.caches.pop(name, None)
+
+    # Looking up droplets.
+
+    def droplets(self, refresh=False):
+        return self.cached('droplets', DropletCacheSecs, lambda: doUtils.getManager().get_all_droplets(), refresh)
+
+    def findDroplet(self, host):
+        """The droplet host names -- by id, address, or (unique) name -- or None."""
+        droplets = self.droplets()
+        for d in droplets:
+            if str(d.id) == str(host) or d.ip_address == host:
+                return d
+        named = [d for d in droplets if d.name == host]
+        if len(named) > 1:
+            raise ValueError("{} droplets are named {}; use an id or address".format(len(named), host))
+        return named[0] if named else None
+
+    def hostParms(self, host, user=None, keyFname=None):
+        """
+        (address, user, key file) to log in to host with: what's known
+        of a droplet made here, or (by its id) in the launch journal,
+        or (by its key tag) in ~/Downloads; given ones win.  Once found,
+        a droplet's are remembered, so later requests don't need the
+        droplet list.  (A host that's no droplet isn't: it may be one
+        by the next request.)
+        """
+        from doUtils.parallelSsh import DefaultUser
+        with self.lock:
+            resolved = self.resolved.get(host)
+        if resolved is None:
+            resolved = self.lookUp(host)
+            if resolved[0] is not None:
+                with self.lock:
+                    self.resolved[host] = resolved
+        _dropletId, address, knownUser, knownKeyFname = resolved
+        return address, user or knownUser or DefaultUser, keyFname or knownKeyFname
+
+    def lookUp(self, host):
+        from doUtils.droplet import KeyTagPrefix, keyNameFromTag
+        from doUtils.journal import getJournal
+        d = self.findDroplet(host)
+        if d is None:
+            return None, host, None, None
+        with self.lock:
+            known = self.launched.get(d.id)
+        if known is None:
+            jrnl = getJournal()
+            known = next((s for s in (jrnl.launches() if jrnl is not None else {}).values()
+                          if s.get('droplet') == d.id and s.get('pemFilePathname')), None)
+        if known is None:
+            for t in d.tags:
+                if t.startswith(KeyTagPrefix):
+                    pem = os.path.join(os.environ['HOME'], 'Downloads', keyNameFromTag(t))
+                    if os.path.exists(pem):
+                        known = {'pemFilePathname': pem}
+        known = known or {}
+        return d.id, d.ip_address, known.get('username'), known.get('pemFilePathname')
+
+    # The ops.
+
+    def ping(self):
+        with self.lock:
+            cacheAges = {name: time.time() - t for name, (t, _v) in self.caches.items()}
+        return {'pid': os.getpid(), 'uptime': time.time() - self.started, 'requests': self.requests,
+                'connections': len(self.sshPool.conns) if self.sshPool else 0, 'cacheAges': cacheAges}
+
+    def ls(self, refresh=False):
+        return [{'id': d.id, 'name': d.name, 'ip': d.ip_address, 'status': d.status, 'region': (d.region or {}).get('slug'),
+                 'size': d.size_slug, 'created': d.created_at, 'tags': d.tags} for d in self.droplets(refresh)]
+
+    def images(self, refresh=False):
+        from doUtils.droplet import distroImages
+        return self.cached('images', ImageCacheSecs, distroImages, refresh)
+
+    def exec(self, host, cmd, user=None, keyFname=None, port=22, timeout=None):
+        from doUtils.parallelSsh import runOnHost
+        address, user, keyFname = self.hostParms(host, user, keyFname)
+        result = runOnHost(self.pool, address, user, keyFname, cmd, timeout=timeout, port=port)
+        if result['error'] and result['status'] is None:
+            self.pool.discard(address, user, keyFname, port)    # so the next try reconnects
+        return result
+
+    def put(self, host, localFpath, remoteFpath, user=None, keyFname=None, port=22):
+        address, user, keyFname = self.hostParms(host, user, keyFname)
+        start = time.time()
+        self.pool.get(address, user, keyFname=keyFname, port=port).put(localFpath, remoteFpath)
+        return {'bytes': os.path.getsize(localFpath), 'secs': time.time() - start}
+
+    def get(self, host, remoteFpath, localFpath, user=None, keyFname=None, port=22):
+        address, user, keyFname = self.hostParms(host, user, keyFname)
+        start = time.time()
+        self.pool.get(address, user, keyFname=keyFname, port=port).get(remoteFpath, localFpath)
+        return {'bytes': os.path.getsize(localFpath), 'secs': time.time() - start}
+
+    def up(self, imageID, count=1, region=None, sizeSlug=None, wait=False, timeout=600):
+        """Make count droplets (each with its own sudo user and key);
+        with wait, wait until they're ready (see waitForFleet())."""
+        from doUtils.droplet import makeDroplet, DefaultRegion, DefaultSizeSlug
+        from doUtils.cloudConfig import makeUserData
+        made = []
+        try:
+            for _ in range(count):
+                uData, uKeys = makeUserData()
+                made.append(makeDroplet(imageID, sudoUserKeys=uKeys, userData=uData,
+                                        region=region or DefaultRegion, sizeSlug=sizeSlug or DefaultSizeSlug))
+        finally:
+            self.forget('droplets')
+            with self.lock:
+                for dParms in made:
+                    self.launched[dParms['droplet'].id] = {k: v for k, v in dParms.items() if k in ('ip address', 'username', 'pemFilePathname')}
+        result = [{'id': dParms['droplet'].id, 'ip': dParms['ip address'], 'username': dParms['username'],
+                   'pemFilePathname': dParms['pemFilePathname'], 'ready': None} for dParms in made]
+        if wait:
+            from doUtils.fleetReady import waitForFleet
+            status = waitForFleet(made, timeout=timeout, pool=self.pool)
+            readyIps = {dParms['ip address'] for dParms in status['ready']}
+            for r in result:
+                r['ready'] = r['ip'] in readyIps
+                r['error'] = status['errors'].get(r['ip'])
+        return result
+
+    def down(self, hosts):
+        """Destroy the droplets hosts name (by id, address, or unique name)."""
+        gone = []
+        try:
+            for host in hosts:
+                d = self.findDroplet(host)
+                if d is None:
+                    raise ValueError("no droplet {}".format(host))
+                d.destroy()
+                gone.append(d.id)
+                with self.lock:
+                    self.launched.pop(d.id, None)
+                    for name, resolved in list(self.resolved.items()):
+                        if resolved[0] == d.id:
+                            del self.resolved[name]
+                if self.sshPool is not None:
+                    for key in list(self.sshPool.conns):
+                        if key[0] == d.ip_address:
+                            self.sshPool.discard(*key)
+        finally:
+            self.forget('droplets')
+        return gone
+
+    def shutdown(self):
+        self.shutdownRequested = True
+        return {'pid': os.getpid()}
+
+    def warmUp(self):
+        """Load python-digitalocean and paramiko, and open the API
+        session, ahead of the first requests."""
+        try:
+            self.droplets()
+            self.pool
+        except Exception as e:
+            log.info("warming up: {}: {}".format(type(e).__name__, e))
+
+    def close(self):
+        if self.sshPool is not None:
+            self.sshPool.closeAll()
+
+
+###############################################################################
+# The server.
+
+
+class DaemonHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                request = recvFrame(self.request)
+            except (OSError, EOFError, ValueError) as e:
+                log.info("dropping connection: {}".format(e))
+                return
+            if request is None:
+                return
+            try:
+                sendFrame(self.request, self.server.controller.handle(request))
+            except OSError:
+                return
+            if self.server.controller.shutdownRequested:
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socketPath=None, idleExitSecs=IdleExitSecs, tuning=None):
+        self.socketPath = socketPath or defaultSocketPath()
+        if os.path.exists(self.socketPath):
+            if isRunning(self.socketPath):
+                raise DaemonError("a daemon is already listening on {}".format(self.socketPath))
+            os.unlink(self.socketPath)    # left by one that died
+        oldUmask = os.umask(0o077)    # only this user can connect
+        try:
+            super().__init__(self.socketPath, DaemonHandler)
+        finally:
+            os.umask(oldUmask)
+        self.controller = Controller(tuning=tuning)
+        self.idleExitSecs = idleExitSecs
+
+    def watchIdle(self):
+        while True:
+            time.sleep(min(60, max(1, self.idleExitSecs / 10)))
+            if time.time() - self.controller.lastRequest > self.idleExitSecs:
+                log.info("idle for {} s; exiting".format(self.idleExitSecs))
+                self.shutdown()
+                return
+
+    def run(self):
+        log.info("doUtils daemon (pid {}) serving on {}".format(os.getpid(), self.socketPath))
+        threading.Thread(target=self.controller.warmUp, daemon=True).start()
+        if self.idleExitSecs:
+            threading.Thread(target=self.watchIdle, daemon=True).start()
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+            self.controller.close()
+            try:
+                os.unlink(self.socketPath)
+            except FileNotFoundError:
+                pass
+
+
+###############################################################################
+# The client side.
+
+
+class DaemonClient:
+    """
+    A connection to a running daemon.
+
+    Operations:
+        call -- an op's result (raising DaemonError if it failed)
+        close
+    """
+
+    def __init__(self, socketPath=None, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(socketPath or defaultSocketPath())
+        except OSError:
+            self.sock.close()
+            raise
+        self.nextId = 0
+
+    def call(self, op, **args):
+        self.nextId += 1
+        sendFrame(self.sock, dict(args, id=self.nextId, op=op))
+        reply = recvFrame(self.sock)
+        if reply is None:
+            raise DaemonError("the daemon closed the connection")
+        if not reply['ok']:
+            raise DaemonError(reply['error'])
+        return reply['result']
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def isRunning(socketPath=None):
+    """Whether a daemon is answering on socketPath."""
+    try:
+        with DaemonClient(socketPath, timeout=5) as client:
+            client.call('ping')
+        return True
+    except (OSError, DaemonError):
+        return False
+
+
+def startDaemon(socketPath=None, idleExitSecs=IdleExitSecs):
+    """
+    Start a daemon in the background (logging to daemon.log beside its
+    socket), and wait until it answers.
+
+    Returns : int
+        Its pid.
+    """
+    socketPath = socketPath or defaultSocketPath()
+    if isRunning(socketPath):
+        raise DaemonError("a daemon is already listening on {}".format(socketPath))
+    pkgParent = os.path.dirname(os.path.dirname(os.path.abspath(doUtils.__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in (pkgParent, os.environ.get('PYTHONPATH')) if p))
+    logFpath = os.path.join(os.path.dirname(socketPath), 'daemon.log')
+    with open(logFpath, 'a') as logFile:
+        proc = subprocess.Popen([sys.executable, '-m', 'doUtils', '--socket', socketPath, 'daemon', 'run',
+                                 '--idle-exit-secs', str(idleExitSecs)],
+                                env=env, stdin=subprocess.DEVNULL, stdout=logFile, stderr=subprocess.STDOUT,
+                                start_new_session=True, cwd='/')
+    giveUpAt = time.time() + StartTimeoutSecs
+    while not isRunning(socketPath):
+        if proc.poll() is not None:
+            raise DaemonError("the daemon exited (status {}); see {}".format(proc.returncode, logFpath))
+        if time.time() > giveUpAt:
+            raise DaemonError("the daemon didn't answer within {} s; see {}".format(StartTimeoutSecs, logFpath))
+        time.sleep(0.05)
+    return proc.pid
+
+
+def stopDaemon(socketPath=None):
+    """Ask the daemon to exit.  Returns : its pid."""
+    with DaemonClient(socketPath, timeout=30) as client:
+        return client.call('shutdown')['pid']
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
@@ -28,12 +28,16 @@ See:
 import os
 import sys
 import time
+import random
 import socket
 import logging
 # import pdb
-import digitalocean
+import doUtils
 import doUtils.utils
-from doUtils.cloudConfig import makeUserData
+from doUtils import timeline
+from doUtils.cloudConfig import makeUserData, userDataFingerprint, addVolumeMounts
+from doUtils.volumes import makeVolumes, destroyVolumes
+from doUtils.journal import getJournal, newLaunchId, launchTag, bindLaunch, finishLaunch
 
 ###############################################################################
 
@@ -57,7 +61,7 @@ def isUp(ipAddr, port=22, nTries=3):
         True if host is up before run out of nTries, else false.
 
     '''
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+    with timeline.span(ipAddr, 'port {} open'.format(port)), socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
         sock.settimeout(3)
         triesLeft = nTries
         while triesLeft:
@@ -147,7 +151,204 @@ def distroImages():
 ###############################################################################
 
 
-def makeDroplet(imageID, sudoUserKeys=[], userData=None):
+DefaultRegion = 'sfo2'
+DefaultSizeSlug = '512mb'
+DropletName = 'dropletFromAPI02'
+
+###############################################################################
+# Droplet reuse.
+#
+# Droplets made with makeDroplet(acquire=True) are tagged so they can be
+# found, and handed out again, later:
+#
+#    doutils -- made by doUtils
+#    doutils-cc-FINGERPRINT -- its cloud-config's userDataFingerprint()
+#    doutils-key-STAMP -- names its key file (see keyTag())
+#    doutils-user-NAME -- the sudo user its key logs in as
+#    doutils-lease-TOKEN -- in use; while there's no live lease tag, it's idle
+#
+# The API has no compare-and-swap, so leasing is by tag: a would-be
+# leaser adds its own, uniquely named, lease tag, waits a moment for any
+# rivals' to land, and rereads the droplet's tags; then does so again.
+# It has the lease only if its tag was the only live one both times;
+# otherwise it removes its tag and looks elsewhere.  (So two leasers
+# can both lose, but not both win: a rival tag that lands before our
+# second read is seen there, and one landing later sees ours.)  A lease
+# tag is live for LeaseTtlSecs after it's made, so a leaser that died
+# doesn't keep a droplet from ever being reused; renewLease() to hold
+# one longer.
+
+ReuseTag = 'doutils'
+FingerprintTagPrefix = 'doutils-cc-'
+KeyTagPrefix = 'doutils-key-'
+UserTagPrefix = 'doutils-user-'
+LeaseTagPrefix = 'doutils-lease-'
+LeaseSettleSecs = 2
+LeaseTtlSecs = 24 * 60 * 60
+
+
+def keyTag(keyName):
+    """Tag naming a key file, eg 'key20180401_1200.123456.pem' (see
+    keypair.py).  Tags can't have dots.
+
+    >>> keyTag('key20180401_1200.123456.pem')
+    'doutils-key-20180401_1200-123456'
+    >>> keyNameFromTag(keyTag('key20180401_1200.123456.pem'))
+    'key20180401_1200.123456.pem'
+    """
+    return KeyTagPrefix + keyName[len('key'):-len('.pem')].replace('.', '-')
+
+
+def keyNameFromTag(tag):
+    stamp = tag[len(KeyTagPrefix):]
+    head, _sep, tail = stamp.rpartition('-')
+    return 'key' + head + '.' + tail + '.pem'
+
+
+def userTag(username):
+    """
+    >>> userTag('adminutil')
+    'doutils-user-adminutil'
+    """
+    return UserTagPrefix + username
+
+
+def newLeaseTag():
+    """A lease tag; later ones sort after earlier ones."""
+    return "{}{:016x}-{:08x}".format(LeaseTagPrefix, time.time_ns(), random.getrandbits(32))
+
+
+def leaseTime(tag):
+    """When a lease tag (see newLeaseTag()) was made; or None.
+
+    >>> leaseTime('doutils-lease-0000000000000000-00000000')
+    0.0
+    >>> leaseTime('doutils-lease-junk') is None
+    True
+    """
+    try:
+        return int(tag[len(LeaseTagPrefix):].split('-')[0], 16) / 1e9
+    except ValueError:
+        return None
+
+
+def leaseTags(droplet, now=None):
+    """droplet's live lease tags (see LeaseTtlSecs)."""
+    now = time.time() if now is None else now
+    return sorted(t for t in droplet.tags if t.startswith(LeaseTagPrefix) and now - (leaseTime(t) or 0) < LeaseTtlSecs)
+
+
+def leaseDroplet(droplet):
+    """Try to lease an idle droplet.
+
+    Returns : string
+        Our lease tag, if we got it; else None.
+    """
+    import digitalocean    # here rather than at top, to keep "import doUtils" quick
+    lease = digitalocean.Tag(token=doUtils.getApiToken(), name=newLeaseTag(), **doUtils.utils.getApiEndpointKwargs())
+    lease.create()
+    lease.add_droplets([str(droplet.id)])
+    for _ in range(2):
+        time.sleep(LeaseSettleSecs)
+        droplet.load()
+        if leaseTags(droplet) != [lease.name]:
+            log.info("lost the race for droplet {}".format(droplet.id))
+            lease.delete()
+            return None
+    for t in droplet.tags:
+        if t.startswith(LeaseTagPrefix) and t not in leaseTags(droplet):
+            log.info("removing expired lease {} from droplet {}".format(t, droplet.id))
+            digitalocean.Tag(token=doUtils.getApiToken(), name=t, **doUtils.utils.getApiEndpointKwargs()).delete()
+    return lease.name
+
+
+def renewLease(dParms):
+    """Extend the lease on a droplet from makeDroplet(acquire=True) by
+    another LeaseTtlSecs.  (It's still ours throughout.)"""
+    import digitalocean    # here rather than at top, to keep "import doUtils" quick
+    if not dParms.get('lease'):
+        raise ValueError("no lease to renew")
+    lease = digitalocean.Tag(token=doUtils.getApiToken(), name=newLeaseTag(), **doUtils.utils.getApiEndpointKwargs())
+    lease.create()
+    lease.add_droplets([str(dParms['droplet'].id)])
+    digitalocean.Tag(token=doUtils.getApiToken(), name=dParms['lease'], **doUtils.utils.getApiEndpointKwargs()).delete()
+    dParms['lease'] = lease.name
+
+
+def acquireIdleDroplet(fingerprint, imageID, region, sizeSlug):
+    """Find an idle droplet made with matching user data, image, region
+    and size, whose key file we have; and lease it.
+
+    Returns : tuple (Droplet, lease tag, key file pathname, username), or None
+    """
+    candidates = doUtils.getManager().get_all_droplets(tag_name=FingerprintTagPrefix + fingerprint)
+    random.shuffle(candidates)    # so concurrent acquirers mostly try different ones
+    for droplet in candidates:
+        if droplet.status != 'active' or leaseTags(droplet):
+            continue
+        if str(droplet.image.get('id')) != str(imageID) or droplet.region.get('slug') != region or droplet.size_slug != sizeSlug:
+            continue
+        keyTags = [t for t in droplet.tags if t.startswith(KeyTagPrefix)]
+        userTags = [t for t in droplet.tags if t.startswith(UserTagPrefix)]
+        if not keyTags or not userTags:
+            continue
+        pemFpath = os.path.join(os.environ["HOME"], "Downloads", keyNameFromTag(keyTags[0]))
+        if not os.path.exists(pemFpath):
+            continue
+        lease = leaseDroplet(droplet)
+        if lease is not None:
+            return droplet, lease, pemFpath, userTags[0][len(UserTagPrefix):]
+    return None
+
+
+def releaseDroplet(dParms):
+    """Hand back a droplet from makeDroplet(acquire=True): it's left
+    running, idle, for the next acquirer."""
+    import digitalocean    # here rather than at top, to keep "import doUtils" quick
+    if not dParms.get('lease'):
+        return
+    lease = digitalocean.Tag(token=doUtils.getApiToken(), name=dParms['lease'], **doUtils.utils.getApiEndpointKwargs())
+    lease.delete()
+    dParms['lease'] = None
+
+###############################################################################
+
+
+def noteLaunch(jrnl, launchId, phase, **data):
+    """Record a launch phase in jrnl (a LaunchJournal, see journal.py), if any."""
+    if jrnl is not None:
+        jrnl.record(launchId, phase, **data)
+
+
+def awaitCreation(droplet, tl):
+    """Wait for a just-created droplet's create action, then load its
+    address."""
+    log.info("awaiting actions...")
+    with tl.span('action wait'):
+        actions = droplet.get_actions()
+        actions[0].load()
+        log.info(actions)
+        actions[0].wait(10)  # ??
+        log.info(actions)
+
+    with tl.span('ip assignment'):
+        droplet.load()
+
+
+def dropletParms(droplet, username, keyName, pemFpath, userData, tl, **extra):
+    """makeDroplet()'s dictionary for a droplet."""
+    return dict({'ip address': droplet.ip_address,
+                 'username': username,
+                 'keyname': keyName,
+                 'userData': userData,
+                 'pemFilePathname': pemFpath,
+                 'ssh command': "ssh -i {} {}@{}".format(keyName, username, droplet.ip_address),
+                 'droplet': droplet,
+                 'timeline': tl}, **extra)
+
+
+def makeDroplet(imageID, sudoUserKeys=[], userData=None, region=DefaultRegion, sizeSlug=DefaultSizeSlug, acquire=False, journal=None,
+                volumes=None):
     """Create a running droplet.
 
     imageID : string
@@ -162,13 +363,46 @@ def makeDroplet(imageID, sudoUserKeys=[], userData=None):
         Startup user data for the VPS, eg for cloud-config.
         May be created by makeUserData (see cloudConfig.py).
 
+    region : string
+        Slug of the datacenter region, eg 'sfo2'.
+
+    sizeSlug : string
+        Slug of the droplet size, eg '512mb'.  (To pick region and
+        size to suit a job, see choosePlacement() in placement.py.)
+
+    acquire : bool
+        Rather than make a new droplet, lease an idle one made earlier
+        (with acquire=True) from the same image, region, size, and
+        cloud-config (apart from ssh keys; see userDataFingerprint());
+        make one only if there's none.  Hand it back with
+        releaseDroplet() when done, rather than destroying it (and
+        renewLease() to hold it over LeaseTtlSecs).  Its user data,
+        user and key are the earlier ones, not those passed in (its
+        userData isn't known then, so is None); no keys are made
+        unless a new droplet is.
+
+    journal : LaunchJournal (see journal.py), or False
+        Where to record the launch's phases, so it can be resumed if
+        interrupted (see resumeLaunches()).  Defaults to the journal in
+        getCacheDir(); False for none.
+
+    volumes : list of dict
+        Data volumes to attach, each made from a snapshot, or empty, or
+        an existing one (see volumes.py); they're mounted by cloud-init
+        (mounts are added to userData).  Not with acquire.
+
     Returns : dictionary
         Dictionary has useful info about the created droplet: 'ip
         address', username (associated with ssh key), keyname (of ssh
         key), userData (used for cloud initialization),
         pemFilePathname for the local key file, 'ssh command' to ssh
-        to the droplet, and droplet (Droplet object). All are strings
-        except for the last.
+        to the droplet, droplet (Droplet object), and timeline (the
+        launch's Timeline, see timeline.py). All are strings except
+        for the last two.  With acquire, also lease (the lease tag),
+        adopted (whether it was an existing droplet) and fingerprint
+        (its cloud-config fingerprint tag).  When
+        journaled, also launch (its id in the journal) and journal.
+        With volumes, also volumes (as from makeVolumes()).
 
     >>> ubuntuImages = [img for img in distroImages() if img[1] == 'Ubuntu']
     >>> id = ubuntuImages[0][0]
@@ -179,30 +413,296 @@ def makeDroplet(imageID, sudoUserKeys=[], userData=None):
 
     """
 
-    doToken = doUtils.getApiToken()
-    if not userData:
-        userData, sudoUserKeys = makeUserData(sudoUserKeys=sudoUserKeys)
-    keyIds = [k.doSshKey.id for k in sudoUserKeys]
-    droplet = digitalocean.Droplet(token=doToken, name='dropletFromAPI02', region='sfo2', image=imageID, size_slug='512mb', backups=False, ssh_keys=keyIds, user_data=userData)
+    import digitalocean    # here rather than at top, to keep "import doUtils" quick
+    if volumes and acquire:
+        raise ValueError("volumes can't be attached to an acquired droplet")
+    tl = timeline.Timeline('launch', image=imageID, region=region, size=sizeSlug)
+    jrnl = getJournal(journal)
+    launchId = newLaunchId()
+    journaled = {'launch': launchId, 'journal': jrnl} if jrnl is not None else {}
+    creating = False
+    vols = []
+    try:
+        noteLaunch(jrnl, launchId, 'started', image=imageID, region=region, size=sizeSlug)
+        doToken = doUtils.getApiToken()
+        tags, lease = [], None
+        if acquire:
+            # No keys made yet: an adopted droplet has its own.
+            fingerprint = userDataFingerprint(userData or makeUserData(sudoUserKeys=sudoUserKeys, keyless=True)[0])
+            with tl.span('acquire'):
+                acquired = acquireIdleDroplet(fingerprint, imageID, region, sizeSlug)
+            if acquired is not None:
+                droplet, lease, pemFpath, username = acquired
+                log.info("adopted idle droplet {}".format(droplet.id))
+                tl.attrs.update(droplet=droplet.id, adopted=True)
+                tl.bindHost(droplet.ip_address)
+                # Its user data is its maker's, which the API doesn't give back; its fingerprint tag says what it was.
+                dParms = dropletParms(droplet, username, os.path.basename(pemFpath), pemFpath, None, tl,
+                                      lease=lease, adopted=True, fingerprint=FingerprintTagPrefix + fingerprint, **journaled)
+                noteLaunch(jrnl, launchId, 'created', droplet=droplet.id, username=username, keyname=dParms['keyname'],
+                           pemFilePathname=pemFpath, fingerprint=dParms['fingerprint'], lease=lease, adopted=True)
+                noteLaunch(jrnl, launchId, 'ip', ip=droplet.ip_address)
+                noteLaunch(jrnl, launchId, 'ready', adopted=True)    # it's been ready all along
+                return dParms
+        if not userData:
+            with tl.span('user data'):
+                userData, sudoUserKeys = makeUserData(sudoUserKeys=sudoUserKeys)
+        if acquire:
+            lease = newLeaseTag()
+            tags = [ReuseTag, FingerprintTagPrefix + fingerprint, keyTag(sudoUserKeys[0].doSshKey.name),
+                    userTag(sudoUserKeys[0].username), lease]
+        if jrnl is not None:
+            tags.append(launchTag(launchId))
+        if volumes:
+            with tl.span('volumes'):
+                vols = makeVolumes(volumes, region, tags=[launchTag(launchId)] if jrnl is not None else [])
+            noteLaunch(jrnl, launchId, 'volumes', volumes=vols)
+            userData = addVolumeMounts(userData, vols)
+        keyIds = [k.doSshKey.id for k in sudoUserKeys]
+        noteLaunch(jrnl, launchId, 'keys', username=sudoUserKeys[0].username, keyname=sudoUserKeys[0].doSshKey.name,
+                   keyIds=keyIds, pemFilePathname=sudoUserKeys[0].pemFilePathnameAsStr, userData=userData, tags=tags, lease=lease)
+        droplet = digitalocean.Droplet(token=doToken, name=DropletName, region=region, image=imageID, size_slug=sizeSlug, backups=False, ssh_keys=keyIds, user_data=userData, tags=tags, volumes=[v['id'] for v in vols], **doUtils.utils.getApiEndpointKwargs())
+
+        log.info("create droplet...")
+        noteLaunch(jrnl, launchId, 'creating')
+        creating = True
+        with tl.span('api create'):
+            droplet.create()
+        noteLaunch(jrnl, launchId, 'created', droplet=droplet.id)
+
+        awaitCreation(droplet, tl)
+        noteLaunch(jrnl, launchId, 'ip', ip=droplet.ip_address)
+    except BaseException as e:
+        tl.finish(error="{}: {}".format(type(e).__name__, e))
+        if isinstance(e, Exception) and not creating:
+            noteLaunch(jrnl, launchId, 'failed', error="{}: {}".format(type(e).__name__, e))
+            destroyVolumes({'volumes': vols})
+        # Otherwise the droplet may exist; leave the launch for resumeLaunches().
+        raise
+    tl.attrs['droplet'] = droplet.id
+    tl.bindHost(droplet.ip_address)    # isUp, SshConn, etc on this address add to tl
+    bindLaunch(droplet.ip_address, jrnl, launchId)    # and waitUntilCloudInitDone() finishes the launch
+    dParms = dropletParms(droplet, sudoUserKeys[0].username, sudoUserKeys[0].doSshKey.name, sudoUserKeys[0].pemFilePathnameAsStr,
+                          userData, tl, volumes=vols, **journaled)
+    if acquire:
+        dParms.update(lease=lease, adopted=False, fingerprint=FingerprintTagPrefix + fingerprint)
+    return dParms
+
+
+def resumeLaunch(state, journal=None):
+    """Carry on with a launch that makeDroplet() didn't finish (eg the
+    controller died), from its last finished phase: find the droplet
+    (by id, or by its launch tag if the create's answer was lost),
+    create it if it was never made, and wait for its address.
+
+    state : dict
+        The launch's state in the journal (see LaunchJournal.pending()).
+
+    journal : LaunchJournal (see journal.py)
+        Defaults to the journal in getCacheDir().
 
-    log.info("create droplet...")
-    droplet.create()
+    Returns : dictionary
+        As from makeDroplet() (plus resumed=True), ready for
+        waitUntilReady(); or None if there's nothing to resume (the
+        launch is then marked abandoned).
+    """
+    import digitalocean    # here rather than at top, to keep "import doUtils" quick
+    jrnl = getJournal(journal)
+    launchId = state['launch']
+    if 'pemFilePathname' not in state:
+        log.info("launch {} was interrupted before its keys were made".format(launchId))
+        noteLaunch(jrnl, launchId, 'abandoned', reason='no keys')
+        return None
+    tl = timeline.Timeline('launch', image=state['image'], region=state['region'], size=state['size'], resumed=launchId)
+    try:
+        droplet = None
+        if 'droplet' in state:
+            try:
+                droplet = doUtils.getManager().get_droplet(state['droplet'])
+            except digitalocean.NotFoundError:
+                log.info("launch {}'s droplet {} is gone".format(launchId, state['droplet']))
+                noteLaunch(jrnl, launchId, 'abandoned', reason='droplet gone')
+                tl.finish(error='droplet gone')
+                return None
+        elif 'creating' in state['phases']:
+            found = doUtils.getManager().get_all_droplets(tag_name=launchTag(launchId))
+            droplet = found[0] if found else None
+        if droplet is None:
+            droplet = digitalocean.Droplet(token=doUtils.getApiToken(), name=DropletName, region=state['region'], image=state['image'], size_slug=state['size'], backups=False, ssh_keys=state['keyIds'], user_data=state['userData'], tags=state['tags'], volumes=[v['id'] for v in state.get('volumes', [])], **doUtils.utils.getApiEndpointKwargs())
+            log.info("create droplet for launch {}...".format(launchId))
+            noteLaunch(jrnl, launchId, 'creating')
+            with tl.span('api create'):
+                droplet.create()
+        if state.get('droplet') != droplet.id:
+            noteLaunch(jrnl, launchId, 'created', droplet=droplet.id)
+        if not droplet.ip_address:
+            awaitCreation(droplet, tl)
+        noteLaunch(jrnl, launchId, 'ip', ip=droplet.ip_address)
+    except BaseException as e:
+        tl.finish(error="{}: {}".format(type(e).__name__, e))
+        raise
+    log.info("resumed launch {}: droplet {} at {}".format(launchId, droplet.id, droplet.ip_address))
+    tl.attrs['droplet'] = droplet.id
+    tl.bindHost(droplet.ip_address)
+    bindLaunch(droplet.ip_address, jrnl, launchId)
+    dParms = dropletParms(droplet, state['username'], state['keyname'], state['pemFilePathname'], state['userData'], tl,
+                          launch=launchId, journal=jrnl, resumed=True, volumes=state.get('volumes', []))
+    if state.get('lease'):
+        dParms.update(lease=state['lease'], adopted=bool(state.get('adopted')))
+    return dParms
+
+
+def resumeLaunches(journal=None):
+    """Resume each unfinished launch in the journal (see resumeLaunch()).
+    Run by one controller at a time.
+
+    EG, after a crash:
+
+    >>> for dParms in resumeLaunches():  # doctest: +SKIP
+    ...     sConn = waitUntilReady(dParms)
+
+    Returns : list of dictionary
+        As from makeDroplet(), one per launch that could be resumed.
+    """
+    jrnl = getJournal(journal)
+    resumed = []
+    for state in jrnl.pending():
+        try:
+            dParms = resumeLaunch(state, jrnl)
+        except Exception as e:
+            log.info("couldn't resume launch {}: {}".format(state['launch'], e))
+            continue
+        if dParms is not None:
+            resumed.append(dParms)
+    return resumed
 
-    log.info("awaiting actions...")
-    actions = droplet.get_actions()
-    actions[0].load()
-    log.info(actions)
-    actions[0].wait(10)  # ??
-    log.info(actions)
-
-    droplet.load()
-    return {'ip address': droplet.ip_address,
-            'username': sudoUserKeys[0].username,
-            'keyname': sudoUserKeys[0].doSshKey.name,
-            'userData': userData,
-            'pemFilePathname': sudoUserKeys[0].pemFilePathnameAsStr,
-            'ssh command': "ssh -i {} {}@{}".format(sudoUserKeys[0].doSshKey.name, sudoUserKeys[0].username, droplet.ip_address),
-            'droplet': droplet}
+###############################################################################
+
+
+def waitUntilReady(dParms, nTries=7, pool=None):
+    """Wait until a droplet just made by makeDroplet() is usable: its
+    ssh port is open, its user can log in, and cloud-init is done.
+
+    dParms : dictionary
+        As returned by makeDroplet().
+
+    nTries : int
+        How many times to check each step.  Number of seconds between
+        checks increases each time.
+
+    pool : SshConnPool (see sshConn.py)
+        If given, the connection comes from (and stays in) the pool.
+
+    Returns : SshConn object (see sshConn.py)
+        A connection to the ready droplet, or None if it didn't get
+        ready.
+    """
+    ip = dParms['ip address']
+    jrnl, launchId = dParms.get('journal'), dParms.get('launch')
+    if not isUp(ip, nTries=nTries):
+        log.info("droplet {} never came up".format(ip))
+        timeline.finishHost(ip, ready=False)
+        finishLaunch(ip, 'failed', error='never came up')
+        return None
+    noteLaunch(jrnl, launchId, 'up')
+    sConn = None
+    for tryNum in range(nTries):    # cloud-init may not have made the user yet
+        time.sleep(tryNum**2)
+        try:
+            if pool is not None:
+                sConn = pool.get(ip, dParms['username'], keyFname=dParms['pemFilePathname'])
+            else:
+                sConn = doUtils.SshConn(ip, dParms['username'], keyFname=dParms['pemFilePathname'])
+            break
+        except Exception as e:
+            log.info("ssh to {} not ready yet: {}".format(ip, e))
+    if sConn is None:
+        log.info("droplet {} not ready".format(ip))
+        timeline.finishHost(ip, ready=False)
+        finishLaunch(ip, 'failed', error="couldn't log in")
+        return None
+    noteLaunch(jrnl, launchId, 'ssh')
+    if not doUtils.waitUntilCloudInitDone(sConn)['done']:    # which finishes the launch
+        log.info("droplet {} not ready".format(ip))
+        return None
+    return sConn
+
+###############################################################################
+# A caching apt proxy for a fleet of droplets.
+
+AptCachePort = 3142
+# apt-cacher-ng listens only on the droplet's private address, so it
+# isn't an open proxy on the internet; and since it can't cache https
+# sources (eg newer PPAs), those tunnel straight through -- allowed only
+# on that private address.  With no private address it listens on
+# localhost alone (and is of no use to a fleet).
+AptCacheConfFpath = '/etc/apt-cacher-ng/zz_doUtils.conf'
+AptCacheBindCmd = ("addr=$(curl -sf http://169.254.169.254/metadata/v1/interfaces/private/0/ipv4/address); "
+                   "if [ -n \"$addr\" ]; then printf 'BindAddress: %s\\nPassThroughPattern: ^(.*):443$\\n' \"$addr\"; "
+                   "else echo 'BindAddress: localhost'; fi > {}; systemctl restart apt-cacher-ng".format(AptCacheConfFpath))
+
+
+def makeAptCacheDroplet(imageID, nTries=10, region=DefaultRegion):
+    """Create a droplet running apt-cacher-ng, and wait until it's
+    serving, so that a fleet of droplets can fetch their packages
+    through it instead of each going to the upstream mirrors and PPAs.
+
+    imageID : string
+        ID for the desired VPS image, eg from distroImages().
+
+    nTries : int
+        How many times to check that the droplet is ready (see
+        waitUntilReady()).
+
+    region : string
+        Slug of the datacenter region; should be the fleet's.
+
+    Returns : dictionary
+        As from makeDroplet(), plus 'apt proxy': the proxy URL to pass
+        as makeUserData(aptProxy=...), or None if the proxy never came
+        up (in which case the fleet should just fetch directly).  The
+        URL is the droplet's private address: the proxy serves only
+        droplets in its datacenter, and the fleet's traffic stays
+        there.  A droplet with no private address can't serve as one.
+        And 'sudoUserKeys': its SshKeypairs, to destroy() with it.
+
+    EG: Bring up the cache first, then point the fleet at it:
+
+    >>> ubuntuImages = [img for img in distroImages() if img[1] == 'Ubuntu']
+    >>> id = ubuntuImages[0][0]
+    >>> cacheParms = makeAptCacheDroplet(id)  # doctest: +ELLIPSIS
+    ...
+    >>> cacheParms['apt proxy'].endswith(':3142')
+    True
+    >>> uData, uKeys = makeUserData(sudoUserKeys=[], installPkgs=['build-essential'], aptProxy=cacheParms['apt proxy'])
+    >>> dropletParms = makeDroplet(id, sudoUserKeys=uKeys, userData=uData)  # doctest: +ELLIPSIS
+    ...
+
+    """
+    userData, sudoUserKeys = makeUserData(sudoUserKeys=[], installPkgs=['apt-cacher-ng'], runCmds=[AptCacheBindCmd])
+    dParms = makeDroplet(imageID, sudoUserKeys=sudoUserKeys, userData=userData, region=region)
+    dParms['apt proxy'] = None
+    dParms['sudoUserKeys'] = sudoUserKeys
+    droplet = dParms['droplet']
+    proxyAddr = getattr(droplet, 'private_ip_address', None)
+    if not proxyAddr:
+        log.info("droplet {} has no private address, so can't serve as an apt cache".format(droplet.ip_address))
+        return dParms
+    log.info("waiting for apt cache on {}:{}...".format(proxyAddr, AptCachePort))
+    sConn = waitUntilReady(dParms, nTries=nTries)    # the proxy's configured by cloud-init's last step
+    if sConn is None:
+        log.info("apt cache on {} never came up".format(droplet.ip_address))
+        return dParms
+    try:
+        _in, out, _err = sConn.do("curl -sf -o /dev/null http://{}:{}/acng-report.html".format(proxyAddr, AptCachePort))
+        out.read()
+        if out.channel.recv_exit_status() == 0:
+            dParms['apt proxy'] = "http://{}:{}".format(proxyAddr, AptCachePort)
+        else:
+            log.info("apt cache on {} isn't serving".format(droplet.ip_address))
+    finally:
+        sConn.close()
+    return dParms
 
 ###############################################################################
 
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.dropletPool
+   :platform: Unix
+   :synopsis: class DropletPool -- a pool of ready droplets that grows and shrinks with demand.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+class DropletPool -- a pool of ready droplets that grows and shrinks with demand.
+
+Making a droplet usable (makeDroplet, then isUp, then
+waitUntilCloudInitDone) takes minutes, which is too slow to start only
+once work has piled up.  The pool keeps between minSize and maxSize
+droplets, including a few idle "warm standbys", and a background thread
+checks demand -- a queue's depth, or any callback -- every few seconds:
+
+    * It sizes the pool for the current demand, plus the standbys, plus
+      the demand it expects by the time a droplet launched now would be
+      ready.  That last uses the recent trend in demand, and the
+      measured boot times of earlier droplets.
+
+    * Droplets idle for longer than idleTimeout are destroyed, as long
+      as that leaves enough.
+
+"""
+
+import os
+import sys
+import math
+import time
+import logging
+import threading
+import statistics
+import doUtils
+from doUtils.sshConn import SshConnPool
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+
+class DropletPool:
+    """
+    A self-sizing pool of ready droplets.
+
+    Operations:
+        start -- start the background thread that sizes the pool
+        stop -- stop it (droplets stay)
+        acquire -- get a ready droplet for some work
+        release -- hand it back when the work's done
+        scale -- check demand and launch/destroy droplets, once
+        stats -- pool sizes and boot-time statistics
+        shutdown -- stop, and destroy all the pool's droplets
+
+    EG:
+
+    >>> work = queue.Queue()  # doctest: +SKIP
+    >>> pool = DropletPool(imageID, minSize=1, maxSize=20, warmStandby=2, demand=work)  # doctest: +SKIP
+    >>> pool.start()  # doctest: +SKIP
+    >>> dParms = pool.acquire(timeout=600)  # doctest: +SKIP
+    >>> sConn = pool.connection(dParms)  # doctest: +SKIP
+    >>> pool.release(dParms)  # doctest: +SKIP
+    >>> pool.shutdown()  # doctest: +SKIP
+    """
+
+    def __init__(self, imageID, minSize=0, maxSize=10, warmStandby=1, demand=None, tasksPerDroplet=1,
+                 idleTimeout=600, checkSecs=10, userDataArgs=None, nTries=7, pool=None):
+        """
+        imageID : string
+            ID for the droplets' image, eg from distroImages().
+
+        minSize, maxSize : int
+            Bounds on the number of droplets (booting ones included).
+
+        warmStandby : int
+            How many ready, idle droplets to keep beyond what demand
+            needs.
+
+        demand : callable, or object with a qsize() method (eg a
+            queue.Queue)
+            How much work is waiting.  None means just what's been
+            acquired.
+
+        tasksPerDroplet : int
+            How many units of demand one droplet handles.
+
+        idleTimeout : number
+            Seconds a droplet can sit idle before it's destroyed.
+
+        checkSecs : number
+            Seconds between the background thread's checks.
+
+        userDataArgs : dict
+            Keyword arguments for makeUserData() (see cloudConfig.py).
+            The user data, and its sudo user's keypair, are made once
+            and shared by all the pool's droplets; shutdown() deletes
+            the keypair.
+
+        nTries : int
+            How many times to check each launching droplet is ready
+            (see waitUntilReady()).
+
+        pool : SshConnPool (see sshConn.py)
+            Where connections to the droplets live; defaults to a new
+            pool.
+        """
+        if not 0 <= minSize <= maxSize:
+            raise ValueError("need 0 <= minSize <= maxSize")
+        self.imageID = imageID
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.warmStandby = warmStandby
+        self.demand = demand
+        self.tasksPerDroplet = tasksPerDroplet
+        self.idleTimeout = idleTimeout
+        self.checkSecs = checkSecs
+        self.userDataArgs = userDataArgs or {}
+        self.userData = None
+        self.sudoUserKeys = None
+        self.keysLock = threading.Lock()
+        self.nTries = nTries
+        self.pool = pool or SshConnPool()
+        self.nBooting = 0
+        self.idle = []          # (dParms, idle since), oldest first
+        self.busy = []          # dParms
+        self.nWaiting = 0       # callers waiting in acquire()
+        self.bootSecs = []      # launch-to-ready time of each droplet
+        self.nFailedBoots = 0
+        self.demandSamples = []     # (time, demand), recent ones
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        self.stopping = threading.Event()
+        self.thread = None
+
+    ###########################################################################
+    # Using the pool.
+
+    def acquire(self, timeout=None):
+        """Get a ready droplet, waiting for one if need be (waiting
+        counts as demand).
+
+        Returns : dictionary
+            As from makeDroplet(); or None if timed out.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.available:
+            while not self.idle:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.nWaiting += 1
+                try:
+                    self.available.wait(remaining if remaining is not None else self.checkSecs)
+                finally:
+                    self.nWaiting -= 1
+            dParms, _since = self.idle.pop()    # most recently used: likely warmest
+            self.busy.append(dParms)
+            return dParms
+
+    def release(self, dParms):
+        """Hand back a droplet from acquire()."""
+        with self.available:
+            self.busy.remove(dParms)
+            self.idle.append((dParms, time.time()))
+            self.available.notify()
+
+    def connection(self, dParms):
+        """An SshConn to a pool droplet, from the connection pool."""
+        return self.pool.get(dParms['ip address'], dParms['username'], keyFname=dParms['pemFilePathname'])
+
+    ###########################################################################
+    # Sizing the pool.
+
+    def start(self):
+        """Start the background thread that sizes the pool."""
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.manage, name='DropletPool', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def manage(self):
+        while not self.stopping.is_set():
+            try:
+                self.scale()
+            except Exception as e:
+                log.info("scaling the pool failed: {}".format(e))
+            self.stopping.wait(self.checkSecs)
+
+    def currentDemand(self):
+        if self.demand is None:
+            queued = 0
+        elif hasattr(self.demand, 'qsize'):
+            queued = self.demand.qsize()
+        else:
+            queued = self.demand()
+        with self.lock:
+            return queued + len(self.busy) * self.tasksPerDroplet + self.nWaiting * self.tasksPerDroplet
+
+    def expectedBootSecs(self):
+        """Recent typical launch-to-ready time; a guess before there
+        are any."""
+        with self.lock:
+            recent = self.bootSecs[-10:]
+        return statistics.median(recent) if recent else 180.0
+
+    def targetSize(self, demand, now=None):
+        """How many droplets the pool should have, for demand now and
+        what's expected by the time a new droplet would be ready."""
+        now = now or time.time()
+        self.demandSamples.append((now, demand))
+        bootSecs = self.expectedBootSecs()
+        # Keep about two boot-times' worth of samples for the trend.
+        self.demandSamples = [(t, d) for t, d in self.demandSamples if now - t <= 2 * bootSecs]
+        (t0, d0) = self.demandSamples[0]
+        slope = (demand - d0) / (now - t0) if now > t0 else 0.0
+        expected = max(demand, demand + slope * bootSecs)
+        target = math.ceil(expected / self.tasksPerDroplet) + self.warmStandby
+        return max(self.minSize, min(self.maxSize, target))
+
+    def scale(self):
+        """Check demand once; launch or destroy droplets to suit.
+
+        Returns : int
+            Droplets launched (positive) or destroyed (negative).
+        """
+        demand = self.currentDemand()
+        target = self.targetSize(demand)
+        now = time.time()
+        with self.lock:
+            size = self.nBooting + len(self.idle) + len(self.busy)
+            toLaunch = max(0, target - size)
+            # Idle too long, oldest first; but keep the pool at target.
+            doomed = []
+            while size - len(doomed) > target and len(self.idle) > len(doomed) and now - self.idle[len(doomed)][1] > self.idleTimeout:
+                doomed.append(self.idle[len(doomed)][0])
+            self.idle = self.idle[len(doomed):]
+            self.nBooting += toLaunch
+        if toLaunch or doomed:
+            log.info("pool: demand {}, size {}, target {}: launching {}, destroying {}".format(demand, size, target, toLaunch, len(doomed)))
+        for _ in range(toLaunch):
+            threading.Thread(target=self.launch, daemon=True).start()
+        for dParms in doomed:
+            self.destroy(dParms)
+        return toLaunch - len(doomed)
+
+    def launch(self):
+        start = time.time()
+        dParms = None
+        try:
+            with self.keysLock:
+                if self.userData is None:
+                    self.userData, self.sudoUserKeys = doUtils.makeUserData(sudoUserKeys=[], **self.userDataArgs)
+            dParms = doUtils.makeDroplet(self.imageID, sudoUserKeys=self.sudoUserKeys, userData=self.userData)
+            ready = doUtils.waitUntilReady(dParms, nTries=self.nTries, pool=self.pool) is not None
+        except Exception as e:
+            log.info("launching a pool droplet failed: {}".format(e))
+            ready = False
+        with self.available:
+            self.nBooting -= 1
+            if ready:
+                self.bootSecs.append(time.time() - start)
+                self.idle.append((dParms, time.time()))
+                self.available.notify()
+            else:
+                self.nFailedBoots += 1
+        if ready:
+            log.info("pool droplet {} ready after {:.0f}s".format(dParms['ip address'], time.time() - start))
+        elif dParms is not None:
+            self.destroy(dParms)
+
+    def destroy(self, dParms):
+        log.info("destroying pool droplet {}...".format(dParms['droplet'].id))
+        self.pool.discard(dParms['ip address'], dParms['username'], dParms['pemFilePathname'])
+        try:
+            dParms['droplet'].destroy()
+        except Exception as e:
+            log.info("destroying {} failed: {}".format(dParms['droplet'].id, e))
+
+    def shutdown(self):
+        """Stop sizing the pool, and destroy all its droplets (busy
+        ones too), and their keypair."""
+        self.stop()
+        with self.lock:
+            droplets = [d for d, _since in self.idle] + self.busy
+            self.idle, self.busy = [], []
+        for dParms in droplets:
+            self.destroy(dParms)
+        with self.keysLock:
+            keys, self.sudoUserKeys, self.userData = self.sudoUserKeys or [], None, None
+        for k in keys:
+            try:
+                k.destroy()
+            except Exception as e:
+                log.info("deleting key {} failed: {}".format(k.doSshKey.name, e))
+
+    ###########################################################################
+
+    def stats(self):
+        """
+        Returns : dict
+            'booting', 'idle', 'busy' counts; 'failedBoots'; and boot
+            times: 'bootSecsMean', 'bootSecsMedian', 'bootSecsMax'
+            (None until a droplet has booted).
+        """
+        with self.lock:
+            bootSecs = list(self.bootSecs)
+            return {'booting': self.nBooting,
+                    'idle': len(self.idle),
+                    'busy': len(self.busy),
+                    'failedBoots': self.nFailedBoots,
+                    'bootSecsMean': statistics.mean(bootSecs) if bootSecs else None,
+                    'bootSecsMedian': statistics.median(bootSecs) if bootSecs else None,
+                    'bootSecsMax': max(bootSecs) if bootSecs else None}
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
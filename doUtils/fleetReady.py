@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.fleetReady
+   :platform: Unix
+   :synopsis: waitForFleet -- wait for many droplets to be ready at once, until enough of them are.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+waitForFleet -- wait for many droplets to be ready at once, until enough of them are.
+
+Bringing droplets up one at a time with waitUntilReady() (isUp(), then
+SshConn(), then waitUntilCloudInitDone(), each sleeping longer between
+tries) takes about the sum of their boot times.  waitForFleet() checks
+all of them together, from one asyncio event loop: it probes each ssh
+port (for the server's banner, not just an open port), logs in once
+it answers, and polls cloud-init's result once logged in, every
+pollSecs; the logging in and polling run in a thread pool, as paramiko
+blocks.  It returns as soon as minReady droplets are ready, so work
+can start on those while the rest catch up:
+
+EG:
+
+    fleet = [doUtils.makeDroplet(iId, sudoUserKeys=uKeys, userData=uData) for _ in range(20)]
+    status = doUtils.waitForFleet(fleet, minReady=15, timeout=600)
+    for dParms in status['ready']:
+        status['connections'][dParms['ip address']].do('./crunch.sh')
+    later = doUtils.waitForFleet(status['pending'], timeout=300)    # the stragglers
+    print(status['errors'])
+
+A droplet has failed if cloud-init finished with errors; the others
+not ready are pending.  (As elsewhere, phases are added to the
+droplets' timelines and launch journals.)
+
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from doUtils import timeline
+from doUtils.sshConn import SshConnPool
+from doUtils.parallelSsh import hostParms, DefaultUser
+from doUtils.cloudConfig import checkCloudInit
+from doUtils.droplet import noteLaunch
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+DefaultPollSecs = 2.0
+ProbeTimeoutSecs = 3.0
+
+
+class NotReadyError(Exception):
+    """A droplet can't get ready."""
+
+
+async def probeSsh(host, port, pollSecs):
+    """Wait until host's ssh server sends its banner."""
+    while True:
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), ProbeTimeoutSecs)
+            try:
+                banner = await asyncio.wait_for(reader.readline(), ProbeTimeoutSecs)
+            finally:
+                writer.close()
+            if banner.startswith(b'SSH-'):
+                return
+            log.info("{}:{} answered, but not with ssh's banner: {!r}".format(host, port, banner[:40]))
+        except (OSError, asyncio.TimeoutError) as e:
+            log.debug("{}:{} not answering yet: {}".format(host, port, e))
+        await asyncio.sleep(pollSecs)
+
+
+class Opened:
+    """
+    The connections waitForFleet() has opened, so it can close those
+    left over once it's done -- including ones still being opened then,
+    in the thread pool, which it doesn't wait for.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.keys = set()       # (host, user, keyFname, port)
+        self.done = False
+
+    def get(self, host, user, keyFname, port):
+        """pool.get(), in the thread pool; once done, the connection's
+        closed at once."""
+        sConn = self.pool.get(host, user, keyFname=keyFname, port=port)
+        with self.lock:
+            if not self.done:
+                self.keys.add((host, user, keyFname, port))
+                return sConn
+        self.pool.discard(host, user, keyFname, port)
+        raise NotReadyError("stopped waiting for {}".format(host))
+
+    def closeAllBut(self, keepHosts):
+        """Stop; close the connections to hosts other than keepHosts."""
+        with self.lock:
+            self.done = True
+            keys = [k for k in self.keys if k[0] not in keepHosts]
+        for key in keys:
+            self.pool.discard(*key)
+
+
+async def readyOne(loop, executor, opened, droplet, user, keyFname, port, pollSecs):
+    """Bring one droplet to ready; returns (SshConn, cloud-init result)."""
+    host, user, keyFname = hostParms(droplet, user, keyFname)
+    jrnl, launchId = (droplet.get('journal'), droplet.get('launch')) if isinstance(droplet, dict) else (None, None)
+    with timeline.span(host, 'port {} open'.format(port)):
+        await probeSsh(host, port, pollSecs)
+    noteLaunch(jrnl, launchId, 'up')
+    while True:    # cloud-init may not have made the user yet
+        try:
+            sConn = await loop.run_in_executor(executor, opened.get, host, user, keyFname, port)
+            break
+        except Exception as e:
+            log.info("ssh to {} not ready yet: {}".format(host, e))
+            await asyncio.sleep(pollSecs)
+    noteLaunch(jrnl, launchId, 'ssh')
+    with timeline.span(host, 'cloud-init'):
+        while True:
+            result = await loop.run_in_executor(executor, checkCloudInit, sConn)
+            if result is not None:
+                break
+            await asyncio.sleep(pollSecs)
+    errors = result['summaryResult'].get('v1', {}).get('errors')
+    if errors:
+        raise NotReadyError("cloud-init errors: {}".format(errors))
+    return sConn, result
+
+
+async def waitForFleetAsync(droplets, minReady, timeout, user, keyFname, port, pollSecs, pool, maxParallel):
+    """waitForFleet(), as a coroutine."""
+    start = time.time()
+    loop = asyncio.get_running_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(maxParallel, len(droplets))))
+    opened = Opened(pool)
+    tasks = {asyncio.ensure_future(readyOne(loop, executor, opened, d, user, keyFname, port, pollSecs)): d for d in droplets}
+    status = {'ready': [], 'failed': [], 'pending': [], 'connections': {}, 'cloudInit': {}, 'errors': {}, 'readySecs': {}}
+    waiting = set(tasks)
+    try:
+        while waiting and len(status['ready']) < minReady and len(status['ready']) + len(waiting) >= minReady:
+            remaining = start + timeout - time.time()
+            if remaining <= 0:
+                break
+            done, waiting = await asyncio.wait(waiting, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                droplet = tasks[task]
+                host = hostParms(droplet, user, keyFname)[0]
+                try:
+                    sConn, result = task.result()
+                except Exception as e:
+                    log.info("droplet {} failed: {}".format(host, e))
+                    status['failed'].append(droplet)
+                    status['errors'][host] = "{}: {}".format(type(e).__name__, e)
+                    timeline.finishHost(host, ready=False)
+                    if isinstance(droplet, dict):
+                        noteLaunch(droplet.get('journal'), droplet.get('launch'), 'failed', error=status['errors'][host])
+                    continue
+                status['ready'].append(droplet)
+                status['connections'][host] = sConn
+                status['cloudInit'][host] = result
+                status['readySecs'][host] = time.time() - start
+                timeline.finishHost(host, cloudInitDone=True)
+                if isinstance(droplet, dict):
+                    noteLaunch(droplet.get('journal'), droplet.get('launch'), 'ready')
+    finally:
+        for task in waiting:
+            task.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+        opened.closeAllBut(status['connections'])
+    status['pending'] = [d for task, d in tasks.items() if task in waiting]
+    status['secs'] = time.time() - start
+    return status
+
+
+def waitForFleet(droplets, minReady=None, timeout=600, user=DefaultUser, keyFname=None, port=22,
+                 pollSecs=DefaultPollSecs, pool=None, maxParallel=32):
+    """
+    Wait until minReady of the droplets are ready -- ssh answering, the
+    user logged in, and cloud-init done -- checking all of them at once.
+
+    droplets : list of dictionary or string
+        As returned by makeDroplet() (or resumeLaunches()); or
+        addresses, to log in to as user, with keyFname.
+
+    minReady : int
+        How many need to be ready; defaults to all of them.
+
+    timeout : number
+        Seconds to give up after, returning however many are ready.
+
+    pollSecs : number
+        Seconds between checks of each droplet.
+
+    pool : SshConnPool (see sshConn.py)
+        Where the connections go; defaults to a new pool.
+
+    maxParallel : int
+        At most this many logins and cloud-init checks at once.
+
+    Returns : dict
+        'ready' -- the droplets that are ready, in the order they got
+            that way
+        'failed' -- those that won't be (cloud-init had errors)
+        'pending' -- the rest, not ready yet; they can be waited for
+            again
+        'connections' -- address -> SshConn, for the ready ones (those
+            opened to the others are closed, and taken out of pool)
+        'cloudInit' -- address -> waitUntilCloudInitDone()'s result
+        'readySecs' -- address -> seconds it took
+        'errors' -- address -> why, for the failed ones
+        'secs' -- seconds waited
+    """
+    droplets = list(droplets)
+    minReady = len(droplets) if minReady is None else min(minReady, len(droplets))
+    return asyncio.run(waitForFleetAsync(droplets, minReady, timeout, user, keyFname, port, pollSecs,
+                                         pool or SshConnPool(), maxParallel))
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.journal
+   :platform: Unix
+   :synopsis: class LaunchJournal -- an append-only record of droplet launches, so interrupted ones can be resumed.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+class LaunchJournal -- an append-only record of droplet launches, so interrupted ones can be resumed.
+
+If the controller dies partway through a launch -- after the droplet's
+keys were made and registered, or after it was created, but before
+cloud-init finished -- the droplet and key are orphaned, and a rerun
+starts over, paying for a whole boot again.  So makeDroplet() and
+waitUntilReady() note each phase of a launch in a journal as they
+finish it:
+
+    * started -- image, region, size
+    * keys -- user, key name and ids, key file, user data
+    * creating -- about to ask for the droplet (which is tagged with
+      the launch's id, so it can be found even if the answer is lost)
+    * created -- the droplet's id
+    * ip -- its address
+    * ready / failed / abandoned -- the launch is over
+
+Once a launch's droplet has an address, the launch is bound to it (see
+bindLaunch()), so whatever finds out that the droplet's ready, or isn't
+-- waitUntilReady(), or waitUntilCloudInitDone() on an SshConn to it --
+closes the launch.  (An adopted droplet, see makeDroplet(acquire=True),
+is ready at once.)
+
+A restarted controller carries on from the last finished phase:
+
+EG:
+
+    for dParms in resumeLaunches():
+        sConn = waitUntilReady(dParms)
+
+Each record is one line of JSON, appended and fsync'd, so a crash
+loses at most the record being written (and a torn last line is
+skipped on reading).  The journal lives in getCacheDir()/launches.jsonl
+by default; compact() drops finished launches from it.
+
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import threading
+from doUtils.utils import getCacheDir
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+JournalName = 'launches.jsonl'
+LaunchTagPrefix = 'doutils-launch-'
+FinishedPhases = ('ready', 'failed', 'abandoned')
+
+
+def newLaunchId():
+    """A launch id; later ones sort after earlier ones.  (Usable in a
+    droplet tag.)"""
+    return "{:016x}-{:08x}".format(time.time_ns(), random.getrandbits(32))
+
+
+# Launches whose droplets have addresses, but aren't finished: address
+# -> (journal, launch id).
+OpenLaunches = {}
+OpenLaunchesLock = threading.Lock()
+
+
+def launchTag(launchId):
+    """
+    >>> launchTag('0123abcd-beef')
+    'doutils-launch-0123abcd-beef'
+    """
+    return LaunchTagPrefix + launchId
+
+
+def bindLaunch(host, jrnl, launchId):
+    """Note that launch launchId, in jrnl, is of the droplet at host
+    (its address), to be finished by finishLaunch()."""
+    if jrnl is not None:
+        with OpenLaunchesLock:
+            OpenLaunches[host] = (jrnl, launchId)
+
+
+def finishLaunch(host, phase, **data):
+    """Record that the launch bound to host (see bindLaunch()), if any,
+    is over: phase is 'ready' or 'failed'.
+
+    Returns : bool
+        Whether there was a launch to finish.
+    """
+    with OpenLaunchesLock:
+        bound = OpenLaunches.pop(host, None)
+    if bound is None:
+        return False
+    jrnl, launchId = bound
+    jrnl.record(launchId, phase, **data)
+    return True
+
+###############################################################################
+
+
+class LaunchJournal:
+    """
+    An append-only journal of the phases of droplet launches.
+
+    Operations:
+        record -- note that a launch finished a phase
+        launches -- each launch's state, so far
+        pending -- launches that haven't finished
+        compact -- rewrite the journal, without finished launches
+    """
+
+    def __init__(self, fpath=None):
+        """
+        fpath : string
+            Defaults to getCacheDir()/launches.jsonl.
+        """
+        self.fpath = fpath or os.path.join(getCacheDir(), JournalName)
+        self.lock = threading.Lock()
+
+    def record(self, launchId, phase, **data):
+        """Note (durably) that launch launchId finished phase; data is
+        what later phases, or a resume, need to know."""
+        line = json.dumps(dict(data, launch=launchId, phase=phase, t=time.time()), default=str) + "\n"
+        with self.lock:
+            fd = os.open(self.fpath, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                size = os.fstat(fd).st_size
+                if size and os.pread(fd, 1, size - 1) != b"\n":
+                    line = "\n" + line    # after a torn line; keep this one whole
+                os.write(fd, line.encode('utf-8'))
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def launches(self):
+        """
+        Returns : dict
+            Launch id -> its state: the fields of all its records
+            merged (later ones win), with 'phases' (in order) and
+            'phase' (the last).
+        """
+        states = {}
+        try:
+            f = open(self.fpath)
+        except FileNotFoundError:
+            return states
+        with f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue    # torn by a crash
+                state = states.setdefault(rec['launch'], {'phases': []})
+                state['phases'].append(rec['phase'])
+                state.update(rec)
+        return states
+
+    def pending(self):
+        """
+        Returns : list of dict
+            The states of launches that haven't finished (see
+            launches()), oldest first.
+        """
+        return [s for _id, s in sorted(self.launches().items()) if s['phase'] not in FinishedPhases]
+
+    def compact(self):
+        """Rewrite the journal with just the unfinished launches (atomically)."""
+        with self.lock:
+            keep = {s['launch'] for s in self.pending()}
+            tmpFpath = self.fpath + '.tmp'
+            with open(tmpFpath, 'w') as out:
+                try:
+                    with open(self.fpath) as f:
+                        for line in f:
+                            try:
+                                if json.loads(line)['launch'] in keep:
+                                    out.write(line)
+                            except ValueError:
+                                continue
+                except FileNotFoundError:
+                    pass
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmpFpath, self.fpath)
+
+
+def getJournal(journal=None):
+    """
+    journal : LaunchJournal, None, or False
+        A journal; None for the default one; False for none.
+
+    Returns : LaunchJournal, or None
+    """
+    if journal is False:
+        return None
+    if journal is None:
+        if not hasattr(getJournal, 'default'):
+            getJournal.default = LaunchJournal()
+        return getJournal.default
+    return journal
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
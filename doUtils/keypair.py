@@ -20,10 +20,6 @@ import logging
 import datetime
 import re
 import random
-import cryptography
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.backends import default_backend
 
 ###############################################################################
 
@@ -37,6 +33,7 @@ class Keypair():
     """
     Generate an RSA keypair.
 
+    >>> import cryptography.hazmat.backends.openssl.rsa
     >>> kp = Keypair()
     >>> kp.name.endswith(".pem")
     True
@@ -49,6 +46,11 @@ class Keypair():
     """
 
     def __init__(self):
+        # cryptography is imported here rather than at top, to keep
+        # "import doUtils" quick.
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.backends import default_backend
         timestamp = "{:%Y%m%d_%H%M.%f}".format(datetime.datetime.now())
         self.name = "key" + timestamp + ".pem"
         # generate rsa key:
@@ -87,6 +89,7 @@ class Keypair():
             HOME/Downloads.
 
         """
+        from cryptography.hazmat.primitives import serialization
         self.pemFilePathnameAsStr = pemFilePathname or os.path.join(os.environ["HOME"], "Downloads", self.name)
         self.passphraseAsStr = self.genPassphrase() if passPhrase == "GENERATE" else passPhrase
         if self.passphraseAsStr == "":
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.parallelSsh
+   :platform: Unix
+   :synopsis: Run a command on many hosts at once (like pssh).
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+Run a command on many hosts at once (like pssh).
+
+Looping over droplets with SshConn() and do() takes the sum of their
+times; runOnAll() runs the command on up to maxParallel hosts at once,
+so a fan-out takes about as long as its slowest host (and a host that
+hangs costs at most the timeout).  Results come back as each host
+finishes, and summarizeResults() groups them by exit status and output:
+
+EG:
+
+    results = list(runOnAll(fleet, 'uptime', timeout=20))
+    summary = summarizeResults(results)
+    print(summary['failed'], summary['timedOut'])
+    for output, hosts in summary['byOutput'].items():
+        print(len(hosts), "hosts:", output)
+
+Connections come from an SshConnPool (see sshConn.py), so repeated
+fan-outs over the same hosts, eg health checks, don't pay for ssh
+handshakes again.
+
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+import concurrent.futures
+from doUtils.sshConn import SshConnPool, drainOutput
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+DefaultUser = 'adminutil'
+
+
+def hostParms(host, user, keyFname):
+    """(host, user, keyFname) for a host given as an address, or as a
+    dictionary from makeDroplet()."""
+    if isinstance(host, dict):
+        return host['ip address'], host['username'], host['pemFilePathname']
+    return host, user, keyFname
+
+
+class ClosingPool:
+    """
+    runOnAll()'s own pool, which it closes when the results are done --
+    without waiting for workers that timed out, one of which may still
+    be in get() then; its connection's closed at once rather than left
+    in the pool.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def get(self, host, user, keyFname=None, port=22):
+        sConn = self.pool.get(host, user, keyFname=keyFname, port=port)
+        with self.lock:
+            if not self.closed:
+                return sConn
+        self.pool.discard(host, user, keyFname, port)
+        raise RuntimeError("connection pool closed while connecting to {}".format(host))
+
+    def discard(self, host, user, keyFname=None, port=22):
+        self.pool.discard(host, user, keyFname, port)
+
+    def closeAll(self):
+        with self.lock:
+            self.closed = True
+        self.pool.closeAll()
+
+
+def runOnHost(pool, host, user, keyFname, cmd, timeout=None, port=22):
+    """Run cmd on one host, giving up after timeout seconds.
+
+    Returns : dict
+        'host'; 'status' (exit status, or None if the command didn't
+        finish), 'stdout', 'stderr' (strings), 'secs', and 'error'
+        (None, 'timeout', or what went wrong).
+    """
+    result = {'host': host, 'status': None, 'stdout': '', 'stderr': '', 'secs': None, 'error': None}
+    got = {}    # the worker's; copied to result only if it finishes in time
+    channels = []
+    start = time.time()
+
+    def work():
+        try:
+            sConn = pool.get(host, user, keyFname=keyFname, port=port)
+            _in, out, err = sConn.do(cmd)
+            channels.append(out.channel)
+            stdout, stderr = drainOutput(out, err)
+            got['status'] = out.channel.recv_exit_status()
+            got['stdout'] = stdout.decode('utf-8', 'replace')
+            got['stderr'] = stderr.decode('utf-8', 'replace')
+        except Exception as e:
+            got['error'] = "{}: {}".format(type(e).__name__, e)
+            pool.discard(host, user, keyFname, port)
+
+    worker = threading.Thread(target=work, name='runOnHost-{}'.format(host), daemon=True)
+    worker.start()
+    worker.join(timeout)
+    result['secs'] = time.time() - start
+    if not worker.is_alive():
+        result.update(got)
+    else:
+        result['error'] = 'timeout'
+        for channel in channels:
+            try:
+                channel.close()
+            except Exception as e:
+                log.info("closing the channel to {}: {}".format(host, e))
+    return result
+
+
+def runOnAll(hosts, cmd, user=DefaultUser, keyFname=None, port=22, maxParallel=32, timeout=60, pool=None):
+    """Run a command on each of hosts, up to maxParallel at a time.
+
+    hosts : list of string or dictionary
+        Addresses; or dictionaries from makeDroplet() (which say their
+        own user and key file).
+
+    cmd : string
+
+    user, keyFname : string
+        Who to log in as, with what key, where hosts are addresses.
+
+    maxParallel : int
+        How many hosts to run on at once.
+
+    timeout : number
+        Seconds to give each host (connecting included); None for no
+        limit.
+
+    pool : SshConnPool (see sshConn.py)
+        Where connections live; defaults to a new pool, closed when
+        the results are done.
+
+    Yields : dict
+        For each host, as it finishes, its result (see runOnHost()).
+
+    >>> for r in runOnAll(['10.0.0.2', '10.0.0.3'], 'uptime', keyFname=pem):  # doctest: +SKIP
+    ...     print(r['host'], r['status'], r['stdout'])
+    """
+    hosts = list(hosts)
+    ownPool = pool is None
+    pool = pool or ClosingPool(SshConnPool())
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(maxParallel, len(hosts)))) as executor:
+            futures = [executor.submit(runOnHost, pool, *hostParms(h, user, keyFname), cmd, timeout=timeout, port=port)
+                       for h in hosts]
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                if result['error']:
+                    log.info("{}: {}".format(result['host'], result['error']))
+                yield result
+    finally:
+        if ownPool:
+            pool.closeAll()
+
+
+def summarizeResults(results):
+    """Aggregate runOnAll()'s results.
+
+    Returns : dict
+        'ok': hosts whose command exited 0; 'failed': host -> nonzero
+        exit status; 'timedOut': hosts that took too long; 'errors':
+        host -> what went wrong (couldn't connect, etc); 'byOutput':
+        stdout -> the hosts that printed it; and 'slowestSecs'.
+
+    >>> s = summarizeResults([{'host': 'a', 'status': 0, 'stdout': 'up\\n', 'error': None, 'secs': 1.0},
+    ...                       {'host': 'b', 'status': 0, 'stdout': 'up\\n', 'error': None, 'secs': 2.0},
+    ...                       {'host': 'c', 'status': 1, 'stdout': '', 'error': None, 'secs': 0.5},
+    ...                       {'host': 'd', 'status': None, 'stdout': '', 'error': 'timeout', 'secs': 9.0}])
+    >>> s['ok'], s['failed'], s['timedOut'], s['byOutput']['up\\n']
+    (['a', 'b'], {'c': 1}, ['d'], ['a', 'b'])
+    """
+    summary = {'ok': [], 'failed': {}, 'timedOut': [], 'errors': {}, 'byOutput': {}, 'slowestSecs': 0.0}
+    for r in sorted(results, key=lambda r: str(r['host'])):
+        if r['error'] == 'timeout':
+            summary['timedOut'].append(r['host'])
+        elif r['error']:
+            summary['errors'][r['host']] = r['error']
+        elif r['status'] == 0:
+            summary['ok'].append(r['host'])
+        else:
+            summary['failed'][r['host']] = r['status']
+        if not r['error']:
+            summary['byOutput'].setdefault(r['stdout'], []).append(r['host'])
+        summary['slowestSecs'] = max(summary['slowestSecs'], r['secs'] or 0.0)
+    return summary
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
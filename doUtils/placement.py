@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.placement
+   :platform: Unix
+   :synopsis: Choose a region and droplet size to suit a job.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+Choose a region and droplet size to suit a job.
+
+The time a job takes is roughly the time to move its data between here
+and the droplet, plus the time to run.  The first depends on the
+region: a TCP connection's throughput is bounded by window/RTT, so we
+measure the round-trip time from here to each region (a TCP connect to
+the region's speedtest host), and cache the measurements for a day
+(failed ones for just a few minutes).
+The second depends on the size: how many vCPUs the job can use.  Sizes
+that don't have the CPUs and memory the job needs, or aren't offered in
+a region, are out; of the rest we pick the quickest, then the cheapest.
+
+EG:
+
+    region, sizeSlug = choosePlacement(cpus=2, memoryMb=4096, dataMb=2000)[:2]
+    dParms = makeDroplet(imageID, region=region, sizeSlug=sizeSlug)
+
+See:
+
+    * https://developers.digitalocean.com/documentation/v2/#regions
+    * https://developers.digitalocean.com/documentation/v2/#sizes
+
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import concurrent.futures
+import doUtils
+from doUtils.utils import getCacheDir
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+ProbeHostTpl = "speedtest-{}.digitalocean.com"
+ProbePort = 80
+RttCacheFname = "regionRtts.json"
+RttMaxAgeSecs = 24 * 60 * 60
+RttFailureMaxAgeSecs = 5 * 60    # an unreachable region is tried again sooner
+
+# For estimating transfer times.
+TcpWindowBytes = 4 * 1024 * 1024
+LinkBytesPerSec = 100 * 1000 * 1000
+
+###############################################################################
+
+
+class NoPlacementError(Exception):
+    message = "No region offers a droplet size meeting the job's needs"
+
+
+def probeRtt(host, port=ProbePort, nProbes=3, timeout=2):
+    """Measure the round-trip time to a host, as the time for a TCP
+    connect.
+
+    nProbes : int
+        How many connects to time; the quickest counts.
+
+    Returns : float
+        Seconds; or None if the host couldn't be reached.
+    """
+    best = None
+    for _ in range(nProbes):
+        start = time.perf_counter()
+        try:
+            with socket.create_connection((host, port), timeout=timeout):
+                rtt = time.perf_counter() - start
+        except OSError:
+            continue
+        best = rtt if best is None else min(best, rtt)
+    return best
+
+
+def regionRtts(regions, refresh=False, maxAgeSecs=RttMaxAgeSecs):
+    """Round-trip times from here to each region, measured in parallel,
+    and cached (in getCacheDir()) for maxAgeSecs -- or, for a region
+    that couldn't be reached, RttFailureMaxAgeSecs.
+
+    regions : list of string
+        Region slugs, eg ['sfo2', 'nyc3'].
+
+    refresh : bool
+        Measure again, even if the cached ones are fresh.
+
+    Returns : dict
+        Region slug -> seconds, or None if unreachable.
+    """
+    cacheFpath = os.path.join(getCacheDir(), RttCacheFname)
+    try:
+        with open(cacheFpath) as f:
+            cached = json.load(f)
+    except (IOError, ValueError):
+        cached = {}
+    now = time.time()
+
+    def isStale(r):
+        if refresh or r not in cached:
+            return True
+        return now - cached[r]['when'] > (maxAgeSecs if cached[r]['rtt'] is not None else min(maxAgeSecs, RttFailureMaxAgeSecs))
+    stale = [r for r in regions if isStale(r)]
+    if stale:
+        log.info("measuring RTT to {}...".format(", ".join(stale)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(stale)) as pool:
+            rtts = pool.map(lambda r: probeRtt(ProbeHostTpl.format(r)), stale)
+            for r, rtt in zip(stale, rtts):
+                cached[r] = {'rtt': rtt, 'when': now}
+        with open(cacheFpath + '.tmp', 'w') as f:
+            json.dump(cached, f, indent=1)
+        os.replace(cacheFpath + '.tmp', cacheFpath)
+    return {r: cached[r]['rtt'] for r in regions}
+
+
+def regionsAndSizes(refresh=False):
+    """What regions and sizes the API says are available.  Fetched once
+    per process.
+
+    Returns : tuple (list of string, list of Size objects)
+        Slugs of the available regions; and the available sizes (see
+        python-digitalocean), each with slug, vcpus, memory (MB),
+        price_hourly, and regions (slugs).
+    """
+    if refresh or not hasattr(regionsAndSizes, 'cached'):
+        manager = doUtils.getManager()
+        regions = [r.slug for r in manager.get_all_regions() if r.available]
+        sizes = [s for s in manager.get_all_sizes() if getattr(s, 'available', True)]
+        regionsAndSizes.cached = (regions, sizes)
+    return regionsAndSizes.cached
+
+
+def estimateTransferSecs(rtt, dataMb):
+    """Estimate the seconds to move dataMb megabytes over a TCP
+    connection with round-trip time rtt (seconds): a few round trips to
+    set up, then window/RTT throughput, up to the link speed.
+
+    >>> round(estimateTransferSecs(0.1, 100), 2)
+    2.68
+    >>> estimateTransferSecs(0.1, 0)
+    0.0
+
+    """
+    if not dataMb:
+        return 0.0
+    bytesPerSec = min(LinkBytesPerSec, TcpWindowBytes / rtt)
+    return 3 * rtt + dataMb * 1000 * 1000 / bytesPerSec
+
+
+def choosePlacement(cpus=1, memoryMb=512, cpuSecs=0, parallelism=None, dataMb=0, dataRegion=None,
+                    imageID=None, maxPriceHourly=None, regions=None):
+    """Choose the region and droplet size that should get a job done
+    soonest.
+
+    cpus : int
+        vCPUs the job needs, at least.
+
+    memoryMb : int
+        Memory the job needs, at least.
+
+    cpuSecs : number
+        How much computing the job does, in CPU-seconds; used to
+        estimate the run time on each size.
+
+    parallelism : int
+        How many CPUs the job can keep busy; defaults to cpus.
+
+    dataMb : number
+        Megabytes to move between here and the droplet (both ways).
+
+    dataRegion : string
+        Region where the job's data already lives (eg in a volume).
+        Only that region is considered, unless nothing there fits.
+
+    imageID : string
+        If given, only regions where the image is available count.
+
+    maxPriceHourly : number
+        Sizes costing more than this (dollars/hour) are out.
+
+    regions : list of string
+        Region slugs to consider; defaults to all available.
+
+    Returns : tuple (region, sizeSlug, estimate)
+        Region and size slugs to pass to makeDroplet(), and a dict
+        with the estimated 'transferSecs', 'runSecs', 'totalSecs', and
+        'rtt', and the 'priceHourly'.
+
+    >>> region, sizeSlug, est = choosePlacement(cpus=2, memoryMb=2048, dataMb=500)  # doctest: +SKIP
+    >>> est['totalSecs'] >= est['transferSecs']  # doctest: +SKIP
+    True
+
+    """
+    parallelism = parallelism or cpus
+    availRegions, sizes = regionsAndSizes()
+    candidateRegions = [r for r in (regions or availRegions) if r in availRegions]
+    if imageID is not None:
+        imageRegions = doUtils.getManager().get_image(imageID).regions
+        candidateRegions = [r for r in candidateRegions if r in imageRegions]
+    fitting = [s for s in sizes
+               if s.vcpus >= cpus and s.memory >= memoryMb
+               and (maxPriceHourly is None or s.price_hourly <= maxPriceHourly)]
+    if dataRegion is not None and any(dataRegion in s.regions for s in fitting) and dataRegion in candidateRegions:
+        candidateRegions = [dataRegion]
+    rtts = regionRtts(candidateRegions)
+
+    best = None
+    for region in candidateRegions:
+        if rtts[region] is None:
+            continue
+        transferSecs = estimateTransferSecs(rtts[region], dataMb)
+        for size in fitting:
+            if region not in size.regions:
+                continue
+            runSecs = cpuSecs / min(size.vcpus, parallelism)
+            totalSecs = transferSecs + runSecs
+            key = (round(totalSecs, 1), size.price_hourly)
+            if best is None or key < best[0]:
+                best = (key, region, size.slug,
+                        {'transferSecs': transferSecs, 'runSecs': runSecs, 'totalSecs': totalSecs,
+                         'rtt': rtts[region], 'priceHourly': size.price_hourly})
+    if best is None:
+        raise NoPlacementError
+    log.info("placement: {} {} ({})".format(best[1], best[2], best[3]))
+    return best[1], best[2], best[3]
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
+    else:
+        logging.basicConfig(level=logging.INFO)
+        regions, _sizes = regionsAndSizes()
+        for region, rtt in sorted(regionRtts(regions, refresh=True).items(), key=lambda kv: kv[1] or 99):
+            print("{:6} {}".format(region, "{:.1f} ms".format(rtt * 1000) if rtt is not None else "unreachable"))
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.profiling
+   :platform: Unix
+   :synopsis: Opt-in profiling of the controller: wall time, CPU time and memory per doUtils call.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+Opt-in profiling of the controller: wall time, CPU time and memory per doUtils call.
+
+When a controller driving a fleet gets slow, the time may be going to
+paramiko's crypto, yaml.dump(), RSA key generation in Keypair, or
+waiting on the API.  enable() wraps the entry points in targets (by
+default makeDroplet, makeUserData, SshConn's do, get and put, Keypair,
+and python-digitalocean's API requests), and from then on each call
+adds to its entry's totals:
+
+    * wall time (time.perf_counter)
+    * CPU time of the calling thread (time.thread_time), so other
+      threads' work isn't counted
+    * peak memory allocated during the call, above what was allocated
+      when it started (tracemalloc; with memory=False, it's not
+      started, and not measured).  tracemalloc has one peak for the
+      whole process, so a call's is only measured when no call in
+      another thread is being measured at the same time; overlapping
+      calls get None.  Even then, threads that aren't profiled count:
+      their allocating adds to a call's peak, and their freeing can
+      hide some of it.
+
+Times are inclusive: makeDroplet's include its Keypair's and API
+requests'.  disable() puts the originals back.
+
+EG:
+
+    from doUtils import profiling
+    profiling.enable(capture={'makeDroplet': 'cprofile'}, captureDir='./profiles')
+    dParms = doUtils.makeDroplet(iId, sudoUserKeys=uKeys, userData=uData)
+    ...
+    print(profiling.report())
+    profiling.writeJson('profile.json')
+    profiling.writePrometheus('/var/lib/node_exporter/doutils_calls.prom')
+    profiling.disable()
+
+Each call to a target named in capture is also profiled, by cProfile
+(written to captureDir as NAME-N.prof, for pstats or snakeviz) or by
+pyinstrument (NAME-N.html; needs the pyinstrument package).  For a
+one-off, profiled() profiles any block:
+
+    with profiling.profiled('crunch.prof'):
+        results = sched.run()
+
+A target is 'module:qualname', eg 'doUtils.sshConn:SshConn.do' or
+'yaml:dump'; it's listed under its qualname ('Keypair' for
+Keypair.__init__).  A function is also replaced in any doUtils module
+that imported it by name.
+
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import importlib
+import threading
+import contextlib
+import functools
+import tracemalloc
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+DefaultTargets = [
+    'doUtils.droplet:makeDroplet',
+    'doUtils.cloudConfig:makeUserData',
+    'doUtils.sshConn:SshConn.do',
+    'doUtils.sshConn:SshConn.get',
+    'doUtils.sshConn:SshConn.put',
+    'doUtils.sshConn:NativeSshConn.do',
+    'doUtils.sshConn:NativeSshConn.get',
+    'doUtils.sshConn:NativeSshConn.put',
+    'doUtils.keypair:Keypair.__init__',
+    'digitalocean.baseapi:BaseAPI.get_data',
+]
+
+Stats = {}              # name -> totals (see stats())
+Patched = []            # (owner, attribute, original), to undo
+Inherited = object()    # as an original: the class inherited the method
+Capture = {}            # name -> 'cprofile' or 'pyinstrument'
+CaptureDir = None
+CaptureCounts = {}
+StartedTracemalloc = False
+Lock = threading.Lock()
+Local = threading.local()   # .frames: the calls in progress in this thread; .capturing
+OpenFrames = set()          # the calls in progress, in all threads, whose memory is being measured
+
+
+def isEnabled():
+    return bool(Patched)
+
+
+def resolve(target):
+    """
+    The (owner, attribute, name) of a target: the module or class
+    holding it, its attribute name there, and the name its stats go
+    under.
+
+    >>> owner, attr, name = resolve('doUtils.keypair:Keypair.__init__')
+    >>> owner.__name__, attr, name
+    ('Keypair', '__init__', 'Keypair')
+    """
+    moduleName, _, qualname = target.partition(':')
+    if not qualname:
+        raise ValueError("target {!r} isn't 'module:qualname'".format(target))
+    owner = importlib.import_module(moduleName)
+    parts = qualname.split('.')
+    for part in parts[:-1]:
+        owner = getattr(owner, part)
+    name = qualname[:-len('.__init__')] if qualname.endswith('.__init__') else qualname
+    return owner, parts[-1], name
+
+
+def enable(targets=DefaultTargets, memory=True, capture=None, captureDir=None):
+    """
+    Start profiling: wrap each target (see above), so its calls are
+    counted and timed.
+
+    targets : list of string
+        'module:qualname' of each function or method to profile.
+
+    memory : bool
+        Whether to measure each call's peak allocation (starting
+        tracemalloc, if it's not already; that slows allocation-heavy
+        code down, by up to 2x).
+
+    capture : dict
+        Name (as in stats()) -> 'cprofile' or 'pyinstrument': profile
+        each of that target's calls, into captureDir.
+
+    captureDir : string
+        Where captured profiles go; defaults to the current directory.
+    """
+    global CaptureDir, StartedTracemalloc
+    if isEnabled():
+        disable()
+    Capture.clear()
+    Capture.update(capture or {})
+    CaptureDir = captureDir or os.getcwd()
+    if Capture:
+        os.makedirs(CaptureDir, exist_ok=True)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        StartedTracemalloc = True
+    nWrapped = 0
+    for target in targets:
+        try:
+            owner, attr, name = resolve(target)
+        except (ImportError, AttributeError, ValueError) as e:
+            log.warning("can't profile {}: {}".format(target, e))
+            continue
+        if isinstance(owner, type):
+            original = owner.__dict__.get(attr, Inherited)
+            fn = getattr(owner, attr) if original is Inherited else original
+            if isinstance(fn, (staticmethod, classmethod)):
+                wrapper = type(fn)(wrap(fn.__func__, name, memory))
+            else:
+                wrapper = wrap(fn, name, memory)
+        else:
+            original = getattr(owner, attr)
+            wrapper = wrap(original, name, memory)
+        setattr(owner, attr, wrapper)
+        Patched.append((owner, attr, original))
+        nWrapped += 1
+        if not isinstance(owner, type):
+            # Modules that did "from doUtils.X import name".
+            for mName, module in list(sys.modules.items()):
+                if module is not owner and mName.split('.')[0] == 'doUtils':
+                    for k, v in list(vars(module).items()):
+                        if v is original:
+                            setattr(module, k, wrapper)
+                            Patched.append((module, k, original))
+    log.info("profiling {} entry points".format(nWrapped))
+
+
+def disable():
+    """Stop profiling: put the originals back (the stats are kept)."""
+    global StartedTracemalloc
+    while Patched:
+        owner, attr, original = Patched.pop()
+        if original is Inherited:
+            delattr(owner, attr)
+        else:
+            setattr(owner, attr, original)
+    # And wrappers picked up since enable() (eg cached by doUtils' lazy import).
+    for mName, module in list(sys.modules.items()):
+        if mName.split('.')[0] == 'doUtils':
+            for k, v in list(vars(module).items()):
+                if callable(v) and hasattr(v, 'profiledOriginal'):
+                    setattr(module, k, v.profiledOriginal)
+    if StartedTracemalloc:
+        tracemalloc.stop()
+        StartedTracemalloc = False
+
+
+def reset():
+    """Forget the stats so far."""
+    with Lock:
+        Stats.clear()
+        CaptureCounts.clear()
+
+
+###############################################################################
+# Measuring calls.
+
+
+class Frame:
+    """A call in progress."""
+
+    __slots__ = ('startWall', 'startCpu', 'startMem', 'peakMem', 'thread')
+
+    def __init__(self, memory):
+        self.thread = threading.get_ident()
+        self.startMem = self.peakMem = None
+        if memory and tracemalloc.is_tracing():
+            with Lock:
+                others = [f for f in OpenFrames if f.thread != self.thread]
+                if others:
+                    # Resetting the peak would lose theirs, and theirs would count ours: measure neither.
+                    for f in others:
+                        f.peakMem = None
+                else:
+                    self.startMem, peak = tracemalloc.get_traced_memory()
+                    # Resetting the peak loses it for calls this one is inside of: fold it into theirs first.
+                    for f in frames():
+                        if f.peakMem is not None:
+                            f.peakMem = max(f.peakMem, peak)
+                    tracemalloc.reset_peak()
+                    self.peakMem = self.startMem
+                OpenFrames.add(self)
+        self.startCpu = time.thread_time()
+        self.startWall = time.perf_counter()
+
+    def finish(self):
+        """Returns : (wall secs, CPU secs, peak bytes allocated or None)"""
+        wall = time.perf_counter() - self.startWall
+        cpu = time.thread_time() - self.startCpu
+        with Lock:
+            OpenFrames.discard(self)
+            if self.peakMem is None or not tracemalloc.is_tracing():
+                return wall, cpu, None
+            peak = max(self.peakMem, tracemalloc.get_traced_memory()[1])
+            for f in frames():
+                if f.peakMem is not None:
+                    f.peakMem = max(f.peakMem, peak)
+        return wall, cpu, max(0, peak - self.startMem)
+
+
+def frames():
+    if not hasattr(Local, 'frames'):
+        Local.frames = []
+    return Local.frames
+
+
+def record(name, wall, cpu, peakBytes, failed):
+    with Lock:
+        s = Stats.get(name)
+        if s is None:
+            s = Stats[name] = {'calls': 0, 'errors': 0, 'wallSecs': 0.0, 'cpuSecs': 0.0, 'maxWallSecs': 0.0,
+                               'maxCpuSecs': 0.0, 'maxPeakBytes': None}
+        s['calls'] += 1
+        s['errors'] += bool(failed)
+        s['wallSecs'] += wall
+        s['cpuSecs'] += cpu
+        s['maxWallSecs'] = max(s['maxWallSecs'], wall)
+        s['maxCpuSecs'] = max(s['maxCpuSecs'], cpu)
+        if peakBytes is not None:
+            s['maxPeakBytes'] = max(s['maxPeakBytes'] or 0, peakBytes)
+
+
+def wrap(fn, name, memory):
+    """fn, counted and timed under name (and captured, if it's in Capture)."""
+
+    @functools.wraps(fn)
+    def profiledCall(*args, **kwargs):
+        kind = Capture.get(name)
+        if kind and not getattr(Local, 'capturing', False):
+            with Lock:
+                CaptureCounts[name] = n = CaptureCounts.get(name, 0) + 1
+            ext = '.html' if kind == 'pyinstrument' else '.prof'
+            capturing = profiled(os.path.join(CaptureDir, "{}-{}{}".format(name, n, ext)), kind)
+        else:
+            capturing = contextlib.nullcontext()
+        stack = frames()
+        frame = Frame(memory)
+        stack.append(frame)
+        failed = True
+        try:
+            with capturing:
+                result = fn(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            stack.pop()
+            record(name, *frame.finish(), failed)
+
+    profiledCall.profiledOriginal = fn
+    return profiledCall
+
+
+@contextlib.contextmanager
+def profiled(fpath, kind='cprofile'):
+    """
+    Profile the block, into fpath: with kind 'cprofile', as a pstats
+    file; with 'pyinstrument', as an HTML report (needs the
+    pyinstrument package).  Profiles don't nest: inside another
+    profiled block in the same thread, the inner one is skipped.
+    """
+    if getattr(Local, 'capturing', False):
+        yield
+        return
+    if kind == 'pyinstrument':
+        import pyinstrument    # optional dependency
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+    elif kind == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        raise ValueError("unknown profiler {!r}: 'cprofile' or 'pyinstrument'".format(kind))
+    Local.capturing = True
+    try:
+        yield
+    finally:
+        Local.capturing = False
+        if kind == 'pyinstrument':
+            profiler.stop()
+            with open(fpath, 'w') as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            profiler.dump_stats(fpath)
+        log.info("profile written to {}".format(fpath))
+
+
+###############################################################################
+# Results.
+
+
+def stats():
+    """
+    The totals so far.
+
+    Returns : dict
+        Name -> dict of 'calls', 'errors' (calls that raised),
+        'wallSecs', 'cpuSecs' (totals), 'meanWallSecs', 'meanCpuSecs',
+        'maxWallSecs', 'maxCpuSecs', and 'maxPeakBytes' (the most any
+        one call allocated at once; None if memory wasn't measured, or
+        no call's could be -- see above).
+    """
+    with Lock:
+        result = {name: dict(s) for name, s in Stats.items()}
+    for s in result.values():
+        s['meanWallSecs'] = s['wallSecs'] / s['calls']
+        s['meanCpuSecs'] = s['cpuSecs'] / s['calls']
+    return result
+
+
+def report(byWhat='wallSecs'):
+    """
+    The stats as a table, largest byWhat first, eg:
+
+        name                      calls   wall s    cpu s  mean ms  max peak
+        makeDroplet                  10    41.25     2.10   4125.0    2.1 MB
+        BaseAPI.get_data             62    39.80     0.31    641.9  180.4 kB
+        Keypair                      10     1.72     1.71    172.0   24.3 kB
+    """
+    def size(n):
+        if n is None:
+            return '-'
+        if n < 1024:
+            return "{} B".format(n)
+        if n < 1024 * 1024:
+            return "{:.1f} kB".format(n / 1024)
+        return "{:.1f} MB".format(n / (1024 * 1024))
+
+    rows = sorted(stats().items(), key=lambda kv: -kv[1][byWhat])
+    lines = ["{:<24} {:>6} {:>8} {:>8} {:>8} {:>9}".format('name', 'calls', 'wall s', 'cpu s', 'mean ms', 'max peak')]
+    for name, s in rows:
+        lines.append("{:<24} {:>6} {:>8.2f} {:>8.2f} {:>8.1f} {:>9}".format(
+            name, s['calls'], s['wallSecs'], s['cpuSecs'], s['meanWallSecs'] * 1000, size(s['maxPeakBytes'])))
+    return "\n".join(lines)
+
+
+def writeJson(fpath):
+    """Write stats() to fpath, as JSON."""
+    with open(fpath, 'w') as f:
+        json.dump({'time': time.time(), 'pid': os.getpid(), 'stats': stats()}, f, indent=1, sort_keys=True)
+
+
+def writePrometheus(fpath, metric='doutils_call'):
+    """Write stats() to fpath (replacing it atomically), for
+    node_exporter's textfile collector: counters METRIC_total,
+    METRIC_errors_total, METRIC_wall_seconds_total and
+    METRIC_cpu_seconds_total, and a gauge METRIC_max_peak_bytes, each
+    labelled with the entry point's name."""
+    series = [('total', 'counter', 'Calls to each doUtils entry point.', 'calls'),
+              ('errors_total', 'counter', 'Calls that raised an exception.', 'errors'),
+              ('wall_seconds_total', 'counter', 'Wall-clock seconds spent in each entry point.', 'wallSecs'),
+              ('cpu_seconds_total', 'counter', 'CPU seconds spent in each entry point, by its calling thread.', 'cpuSecs'),
+              ('max_peak_bytes', 'gauge', 'Most memory allocated at once during one call.', 'maxPeakBytes')]
+    current = stats()
+    lines = []
+    for suffix, kind, helpText, key in series:
+        lines += ["# HELP {}_{} {}".format(metric, suffix, helpText), "# TYPE {}_{} {}".format(metric, suffix, kind)]
+        lines += ['{}_{}{{name="{}"}} {}'.format(metric, suffix, name, s[key])
+                  for name, s in sorted(current.items()) if s[key] is not None]
+    with open(fpath + '.tmp', 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(fpath + '.tmp', fpath)
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
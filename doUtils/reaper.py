@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.reaper
+   :platform: Unix
+   :synopsis: reap -- find, and delete, droplets, keys and key files doUtils left behind.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+reap -- find, and delete, droplets, keys and key files doUtils left behind.
+
+Every SshKeypair registers an ssh key with Digital Ocean and writes a
+key file (~/Downloads/keyTIMESTAMP.pem); failed runs leave droplets
+running; leasing and journaling leave tags.  Nothing cleans them up,
+and long lists make every listing slower.  reap() finds what doUtils
+made -- droplets named DropletName or tagged doutils*, keys and key
+files named key*.pem, and doutils-* tags -- and applies its policies:
+
+    * droplets older than maxAgeHours, unless leased (in use); leased
+      ones once the lease is older than maxLeaseHours (its holder has
+      likely died).  Droplets tagged doutils-keep are never reaped.
+    * keys (registered ones) older than maxAgeHours; droplets don't
+      need them once made.
+    * key files older than maxAgeHours, unless a droplet that's being
+      kept may need one to be logged in to.
+    * data volumes (tagged doutils, see volumes.py) older than
+      maxAgeHours, unless attached to a droplet that's being kept.
+    * doutils-* tags with no droplets left (launch, lease, key and
+      cloud-config tags).
+
+By default it's a dry run: it reports what it would delete, and why,
+and deletes nothing.
+
+EG:
+
+    report = reap(maxAgeHours=12)
+    print(formatReport(report))
+    reap(maxAgeHours=12, dryRun=False)
+
+Deleting is kept to few API calls, made at most ratePerSec a second:
+the droplets are tagged (up to TagBatch per call) with a one-off tag,
+and all deleted with one call by that tag; keys, volumes and tags,
+which can only be deleted one at a time, are deleted maxParallel at a
+time.
+Journaled launches (see journal.py) whose droplets are reaped are
+marked abandoned.
+
+"""
+
+import os
+import re
+import sys
+import time
+import glob
+import logging
+import calendar
+import datetime
+import threading
+import concurrent.futures
+import doUtils
+import doUtils.utils
+from doUtils.droplet import DropletName, ReuseTag, KeyTagPrefix, LeaseTagPrefix, keyNameFromTag, leaseTime
+from doUtils.journal import getJournal, FinishedPhases
+from doUtils.volumes import VolumeTag
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+KeepTag = 'doutils-keep'
+ReapTagPrefix = 'doutils-reap-'
+KeyNameRe = re.compile(r'^key(\d{8}_\d{4}\.\d{6})\.pem$')
+TagBatch = 50               # droplets tagged per API call
+PemMatchSecs = 15 * 60      # a droplet made within this long after a key may use it
+LeaseGraceSecs = 60
+DetachWaitSecs = 30         # for reaped droplets' volumes to be detached
+DefaultMaxAgeHours = 24
+DefaultMaxLeaseHours = 24
+
+
+class RateLimiter:
+    """At most perSec calls to wait() return per second, across threads."""
+
+    def __init__(self, perSec):
+        self.interval = 1.0 / perSec if perSec else 0.0
+        self.nextAt = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            at = max(now, self.nextAt)
+            self.nextAt = at + self.interval
+        time.sleep(at - now)
+
+
+def keyTime(keyName):
+    """
+    When a key was made, from its name (see keypair.py); or None.
+
+    >>> keyTime('key20180401_1200.123456.pem') == time.mktime((2018, 4, 1, 12, 0, 0, 0, 0, -1)) + 0.123456
+    True
+    >>> keyTime('id_rsa.pem') is None
+    True
+    """
+    m = KeyNameRe.match(keyName)
+    if not m:
+        return None
+    return datetime.datetime.strptime(m.group(1), '%Y%m%d_%H%M.%f').timestamp()
+
+
+def isOurs(droplet):
+    return droplet.name == DropletName or any(t == ReuseTag or t.startswith('doutils-') for t in droplet.tags)
+
+
+def apiTime(stamp):
+    """Seconds since the epoch, from the API's times, eg '2018-04-01T12:00:00Z'."""
+    return calendar.timegm(time.strptime(stamp, '%Y-%m-%dT%H:%M:%SZ'))
+
+
+def dropletVerdict(droplet, now, maxAgeSecs, maxLeaseSecs):
+    """Why droplet should be reaped, or None to keep it."""
+    if KeepTag in droplet.tags:
+        return None
+    leases = sorted(t for t in droplet.tags if t.startswith(LeaseTagPrefix))
+    if leases:
+        leasedAt = leaseTime(leases[-1])    # the latest: earlier ones may be expired leftovers (see droplet.leaseTags())
+        if leasedAt is not None and now - leasedAt > maxLeaseSecs:
+            return "leased {:.1f}h ago".format((now - leasedAt) / 3600)
+        return None
+    age = now - apiTime(droplet.created_at)
+    if age > maxAgeSecs:
+        return "made {:.1f}h ago".format(age / 3600)
+    return None
+
+
+def findStale(maxAgeHours=DefaultMaxAgeHours, maxLeaseHours=DefaultMaxLeaseHours, keyDir=None, journal=None, now=None):
+    """
+    Find what reap() would delete (see reap(), which takes the same
+    arguments).
+
+    Returns : dict
+        'droplets', 'keys', 'pems', 'volumes', 'tags' -- lists of
+        what's stale, each a dict with 'why' (and 'droplet', 'key',
+        'path', 'id' or 'tag' respectively, and 'id' and 'name' for
+        droplets, keys and volumes);
+        'kept' -- how many of each of ours are being kept.
+    """
+    now = time.time() if now is None else now
+    maxAgeSecs, maxLeaseSecs = maxAgeHours * 3600, maxLeaseHours * 3600
+    keyDir = keyDir or os.path.join(os.environ["HOME"], "Downloads")
+    manager = doUtils.getManager()
+
+    ours = [d for d in manager.get_all_droplets() if isOurs(d)]
+    staleDroplets, keptDroplets = [], []
+    for d in ours:
+        why = dropletVerdict(d, now, maxAgeSecs, maxLeaseSecs)
+        if why:
+            staleDroplets.append({'droplet': d, 'id': d.id, 'name': d.name, 'why': why})
+        else:
+            keptDroplets.append(d)
+    reapedIds = {s['id'] for s in staleDroplets}
+
+    staleKeys, keptKeys = [], 0
+    for k in manager.get_all_sshkeys():
+        made = keyTime(k.name or '')
+        if made is None:
+            continue
+        if now - made > maxAgeSecs:
+            staleKeys.append({'key': k, 'id': k.id, 'name': k.name, 'why': "made {:.1f}h ago".format((now - made) / 3600)})
+        else:
+            keptKeys += 1
+
+    # Key files kept droplets may need: named by their key tags, or in
+    # the journal, or (not knowing) any made shortly before them.
+    needed, unknownMadeAt = set(), []
+    jrnl = getJournal(journal)
+    launches = jrnl.launches() if jrnl is not None else {}
+    pemsByDroplet = {s.get('droplet'): os.path.basename(s['pemFilePathname'])
+                     for s in launches.values() if s.get('droplet') and s.get('pemFilePathname')}
+    for d in keptDroplets:
+        names = [keyNameFromTag(t) for t in d.tags if t.startswith(KeyTagPrefix)]
+        if d.id in pemsByDroplet:
+            names.append(pemsByDroplet[d.id])
+        if names:
+            needed.update(names)
+        else:
+            unknownMadeAt.append(apiTime(d.created_at))
+    stalePems, keptPems = [], 0
+    for path in sorted(glob.glob(os.path.join(keyDir, 'key*.pem'))):
+        name = os.path.basename(path)
+        made = keyTime(name)
+        if made is None:
+            continue
+        if now - made > maxAgeSecs and name not in needed and not any(0 <= t - made <= PemMatchSecs for t in unknownMadeAt):
+            stalePems.append({'path': path, 'why': "made {:.1f}h ago".format((now - made) / 3600)})
+        else:
+            keptPems += 1
+
+    staleVolumes, keptVolumes = [], 0
+    keptIds = {d.id for d in keptDroplets}
+    for v in manager.get_all_volumes():
+        if VolumeTag not in (v.tags or []) or KeepTag in v.tags:
+            continue
+        age = now - apiTime(v.created_at)
+        if age > maxAgeSecs and not keptIds.intersection(v.droplet_ids or []):
+            staleVolumes.append({'id': v.id, 'name': v.name, 'why': "made {:.1f}h ago".format(age / 3600)})
+        else:
+            keptVolumes += 1
+
+    # Tags of ours that will have no droplets left.
+    tagged = {}
+    for d in ours:
+        for t in d.tags:
+            tagged.setdefault(t, set()).add(d.id)
+    staleTags = []
+    for tag in manager.get_all_tags():
+        if not tag.name.startswith('doutils-') or tag.name == KeepTag:
+            continue
+        if tag.name.startswith(LeaseTagPrefix) and now - (leaseTime(tag.name) or 0) < LeaseGraceSecs:
+            continue    # may be being added to a droplet (see droplet.leaseDroplet())
+        left = tagged.get(tag.name, set()) - reapedIds
+        if not left:
+            staleTags.append({'tag': tag.name, 'why': "no droplets left" if tag.name in tagged else "no droplets"})
+
+    return {'droplets': staleDroplets, 'keys': staleKeys, 'pems': stalePems, 'volumes': staleVolumes, 'tags': staleTags,
+            'kept': {'droplets': len(keptDroplets), 'keys': keptKeys, 'pems': keptPems, 'volumes': keptVolumes}}
+
+
+def deleteDroplets(droplets, limiter):
+    """Delete droplets with a few calls: tag them, then delete by tag."""
+    import digitalocean    # here rather than at top, to keep "import doUtils" quick
+    if not droplets:
+        return
+    reapTag = "{}{:x}".format(ReapTagPrefix, time.time_ns())
+    tag = digitalocean.Tag(token=doUtils.getApiToken(), name=reapTag, **doUtils.utils.getApiEndpointKwargs())
+    limiter.wait()
+    tag.create()
+    for i in range(0, len(droplets), TagBatch):
+        limiter.wait()
+        tag.add_droplets([str(d.id) for d in droplets[i:i + TagBatch]])
+    limiter.wait()
+    doUtils.getManager().get_data("droplets?tag_name={}".format(reapTag), type=digitalocean.baseapi.DELETE)
+    limiter.wait()
+    tag.delete()
+
+
+def deleteEach(items, delete, limiter, maxParallel):
+    """delete(item) for each item, maxParallel at a time, rate-limited;
+    returns the errors, as (item, error message)."""
+    def deleteOne(item):
+        limiter.wait()
+        delete(item)
+
+    errors = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, maxParallel)) as executor:
+        futures = {executor.submit(deleteOne, item): item for item in items}
+        for future in concurrent.futures.as_completed(futures):
+            if future.exception() is not None:
+                errors.append((futures[future], "{}: {}".format(type(future.exception()).__name__, future.exception())))
+    return errors
+
+
+def reap(maxAgeHours=DefaultMaxAgeHours, maxLeaseHours=DefaultMaxLeaseHours, dryRun=True, keyDir=None, journal=None,
+         ratePerSec=5, maxParallel=8, now=None):
+    """
+    Find droplets, keys, key files and tags doUtils left behind, and
+    (unless dryRun) delete them.
+
+    maxAgeHours : number
+        Reap droplets, keys and key files older than this.
+
+    maxLeaseHours : number
+        Reap leased droplets whose lease is older than this.
+
+    dryRun : bool
+        Just report; delete nothing.
+
+    keyDir : string
+        Where the key files are; defaults to ~/Downloads.
+
+    journal : LaunchJournal (see journal.py), or False
+        Journal of launches, to find which key files droplets need, and
+        to mark reaped droplets' launches abandoned.  Defaults to the
+        one in getCacheDir(); False for none.
+
+    ratePerSec : number
+        At most this many API calls a second.
+
+    maxParallel : int
+        At most this many API calls at once.
+
+    Returns : dict
+        As from findStale(), plus 'dryRun', and 'errors' -- a list of
+        what couldn't be deleted, and why.
+    """
+    report = findStale(maxAgeHours, maxLeaseHours, keyDir, journal, now)
+    report.update(dryRun=dryRun, errors=[])
+    if dryRun:
+        return report
+    import digitalocean    # here rather than at top, to keep "import doUtils" quick
+    limiter = RateLimiter(ratePerSec)
+    errors = report['errors']
+
+    droplets = [s['droplet'] for s in report['droplets']]
+    try:
+        deleteDroplets(droplets, limiter)
+        log.info("reaped {} droplets".format(len(droplets)))
+    except Exception as e:
+        errors.append(('droplets', "{}: {}".format(type(e).__name__, e)))
+    jrnl = getJournal(journal)
+    if jrnl is not None and droplets:
+        reapedIds = {d.id for d in droplets}
+        for state in jrnl.launches().values():
+            if state.get('droplet') in reapedIds and state['phase'] not in FinishedPhases:
+                jrnl.record(state['launch'], 'abandoned', reason='reaped')
+
+    keyErrors = deleteEach([s['key'] for s in report['keys']], lambda k: k.destroy(), limiter, maxParallel)
+    errors.extend(("key {}".format(k.name), why) for k, why in keyErrors)
+
+    endPoint = doUtils.utils.getApiEndpointKwargs()
+
+    def deleteVolume(volumeId):
+        volume = digitalocean.Volume(id=volumeId, token=doUtils.getApiToken(), **endPoint)
+        giveUpAt = time.time() + DetachWaitSecs
+        while True:
+            try:
+                return volume.destroy()
+            except digitalocean.DataReadError:    # still attached to a droplet being deleted
+                if time.time() > giveUpAt:
+                    raise
+                time.sleep(2)
+                limiter.wait()
+    volumeErrors = deleteEach([s['id'] for s in report['volumes']], deleteVolume, limiter, maxParallel)
+    errors.extend(("volume {}".format(vId), why) for vId, why in volumeErrors)
+
+    tagErrors = deleteEach([s['tag'] for s in report['tags']],
+                           lambda name: digitalocean.Tag(token=doUtils.getApiToken(), name=name, **endPoint).delete(),
+                           limiter, maxParallel)
+    errors.extend(("tag {}".format(name), why) for name, why in tagErrors)
+
+    for s in report['pems']:
+        try:
+            os.remove(s['path'])
+        except OSError as e:
+            errors.append((s['path'], str(e)))
+    return report
+
+
+def formatReport(report):
+    """reap()'s report, as text."""
+    lines = ["{}: {} droplets, {} keys, {} key files, {} volumes, {} tags".format(
+        "Would reap" if report.get('dryRun', True) else "Reaped",
+        len(report['droplets']), len(report['keys']), len(report['pems']), len(report['volumes']), len(report['tags']))]
+    for s in report['droplets']:
+        lines.append("  droplet {} {} -- {}".format(s['id'], s['name'], s['why']))
+    for s in report['keys']:
+        lines.append("  key {} {} -- {}".format(s['id'], s['name'], s['why']))
+    for s in report['pems']:
+        lines.append("  key file {} -- {}".format(s['path'], s['why']))
+    for s in report['volumes']:
+        lines.append("  volume {} {} -- {}".format(s['id'], s['name'], s['why']))
+    for s in report['tags']:
+        lines.append("  tag {} -- {}".format(s['tag'], s['why']))
+    kept = report['kept']
+    lines.append("Kept: {} droplets, {} keys, {} key files, {} volumes".format(kept['droplets'], kept['keys'], kept['pems'],
+                                                                             kept['volumes']))
+    for what, why in report.get('errors', []):
+        lines.append("  couldn't delete {}: {}".format(what, why))
+    return "\n".join(lines)
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.remoteJob
+   :platform: Unix
+   :synopsis: class RemoteJob -- run a script detached on a droplet, and snarf the results.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+class RemoteJob -- run a script detached on a droplet, and snarf the results.
+
+The job runs under nohup/setsid (or systemd-run), so it carries on if
+the ssh connection drops; a new RemoteJob with the same jobId can
+re-attach to it later.  Everything for a job lives in one directory on
+the droplet (~/doUtilsJobs/JOBID): the script, its inputs, its
+stdout.log and stderr.log, and the pid and exitcode files.
+
+Inputs go up, and outputs come back, as a single tar stream over one
+ssh channel, instead of a round trip per file over sftp.
+
+"""
+
+import os
+import sys
+import time
+import shlex
+import logging
+import datetime
+import tarfile
+from doUtils.sshConn import drainOutput
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+JobsDir = 'doUtilsJobs'     # relative to the remote user's home
+ScriptName = 'job.sh'
+ExitCodeName = 'exitcode'
+PidName = 'pid'
+StdoutName = 'stdout.log'
+StderrName = 'stderr.log'
+
+# Wraps the script so that its exit code is recorded, atomically, when
+# it finishes.
+JobWrapper = "{interp} ./{script} > {stdout} 2> {stderr}; echo $? > {exitcode}.tmp && mv {exitcode}.tmp {exitcode}"
+
+###############################################################################
+
+
+class RemoteJobError(Exception):
+    message = "Remote job operation failed"
+
+
+def runCmd(sshConn, cmd):
+    """Run cmd via sshConn; wait for it to finish.
+
+    Returns : tuple (int, string, string)
+        Exit status, stdout, and stderr of the command.
+    """
+    _in, out, err = sshConn.do(cmd)
+    outData, errData = drainOutput(out, err)
+    status = out.channel.recv_exit_status()
+    return status, outData.decode('utf-8', 'replace'), errData.decode('utf-8', 'replace')
+
+
+def tarPut(sshConn, localPaths, remoteDir, compress=True):
+    """Send local files and directories into remoteDir on the host, as
+    one tar stream (rather than a file at a time over sftp).
+
+    localPaths : list of string
+        Each lands in remoteDir under its basename.
+    """
+    zFlag = 'z' if compress else ''
+    stdin, out, err = sshConn.do("mkdir -p {0} && tar x{1}f - -C {0}".format(shlex.quote(remoteDir), zFlag))
+    with tarfile.open(fileobj=stdin, mode='w|gz' if compress else 'w|') as tar:
+        for p in localPaths:
+            tar.add(p, arcname=os.path.basename(p.rstrip(os.sep)))
+    stdin.flush()
+    stdin.channel.shutdown_write()
+    _outData, errData = drainOutput(out, err)
+    if out.channel.recv_exit_status() != 0:
+        raise RemoteJobError("tar upload to {} failed: {}".format(remoteDir, errData.decode('utf-8', 'replace')))
+
+
+def tarGet(sshConn, remoteDir, remotePaths, localDir, compress=True):
+    """Fetch files and directories from remoteDir on the host into
+    localDir, as one tar stream.
+
+    remotePaths : list of string
+        Relative to remoteDir.
+    """
+    zFlag = 'z' if compress else ''
+    paths = " ".join(shlex.quote(p) for p in remotePaths)
+    _in, out, err = sshConn.do("tar c{}f - -C {} {}".format(zFlag, shlex.quote(remoteDir), paths))
+    os.makedirs(localDir, exist_ok=True)
+    with tarfile.open(fileobj=out, mode='r|gz' if compress else 'r|') as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(localDir, filter='data')
+        else:   # pragma: no cover
+            tar.extractall(localDir)
+    _outData, errData = drainOutput(out, err)    # (tar's trailing padding, and any complaints)
+    if out.channel.recv_exit_status() != 0:
+        raise RemoteJobError("tar download from {} failed: {}".format(remoteDir, errData.decode('utf-8', 'replace')))
+
+###############################################################################
+
+
+class RemoteJob:
+    """
+    A script run detached on a host.
+
+    Operations:
+        submit -- send script and inputs, and start the job
+        status -- 'not started', 'running', 'done', or 'lost'
+        exitCode -- the script's exit code, once done
+        readLog -- get the log output since some offset
+        streamLog -- yield log output as it appears, until done
+        wait -- until done
+        fetchResults -- bring the outputs back
+        cleanup -- remove the job's directory on the host
+
+    EG:
+
+    >>> import doUtils
+    >>> sc = doUtils.SshConn(dParms['ip address'], 'adminutil', keyFname=dParms['pemFilePathname'])  # doctest: +SKIP
+    >>> job = RemoteJob(sc, 'crunch.sh', inputs=['data.csv'], outputs=['results'])  # doctest: +SKIP
+    >>> job.submit()  # doctest: +SKIP
+    >>> for chunk in job.streamLog():  # doctest: +SKIP
+    ...     print(chunk, end='')
+    >>> job.exitCode()  # doctest: +SKIP
+    0
+    >>> job.fetchResults('./crunched')  # doctest: +SKIP
+    """
+
+    def __init__(self, sshConn, script=None, inputs=None, outputs=None, jobId=None, interpreter='bash', launcher='nohup'):
+        """
+        Define a job; or with jobId, re-attach to one already
+        submitted.
+
+        sshConn : SshConn object (see sshConn.py)
+
+        script : string
+            Local pathname of the script to run.
+
+        inputs : list of string
+            Local files and directories the script needs.  They're
+            put alongside the script, under their basenames.
+
+        outputs : list of string
+            Files and directories, relative to the job's directory,
+            to bring back. Defaults to the whole job directory.
+
+        jobId : string
+            Name for the job.  Defaults to one made from the time.
+
+        interpreter : string
+            What runs the script on the host.
+
+        launcher : string
+            'nohup' (nohup plus setsid), or 'systemd-run' (a
+            transient systemd unit, via sudo).
+        """
+        if launcher not in ('nohup', 'systemd-run'):
+            raise ValueError("launcher must be 'nohup' or 'systemd-run'")
+        self.sshConn = sshConn
+        self.script = script
+        self.inputs = inputs or []
+        self.outputs = outputs or ['.']
+        self.jobId = jobId or "job{:%Y%m%d_%H%M%S.%f}".format(datetime.datetime.now())
+        self.jobDir = "{}/{}".format(JobsDir, self.jobId)
+        self.interpreter = interpreter
+        self.launcher = launcher
+
+    def remotePath(self, name):
+        return "{}/{}".format(self.jobDir, name)
+
+    def submit(self):
+        """Send the script and inputs to the host, and start the job
+        running, detached from this ssh connection."""
+        if not self.script:
+            raise RemoteJobError("No script to submit for job {}".format(self.jobId))
+        log.info("sending job {} to {}...".format(self.jobId, self.jobDir))
+        status, _out, err = runCmd(self.sshConn, "mkdir -p {}".format(shlex.quote(self.jobDir)))
+        if status != 0:
+            raise RemoteJobError("Couldn't make {}: {}".format(self.jobDir, err))
+        self.sshConn.put(self.script, self.remotePath(ScriptName))
+        if self.inputs:
+            tarPut(self.sshConn, self.inputs, self.jobDir)
+
+        wrapped = JobWrapper.format(interp=self.interpreter, script=ScriptName, stdout=StdoutName, stderr=StderrName, exitcode=ExitCodeName)
+        qDir = shlex.quote(self.jobDir)
+        if self.launcher == 'nohup':
+            cmd = "cd {} && {{ nohup setsid sh -c {} > /dev/null 2>&1 < /dev/null & echo $! > {}; }}".format(qDir, shlex.quote(wrapped), PidName)
+        else:
+            unit = "doUtils-{}".format(self.jobId.replace('.', '_'))
+            cmd = ("cd {0} && sudo systemd-run --quiet --unit={1} --uid=$(id -u) --gid=$(id -g) --working-directory=$PWD sh -c {2}"
+                   " && systemctl show -p MainPID --value {1} > {3}").format(qDir, unit, shlex.quote(wrapped), PidName)
+        log.info("starting job {}...".format(self.jobId))
+        status, _out, err = runCmd(self.sshConn, cmd)
+        if status != 0:
+            raise RemoteJobError("Couldn't start job {}: {}".format(self.jobId, err))
+
+    def status(self):
+        """
+        Returns : string
+            'not started' (no job directory), 'running', 'done', or
+            'lost' (not running, but never recorded an exit code --
+            eg the droplet rebooted).
+        """
+        qDir = shlex.quote(self.jobDir)
+        # (systemd-run's MainPID is 0 for a unit that's already gone --
+        # and "kill -0 0" always succeeds.)
+        cmd = ("if [ ! -d {0} ]; then echo 'not started';"
+               " elif [ -e {0}/{1} ]; then echo done;"
+               " elif pid=$(cat {0}/{2} 2>/dev/null) && [ \"$pid\" -gt 0 ] 2>/dev/null && kill -0 \"$pid\" 2>/dev/null;"
+               " then echo running;"
+               " else echo lost; fi").format(qDir, ExitCodeName, PidName)
+        _status, out, _err = runCmd(self.sshConn, cmd)
+        return out.strip()
+
+    def isDone(self):
+        return self.status() in ('done', 'lost')
+
+    def exitCode(self):
+        """
+        Returns : int
+            The script's exit code; or None if it's not done.
+        """
+        status, out, _err = runCmd(self.sshConn, "cat {}".format(shlex.quote(self.remotePath(ExitCodeName))))
+        return int(out.strip()) if status == 0 else None
+
+    def readLog(self, offset=0, which=StdoutName):
+        """Read a log, from offset onwards.
+
+        which : string
+            'stdout.log' or 'stderr.log'.
+
+        Returns : tuple (string, int)
+            The text read, and the offset to read from next time.
+        """
+        _in, out, _err = self.sshConn.do("tail -c +{} {} 2>/dev/null".format(offset + 1, shlex.quote(self.remotePath(which))))
+        data = out.read()
+        # (Offsets are in bytes; a multibyte character split across
+        # reads comes out as a replacement character.)
+        return data.decode('utf-8', 'replace'), offset + len(data)
+
+    def streamLog(self, pollSecs=2, which=StdoutName):
+        """Yield the log's output as it appears, until the job is done.
+
+        pollSecs : number
+            Seconds between checks.
+        """
+        offset = 0
+        while True:
+            done = self.isDone()    # check before the read, so we don't miss the tail
+            text, offset = self.readLog(offset, which)
+            if text:
+                yield text
+            if done:
+                return
+            time.sleep(pollSecs)
+
+    def wait(self, pollSecs=5, timeout=None):
+        """Wait until the job's done.
+
+        Returns : int
+            The exit code, or None if timed out (or the job was lost).
+        """
+        start = time.time()
+        while not self.isDone():
+            if timeout is not None and time.time() - start > timeout:
+                return None
+            time.sleep(pollSecs)
+        return self.exitCode()
+
+    def fetchResults(self, localDir, compress=True):
+        """Bring the outputs back into localDir, in one tar stream.
+
+        compress : bool
+            gzip the stream -- worthwhile unless the outputs are
+            already compressed.
+        """
+        log.info("fetching results of job {} to {}...".format(self.jobId, localDir))
+        tarGet(self.sshConn, self.jobDir, self.outputs, localDir, compress=compress)
+
+    def cleanup(self):
+        """Remove the job's directory on the host."""
+        runCmd(self.sshConn, "rm -rf {}".format(shlex.quote(self.jobDir)))
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
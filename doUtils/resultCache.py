@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.resultCache
+   :platform: Unix
+   :synopsis: class ResultCache -- remember remote jobs' results, keyed by what went into them.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+class ResultCache -- remember remote jobs' results, keyed by what went into them.
+
+A job's results depend (we assume) only on its script, its inputs, and
+the machine it ran on -- the image and cloud-config.  So the hash of
+those is the key to a local cache of results, and running the same
+job again is a lookup:
+
+    def connect():
+        dParms = makeDroplet(imageID, sudoUserKeys=uKeys, userData=uData)
+        return waitUntilReady(dParms)
+
+    result = runCached('crunch.sh', ['data.csv'], './crunched', connect,
+                       outputs=['results'], imageID=imageID, userData=uData)
+
+On a hit, the outputs are copied into ./crunched at once, and connect()
+(so, making a droplet) never happens.  On a miss, the job runs via
+RemoteJob, and its outputs are cached if it succeeded.
+
+The cache lives in getCacheDir()/results, one directory per key.  When
+it's over maxBytes, the least recently used entries are removed.
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+from doUtils.utils import getCacheDir
+from doUtils.cloudConfig import userDataFingerprint
+from doUtils.remoteJob import RemoteJob, StdoutName, StderrName
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+DefaultMaxBytes = 1024 * 1024 * 1024
+MetaName = 'meta.json'
+OutputsName = 'outputs'
+
+
+def hashFile(fpath, h):
+    with open(fpath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+
+
+def hashPath(path, h):
+    """Add a file, or a directory tree, to hash h: names (relative),
+    modes, and contents, in a fixed order."""
+    if os.path.isdir(path):
+        for dirPath, dirNames, fnames in os.walk(path):
+            dirNames.sort()
+            for fname in sorted(fnames):
+                fpath = os.path.join(dirPath, fname)
+                h.update(os.path.relpath(fpath, path).encode('utf-8') + b'\0')
+                h.update(oct(os.stat(fpath).st_mode & 0o777).encode('ascii') + b'\0')
+                hashFile(fpath, h)
+    else:
+        hashFile(path, h)
+
+
+def jobKey(script, inputs=None, outputs=None, interpreter='bash', imageID=None, userData=None):
+    """The cache key for a job: a hash of everything that determines
+    its results.
+
+    script : string
+        Local pathname of the script.
+
+    inputs : list of string
+        Local files and directories the script uses.
+
+    outputs : list of string
+        What's brought back (see RemoteJob).
+
+    imageID : string
+
+    userData : string
+        The droplet's cloud-config; only its fingerprint counts (see
+        userDataFingerprint()), so its ssh keys don't.
+
+    Returns : string
+        64 hex digits.
+    """
+    h = hashlib.sha256()
+    h.update(b'script\0')
+    hashPath(script, h)
+    for p in inputs or []:
+        h.update(b'input\0' + os.path.basename(p.rstrip(os.sep)).encode('utf-8') + b'\0')
+        hashPath(p, h)
+    parms = {'outputs': list(outputs or ['.']),
+             'interpreter': interpreter,
+             'imageID': None if imageID is None else str(imageID),
+             'cloudConfig': None if userData is None else userDataFingerprint(userData)}
+    h.update(json.dumps(parms, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+def treeBytes(path):
+    total = 0
+    for dirPath, _dirNames, fnames in os.walk(path):
+        for fname in fnames:
+            try:
+                total += os.lstat(os.path.join(dirPath, fname)).st_size
+            except OSError:
+                pass
+    return total
+
+###############################################################################
+
+
+class ResultCache:
+    """
+    A local cache of job results, by key (see jobKey()).
+
+    Operations:
+        lookup -- the metadata of a cached result, or None
+        restore -- copy a cached result's outputs somewhere
+        store -- cache a result
+        evict -- remove least recently used entries, to fit maxBytes
+        stats -- entries, bytes, hits and misses
+    """
+
+    def __init__(self, cacheDir=None, maxBytes=DefaultMaxBytes):
+        """
+        cacheDir : string
+            Defaults to getCacheDir()/results.
+
+        maxBytes : int
+            How big the cache can get.
+        """
+        self.cacheDir = cacheDir or os.path.join(getCacheDir(), 'results')
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cacheDir, exist_ok=True)
+
+    def entryDir(self, key):
+        return os.path.join(self.cacheDir, key[:2], key)
+
+    def lookup(self, key):
+        """
+        Returns : dict
+            The cached result's metadata ('exitCode', 'stdout',
+            'stderr', 'bytes', 'created'), or None if not cached.
+        """
+        metaFpath = os.path.join(self.entryDir(key), MetaName)
+        try:
+            with open(metaFpath) as f:
+                meta = json.load(f)
+        except (IOError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(metaFpath)    # recently used
+        self.hits += 1
+        return meta
+
+    def restore(self, key, localDir):
+        """Copy a cached result's outputs into localDir."""
+        shutil.copytree(os.path.join(self.entryDir(key), OutputsName), localDir, symlinks=True, dirs_exist_ok=True)
+
+    def store(self, key, outputsDir, exitCode=0, stdout='', stderr=''):
+        """Cache the outputs in outputsDir (copied), and the job's exit
+        code and logs, under key."""
+        entryDir = self.entryDir(key)
+        os.makedirs(os.path.dirname(entryDir), exist_ok=True)
+        tmpDir = tempfile.mkdtemp(prefix='.tmp-', dir=os.path.dirname(entryDir))
+        try:
+            shutil.copytree(outputsDir, os.path.join(tmpDir, OutputsName), symlinks=True)
+            meta = {'exitCode': exitCode, 'stdout': stdout, 'stderr': stderr,
+                    'bytes': treeBytes(tmpDir), 'created': time.time()}
+            with open(os.path.join(tmpDir, MetaName), 'w') as f:
+                json.dump(meta, f)
+            try:
+                os.rename(tmpDir, entryDir)    # atomic; if there's one already, keep it
+            except OSError:
+                shutil.rmtree(tmpDir, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmpDir, ignore_errors=True)
+            raise
+        self.evict()
+
+    def entries(self):
+        """
+        Returns : list of tuple (last used, bytes, entry directory)
+        """
+        out = []
+        for prefix in os.listdir(self.cacheDir):
+            prefixDir = os.path.join(self.cacheDir, prefix)
+            if not os.path.isdir(prefixDir):
+                continue
+            for key in os.listdir(prefixDir):
+                metaFpath = os.path.join(prefixDir, key, MetaName)
+                try:
+                    with open(metaFpath) as f:
+                        nBytes = json.load(f)['bytes']
+                    out.append((os.stat(metaFpath).st_mtime, nBytes, os.path.join(prefixDir, key)))
+                except (IOError, ValueError, KeyError):
+                    continue
+        return out
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in
+        maxBytes.
+
+        Returns : int
+            How many were removed.
+        """
+        entries = sorted(self.entries())
+        total = sum(nBytes for _used, nBytes, _dir in entries)
+        nEvicted = 0
+        for _used, nBytes, entryDir in entries:
+            if total <= self.maxBytes:
+                break
+            log.info("evicting cached result {}".format(os.path.basename(entryDir)))
+            shutil.rmtree(entryDir, ignore_errors=True)
+            total -= nBytes
+            nEvicted += 1
+        return nEvicted
+
+    def stats(self):
+        entries = self.entries()
+        return {'entries': len(entries), 'bytes': sum(nBytes for _used, nBytes, _dir in entries),
+                'hits': self.hits, 'misses': self.misses}
+
+###############################################################################
+
+
+def runCached(script, inputs, localDir, connect, outputs=None, interpreter='bash', imageID=None, userData=None,
+              cache=None, pollSecs=5, timeout=None):
+    """Run a job remotely -- unless its results are already cached.
+
+    script, inputs, outputs, interpreter : see RemoteJob
+
+    localDir : string
+        Where the outputs go.
+
+    connect : callable
+        Called (only on a miss) to get an SshConn to run the job on.
+
+    imageID, userData : string
+        The droplet's image and cloud-config, for the cache key (see
+        jobKey()).
+
+    cache : ResultCache
+        Defaults to one in getCacheDir().
+
+    timeout : number
+        Seconds to wait for the job; None for no limit.
+
+    Returns : dict
+        'exitCode', 'stdout', 'stderr', 'key', and 'cached' (whether it
+        came from the cache).  Only successful runs are cached.
+
+    Raises : TimeoutError
+        If the job's still running after timeout seconds.  It's left
+        as it is, to be waited on again (RemoteJob(sConn, jobId=...)).
+    """
+    cache = cache or ResultCache()
+    key = jobKey(script, inputs, outputs, interpreter, imageID, userData)
+    meta = cache.lookup(key)
+    if meta is not None:
+        log.info("cached result {} for {}".format(key[:12], script))
+        cache.restore(key, localDir)
+        return dict(meta, key=key, cached=True)
+
+    sConn = connect()
+    if sConn is None:
+        raise ConnectionError("couldn't get a connection to run {}".format(script))
+    job = RemoteJob(sConn, script, inputs=inputs, outputs=outputs, interpreter=interpreter)
+    job.submit()
+    exitCode = job.wait(pollSecs=pollSecs, timeout=timeout)
+    if exitCode is None:
+        if not job.isDone():
+            raise TimeoutError("job {} ({}) on {} still running after {}s".format(job.jobId, script, sConn.host, timeout))
+        exitCode = job.exitCode()    # None if the job was lost
+    stdout, _offset = job.readLog(which=StdoutName)
+    stderr, _offset = job.readLog(which=StderrName)
+    with tempfile.TemporaryDirectory(prefix='runCached-') as fetchDir:
+        job.fetchResults(fetchDir)
+        if exitCode == 0:
+            cache.store(key, fetchDir, exitCode, stdout, stderr)
+        shutil.copytree(fetchDir, localDir, symlinks=True, dirs_exist_ok=True)
+    job.cleanup()
+    return {'exitCode': exitCode, 'stdout': stdout, 'stderr': stderr, 'key': key, 'cached': False}
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
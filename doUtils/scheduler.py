@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.scheduler
+   :platform: Unix
+   :synopsis: class FleetScheduler -- spread a list of tasks over a fleet of droplets.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+class FleetScheduler -- spread a list of tasks over a fleet of droplets.
+
+Tasks sit in one work queue, and each host has a few worker threads
+("slots") pulling from it over a shared, pooled ssh connection -- so a
+fast host simply takes more tasks than a slow one.  When the queue runs
+dry, a free slot may start a backup copy of a task that's running much
+longer than usual on some other host; whichever copy finishes first
+wins.  Tasks that fail because of a host are retried on another host,
+and a host that keeps failing is dropped.
+
+Hosts can be added while the tasks are running, including droplets
+that the scheduler makes itself (see addDroplets).
+
+"""
+
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+import statistics
+import doUtils
+from doUtils.sshConn import SshConnPool, drainOutput
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+
+class FleetScheduler:
+    """
+    Run a list of tasks across a set of hosts.
+
+    Each task is either a shell command (string), run with
+    SshConn.do(); or a callable, called with an SshConn to its host.
+
+    Operations:
+        addHost -- add a host to the fleet (also while running)
+        addDroplets -- make droplets and add them as they come up
+        run -- run all the tasks, return their results
+        stats -- throughput, and per-host counts
+        destroyDroplets -- destroy the droplets addDroplets made
+
+    EG:
+
+    >>> tasks = ['./crunch.sh {}'.format(i) for i in range(1000)]
+    >>> sched = FleetScheduler(tasks, hosts=[dParms1, dParms2], slotsPerHost=4)  # doctest: +SKIP
+    >>> sched.addDroplets(3, imageID)  # doctest: +SKIP
+    >>> results = sched.run()  # doctest: +SKIP
+    >>> sched.stats()['tasksPerSec']  # doctest: +SKIP
+    """
+
+    def __init__(self, tasks, hosts=(), user='adminutil', keyFname=None, slotsPerHost=2, maxRetries=2, maxHostErrors=3, slowFactor=3.0, pool=None,
+                 port=22):
+        """
+        tasks : list of string or callable
+            Shell commands, or callables taking an SshConn.
+
+        hosts : list of string or dict
+            Each an IP address or hostname (using user and keyFname
+            below), or a dictionary as returned by makeDroplet().
+
+        user : string
+            Who to log in as, for hosts given by address.
+
+        keyFname : string
+            ssh key file, for hosts given by address.
+
+        slotsPerHost : int
+            How many tasks to run at once on each host.
+
+        maxRetries : int
+            How many more times to try a task that failed with an
+            exception (eg its host went away).
+
+        maxHostErrors : int
+            Drop a host after this many failures in a row.
+
+        slowFactor : number
+            A task counts as a straggler once it's been running this
+            many times the median task time; then an idle slot
+            elsewhere may start a backup copy of it.
+
+        pool : SshConnPool (see sshConn.py)
+            Connections to use; defaults to a new pool.
+
+        port : int
+            The hosts' ssh port.
+        """
+        self.tasks = list(tasks)
+        self.results = [None] * len(self.tasks)
+        self.attempts = [0] * len(self.tasks)
+        self.failedOn = [set() for _ in self.tasks]
+        self.runningOn = [[] for _ in self.tasks]   # (host, start time) of each copy running
+        self.work = queue.Queue()
+        for i in range(len(self.tasks)):
+            self.work.put(i)
+        self.user = user
+        self.keyFname = keyFname
+        self.port = port
+        self.slotsPerHost = slotsPerHost
+        self.maxRetries = maxRetries
+        self.maxHostErrors = maxHostErrors
+        self.slowFactor = slowFactor
+        self.pool = pool or SshConnPool()
+        self.hosts = {}         # host -> dict of its state
+        self.taskSecs = []      # how long each finished task took
+        self.nBackups = 0
+        self.droplets = []      # made by addDroplets
+        self.sudoUserKeys = None    # addDroplets' droplets' (all the same)
+        self.keysLock = threading.Lock()
+        self.nBringingUp = 0    # droplets addDroplets is still waiting on
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.allDone = threading.Event()
+        self.startTime = None
+        self.endTime = None
+        if not self.tasks:
+            self.allDone.set()
+        for h in hosts:
+            self.addHost(h)
+
+    ###########################################################################
+    # The fleet.
+
+    def addHost(self, host, user=None, keyFname=None, slots=None, port=None):
+        """Add a host to the fleet.  If the tasks are already running,
+        it starts taking them right away.
+
+        host : string or dict
+            An IP address or hostname, or a dictionary as returned by
+            makeDroplet().
+        """
+        if isinstance(host, dict):
+            user = user or host['username']
+            keyFname = keyFname or host['pemFilePathname']
+            host = host['ip address']
+        with self.lock:
+            if host in self.hosts and self.hosts[host]['alive']:
+                return
+            self.hosts[host] = {'user': user or self.user,
+                                'keyFname': keyFname or self.keyFname,
+                                'port': port or self.port,
+                                'slots': slots or self.slotsPerHost,
+                                'alive': True,
+                                'errors': 0,
+                                'done': 0,
+                                'secs': 0.0}
+            started = self.startTime is not None
+        log.info("added host {}".format(host))
+        if started:
+            self.startWorkers(host)
+
+    def addDroplets(self, nDroplets, imageID, userDataArgs=None, nTries=7):
+        """Make droplets, and add each one to the fleet as soon as it's
+        up and cloud-init is done.  Doesn't wait: the droplets come up
+        in the background, and join in as they're ready.
+
+        nDroplets : int
+
+        imageID : string
+            ID for the desired VPS image, eg from distroImages().
+
+        userDataArgs : dict
+            Keyword arguments for makeUserData() (see cloudConfig.py),
+            eg to install packages the tasks need.
+
+        nTries : int
+            How many times to check each droplet is up (see isUp()).
+
+        The droplets all share one sudo user keypair, made for the
+        first; destroyDroplets() deletes it.
+
+        Returns : list of threads
+            One bringing up each droplet (join them to wait).
+        """
+        threads = []
+        with self.lock:
+            self.nBringingUp += nDroplets
+        for _ in range(nDroplets):
+            t = threading.Thread(target=self.bringUpDroplet, args=(imageID, userDataArgs or {}, nTries), daemon=True)
+            t.start()
+            threads.append(t)
+        return threads
+
+    def bringUpDroplet(self, imageID, userDataArgs, nTries):
+        try:
+            with self.keysLock:
+                uData, uKeys = doUtils.makeUserData(sudoUserKeys=self.sudoUserKeys, **userDataArgs)
+                self.sudoUserKeys = uKeys
+            dParms = doUtils.makeDroplet(imageID, sudoUserKeys=uKeys, userData=uData)
+            with self.lock:
+                self.droplets.append(dParms)
+            if doUtils.waitUntilReady(dParms, nTries=nTries, pool=self.pool) is None:
+                log.info("droplet {} not ready; leaving it out".format(dParms['ip address']))
+                return
+            self.addHost(dParms)
+        except Exception as e:
+            log.info("bringing up a droplet failed: {}".format(e))
+        finally:
+            with self.lock:
+                self.nBringingUp -= 1
+
+    def destroyDroplets(self):
+        """Destroy the droplets addDroplets made, and their keypair.
+
+        Returns : list of strings
+            List of IDs of destroyed droplets
+        """
+        with self.lock:
+            droplets, self.droplets = self.droplets, []
+        goneOnes = []
+        for dParms in droplets:
+            self.pool.discard(dParms['ip address'], dParms['username'], dParms['pemFilePathname'])
+            log.info("destroying {}...".format(dParms['droplet'].id))
+            dParms['droplet'].destroy()
+            goneOnes.append(dParms['droplet'].id)
+        with self.keysLock:
+            keys, self.sudoUserKeys = self.sudoUserKeys or [], None
+        for k in keys:
+            k.destroy()
+        return goneOnes
+
+    ###########################################################################
+    # Running.
+
+    def run(self, timeout=None):
+        """Run all the tasks, and wait for them to finish.
+
+        timeout : number
+            Give up after this many seconds.
+
+        Returns : list of dicts, one per task, in order
+            Each has 'host', 'secs', 'attempts', and either 'status',
+            'stdout' and 'stderr' (for a command), 'result' (for a
+            callable), or 'error' if the task couldn't be done.  None
+            for a task not finished before the timeout.
+        """
+        with self.lock:
+            self.startTime = time.time()
+            hosts = list(self.hosts)
+        for host in hosts:
+            self.startWorkers(host)
+        try:
+            while not self.allDone.wait(1):
+                if timeout is not None and time.time() - self.startTime > timeout:
+                    log.info("timed out with tasks unfinished")
+                    break
+                with self.lock:
+                    stillHope = self.nBringingUp or any(h['alive'] for h in self.hosts.values())
+                if not stillHope:
+                    self.failRemaining("no hosts left")
+        finally:
+            self.stopping.set()
+            self.endTime = time.time()
+        return self.results
+
+    def startWorkers(self, host):
+        with self.lock:
+            nSlots = self.hosts[host]['slots']
+        for slot in range(nSlots):
+            threading.Thread(target=self.worker, args=(host,), name="worker-{}-{}".format(host, slot), daemon=True).start()
+
+    def worker(self, host):
+        hostState = self.hosts[host]
+        slot = {}       # this slot's own session() of the pooled connection, for callable tasks
+        while hostState['alive'] and not self.stopping.is_set():
+            try:
+                i = self.work.get(timeout=0.5)
+            except queue.Empty:
+                i = self.pickStraggler(host)
+                if i is None:
+                    continue
+            with self.lock:
+                if self.results[i] is not None:
+                    continue    # a backup copy already finished it
+                leaveIt = host in self.failedOn[i] and any(h['alive'] and name not in self.failedOn[i] for name, h in self.hosts.items())
+                if leaveIt:
+                    self.work.put(i)    # for a host it hasn't failed on
+                else:
+                    self.attempts[i] += 1
+                    start = time.time()
+                    self.runningOn[i].append((host, start))
+            if leaveIt:
+                time.sleep(0.1)
+                continue
+            try:
+                sConn = self.pool.get(host, hostState['user'], keyFname=hostState['keyFname'], port=hostState['port'])
+                outcome = self.runTask(sConn, self.tasks[i], slot)
+            except Exception as e:
+                self.taskFailed(i, host, start, e)
+            else:
+                self.taskDone(i, host, start, outcome)
+        self.closeSession(slot)
+        log.info("worker for {} stopping".format(host))
+
+    def runTask(self, sConn, task, slot):
+        if callable(task):
+            if slot.get('conn') is not sConn:    # (the pool reconnected)
+                self.closeSession(slot)
+                slot.update(conn=sConn, session=sConn.session())
+            return {'result': task(slot['session'])}
+        _in, out, err = sConn.do(task)
+        stdout, stderr = drainOutput(out, err)
+        return {'status': out.channel.recv_exit_status(), 'stdout': stdout.decode('utf-8', 'replace'),
+                'stderr': stderr.decode('utf-8', 'replace')}
+
+    def closeSession(self, slot):
+        session = slot.pop('session', None)
+        slot.pop('conn', None)
+        if session is not None:
+            try:
+                session.close()
+            except Exception as e:
+                log.info("closing a session: {}".format(e))
+
+    def taskDone(self, i, host, start, outcome):
+        secs = time.time() - start
+        with self.lock:
+            self.runningOn[i].remove((host, start))
+            hostState = self.hosts[host]
+            hostState['errors'] = 0
+            if self.results[i] is not None:
+                return    # the other copy won
+            hostState['done'] += 1
+            hostState['secs'] += secs
+            self.taskSecs.append(secs)
+            outcome.update({'host': host, 'secs': secs, 'attempts': self.attempts[i]})
+            self.results[i] = outcome
+            self.checkAllDone()
+
+    def taskFailed(self, i, host, start, e):
+        log.info("task {} failed on {}: {}".format(i, host, e))
+        with self.lock:
+            self.runningOn[i].remove((host, start))
+            self.failedOn[i].add(host)
+            hostState = self.hosts[host]
+            hostState['errors'] += 1
+            if hostState['errors'] >= self.maxHostErrors and hostState['alive']:
+                log.info("dropping host {}".format(host))
+                hostState['alive'] = False
+            if self.results[i] is None and not self.runningOn[i]:
+                if self.attempts[i] > self.maxRetries:
+                    self.results[i] = {'error': str(e), 'host': host, 'secs': time.time() - start, 'attempts': self.attempts[i]}
+                    self.checkAllDone()
+                else:
+                    self.work.put(i)
+        if not hostState['alive']:
+            self.pool.discard(host, hostState['user'], hostState['keyFname'], hostState['port'])
+
+    def pickStraggler(self, host):
+        """With the queue empty, find a task that's running much longer
+        than usual elsewhere, to run a backup copy of here."""
+        with self.lock:
+            if len(self.taskSecs) < 3:
+                return None
+            tooLong = self.slowFactor * statistics.median(self.taskSecs)
+            now = time.time()
+            for i, runs in enumerate(self.runningOn):
+                if len(runs) == 1 and self.results[i] is None and runs[0][0] != host and now - runs[0][1] > tooLong:
+                    log.info("task {} is slow on {}; starting a backup copy on {}".format(i, runs[0][0], host))
+                    self.nBackups += 1
+                    return i
+        return None
+
+    def checkAllDone(self):
+        # (Called with the lock held.)
+        if all(r is not None for r in self.results):
+            self.allDone.set()
+
+    def failRemaining(self, why):
+        with self.lock:
+            for i, r in enumerate(self.results):
+                if r is None:
+                    self.results[i] = {'error': why, 'host': None, 'secs': 0.0, 'attempts': self.attempts[i]}
+            self.allDone.set()
+
+    ###########################################################################
+
+    def stats(self):
+        """
+        Returns : dict
+            'tasks', 'done' (finished without error), 'failed',
+            'elapsed' seconds, 'tasksPerSec', 'backups' (backup copies
+            started for stragglers), and 'hosts': for each host, its
+            'done' count, 'meanSecs' per task, and 'alive'.
+        """
+        with self.lock:
+            finished = [r for r in self.results if r is not None]
+            nFailed = len([r for r in finished if 'error' in r])
+            elapsed = ((self.endTime or time.time()) - self.startTime) if self.startTime else 0.0
+            hosts = {name: {'done': h['done'],
+                            'meanSecs': h['secs'] / h['done'] if h['done'] else None,
+                            'alive': h['alive']}
+                     for name, h in self.hosts.items()}
+            return {'tasks': len(self.tasks),
+                    'done': len(finished) - nFailed,
+                    'failed': nFailed,
+                    'elapsed': elapsed,
+                    'tasksPerSec': (len(finished) - nFailed) / elapsed if elapsed else 0.0,
+                    'backups': self.nBackups,
+                    'hosts': hosts}
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
@@ -12,22 +12,59 @@ class SshConn -- an ssh connection.
 Wrap it up in an object to provide a bit higher level of abstraction
 than paramiko. (And a tiny subset thereof!)
 
+There are two backends.  By default it's paramiko.  With
+backend='openssh' it's the system's ssh and scp, multiplexed over one
+ControlMaster connection per host that persists (ControlPersist) after
+the SshConn is closed: the crypto runs in native code, and connecting
+to the same droplet again costs next to nothing.
+
 See:
 
     * http://www.paramiko.org/
     * https://gist.github.com/mlafeldt/841944 (paramiko examples)
+    * https://man.openbsd.org/ssh_config#ControlMaster
 
 """
 
 import os
+import copy
+import mmap
+import shlex
+import hashlib
 import logging
-import paramiko
+import tempfile
+import threading
+import subprocess
+from doUtils import timeline
+from doUtils.sshTuning import getTuning
 
 ###############################################################################
 
 ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
 log = logging.getLogger(ModuleName)
 
+LargeBlockBytes = 4 * 1024 * 1024
+SftpRequestBytes = 32768    # paramiko's largest sftp read/write request
+
+###############################################################################
+
+
+def drainOutput(out, err):
+    """Read a command's stdout and stderr (as from SshConn.do()) to the
+    end, both at once: a command blocks once it's written a pipe's (or
+    an ssh channel's window's) worth to one we're not reading.  Call
+    this before recv_exit_status(), which waits for the command.
+
+    Returns : tuple (bytes, bytes)
+        Everything on stdout, and on stderr.
+    """
+    errData = []
+    reader = threading.Thread(target=lambda: errData.append(err.read()), daemon=True)
+    reader.start()
+    outData = out.read()
+    reader.join()
+    return outData, errData[0] if errData else b''
+
 ###############################################################################
 
 
@@ -39,9 +76,18 @@ class SshConn:
         do -- execute a command
         get -- fetch a file from the host
         put -- send a file to the host
+        forwardLocal, forwardRemote, socksProxy -- tunnels over the
+            connection (see tunnel.py)
     """
 
-    def __init__(self, host, user, passwd=None, keyFname=None):
+    def __new__(cls, *args, backend='paramiko', **kwargs):
+        if cls is SshConn and backend == 'openssh':
+            cls = NativeSshConn
+        elif backend not in ('paramiko', 'openssh'):
+            raise ValueError("no ssh backend {!r}; there's 'paramiko' and 'openssh'".format(backend))
+        return super().__new__(cls)
+
+    def __init__(self, host, user, passwd=None, keyFname=None, port=22, tuning=None, backend='paramiko'):
         """"
         Create an ssh connection object (including an sshClient
         connection and an sftpClient connection).
@@ -59,8 +105,19 @@ class SshConn:
             An ssh key file, as an alternative to the
             password.
 
+        port : int
+            The host's ssh port.
+
+        tuning : string or SshTuning
+            A tuning profile (see sshTuning.py), eg 'fast'; None for
+            paramiko's defaults.
+
+        backend : string
+            'paramiko', or 'openssh' for the system's ssh (see
+            NativeSshConn).
+
         """
-        port = 22
+        import paramiko    # here rather than at top, to keep "import doUtils" quick
         self.sshClient = paramiko.SSHClient()
         self.sshClient.load_system_host_keys()
         self.sshClient.set_missing_host_key_policy(paramiko.WarningPolicy)
@@ -69,8 +126,30 @@ class SshConn:
         # Raises: AuthenticationException – if authentication failed
         # Raises: SSHException – if there was any other error connecting or establishing an SSH session
         # Raises: socket.error – if a socket error occurred while connecting
-        self.sshClient.connect(host, port=port, username=user, password=passwd, key_filename=keyFname)
-        self.sftpClient = self.sshClient.open_sftp()
+        self.host = host
+        self.user = user
+        self.tuning = getTuning(tuning)
+        tuningArgs = self.tuning.connectArgs() if self.tuning is not None else {}
+        with timeline.span(host, 'ssh connect+auth'):
+            self.sshClient.connect(host, port=port, username=user, password=passwd, key_filename=keyFname, **tuningArgs)
+        with timeline.span(host, 'sftp open'):
+            self.sftpClient = self.sshClient.open_sftp()
+        self.tunnels = []
+        self.parent = None      # for a session(), the connection it's over
+
+    def session(self):
+        """
+        A view of this connection with an sftp channel of its own, for
+        a thread to get() and put() with while others use the
+        connection (an SFTPClient isn't to be shared between threads,
+        and its requests queue behind each other's anyway).  Its close()
+        closes just that channel.
+        """
+        view = copy.copy(self)
+        view.sftpClient = self.sshClient.open_sftp()
+        view.tunnels = []
+        view.parent = self
+        return view
 
     def __enter__(self):
         return self
@@ -110,9 +189,496 @@ class SshConn:
         """
         return self.sftpClient.put(localFpath, remoteFpath)
 
-    def __exit__(self, exc_type, exc_value, traceback):
+    def putLarge(self, localFpath, remoteFpath, blockSize=LargeBlockBytes):
+        """
+        Like put(), but for big files: the local file is mmap'd, and
+        handed to sftp as memoryview slices, rather than read into a
+        fresh bytes object a chunk at a time; and the requests are
+        pipelined.  The remote file is unbuffered (bufsize=0), so the
+        slices go straight to sftp writes rather than being copied
+        into paramiko's write buffer first.
+
+        blockSize : int
+            Bytes handed to sftp per write call (it splits them into
+            requests itself, without copying).
+        """
+        size = os.path.getsize(localFpath)
+        with open(localFpath, 'rb') as lf, self.sftpClient.open(remoteFpath, 'wb', bufsize=0) as rf:
+            rf.set_pipelined(True)
+            if size == 0:
+                return
+            with mmap.mmap(lf.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+                view = memoryview(mm)
+                try:
+                    for offset in range(0, size, blockSize):
+                        rf.write(view[offset:offset + blockSize])
+                finally:
+                    view.release()
+        if self.sftpClient.stat(remoteFpath).st_size != size:
+            raise IOError("size mismatch in putLarge: {}".format(remoteFpath))
+
+    def getLarge(self, remoteFpath, localfPath):
+        """
+        Like get(), but for big files: the local file is preallocated
+        (posix_fallocate, so it's contiguous and can't run out of disk
+        midway), and sftp's prefetched blocks are written straight to
+        their offsets in it with pwrite, with no file-object buffering
+        between.  (An mmap'd destination measured slower: its page
+        faults cost more than the copy they save.)
+        """
+        with self.sftpClient.open(remoteFpath, 'rb') as rf:
+            size = rf.stat().st_size
+            rf.prefetch(size)
+            fd = os.open(localfPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                if size:
+                    os.posix_fallocate(fd, 0, size)
+                offset = 0
+                while offset < size:
+                    data = rf.read(min(SftpRequestBytes, size - offset))
+                    if not data:
+                        raise IOError("{} ended early, at {} of {} bytes".format(remoteFpath, offset, size))
+                    os.pwrite(fd, data, offset)
+                    offset += len(data)
+            finally:
+                os.close(fd)
+
+    def openTcpChannel(self, host, port):
+        """
+        A channel to host:port as reached from the other end of the
+        connection (ssh's direct-tcpip, as "ssh -L" uses); it has
+        socket-like send, sendall, recv and close.
+        """
+        return self.sshClient.get_transport().open_channel('direct-tcpip', (host, port), ('127.0.0.1', 0))
+
+    def openTunnel(self, kind, *args, **kwargs):
+        from doUtils import tunnel
+        t = getattr(tunnel, kind)(self, *args, **kwargs)
+        self.tunnels.append(t)
+        return t.start() if isinstance(t, tunnel.ListeningTunnel) else t
+
+    def forwardLocal(self, localPort, remoteHost='127.0.0.1', remotePort=None, **kwargs):
+        """
+        Like "ssh -L": forward connections to localPort here to
+        remoteHost:remotePort as reached from the host.  Closed with
+        the SshConn, or by its close().
+
+        Returns : tunnel.LocalForward
+            Its localPort is the port (if 0 was asked for), and its
+            stats() the connections and bytes so far.
+        """
+        return self.openTunnel('LocalForward', localPort, remoteHost, remotePort, **kwargs)
+
+    def forwardRemote(self, remotePort, localHost='127.0.0.1', localPort=None, **kwargs):
+        """
+        Like "ssh -R": forward connections to remotePort on the host to
+        localHost:localPort as reached from here.
+
+        Returns : tunnel.RemoteForward
+        """
+        return self.openTunnel('RemoteForward', remotePort, localHost, localPort, **kwargs)
+
+    def socksProxy(self, localPort=1080, **kwargs):
+        """
+        Like "ssh -D": a SOCKS5 proxy on localPort here, whose
+        connections go out from the host.
+
+        Returns : tunnel.SocksProxy
+        """
+        return self.openTunnel('SocksProxy', localPort, **kwargs)
+
+    def isActive(self):
+        """Is the connection still up?"""
+        transport = self.sshClient.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        for t in list(self.tunnels):
+            t.close()
         self.sftpClient.close()
-        self.sshClient.close()
+        if self.parent is None:
+            self.sshClient.close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+###############################################################################
+# The native ssh backend.
+
+ControlPersistSecs = 600
+
+
+class NativeChannelFile:
+    """One of a native command's stdin, stdout, or stderr, looking
+    enough like paramiko's ChannelFile for our uses: read(),
+    readlines(), write(), and .channel."""
+
+    def __init__(self, channel, pipe):
+        self.channel = channel
+        self.pipe = pipe
+        self.drained = None     # what drain() read, until read() takes it
+
+    def drain(self):
+        """Read the rest of the output into memory (so the command
+        can't block writing to it)."""
+        if self.drained is None:
+            self.drained = self.pipe.read()
+
+    def read(self, size=-1):
+        if self.drained is not None:
+            if size is None or size < 0:
+                data, self.drained = self.drained, b''
+            else:
+                data, self.drained = self.drained[:size], self.drained[size:]
+            return data
+        return self.pipe.read(size)
+
+    def readlines(self):
+        return [line.decode('utf-8', 'replace') for line in self.read().splitlines(True)]
+
+    def __iter__(self):
+        return iter(self.readlines())
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.pipe.write(data)
+        return len(data)
+
+    def flush(self):
+        self.pipe.flush()
+
+    def close(self):
+        self.pipe.close()
+
+
+class NativeChannel:
+    """The command itself (an ssh process), looking enough like
+    paramiko's Channel for our uses."""
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.files = []
+
+    def shutdown_write(self):
+        if not self.proc.stdin.closed:
+            self.proc.stdin.close()
+
+    def recv_exit_status(self):
+        self.shutdown_write()
+        # Drain stdout and stderr at once, lest the command block on a
+        # full pipe we're not reading.
+        drainers = [threading.Thread(target=f.drain) for f in self.files]
+        for t in drainers:
+            t.start()
+        for t in drainers:
+            t.join()
+        return self.proc.wait()
+
+    def exit_status_ready(self):
+        return self.proc.poll() is not None
+
+    def close(self):
+        """Give up on the command."""
+        if self.proc.poll() is None:
+            self.proc.kill()
+
+
+class NativeTcpChannel(NativeChannel):
+    """
+    A connection to host:port as reached from the host, through the
+    ControlMaster ("ssh -W host:port"), looking enough like paramiko's
+    direct-tcpip Channel for tunnel.py: recv, sendall, shutdown_write,
+    close, .active and .closed.  (If the host can't connect, it just
+    ends: there's no refusal to see before sending.)
+    """
+
+    def __init__(self, proc):
+        super().__init__(proc)
+        self.closed = False
+
+    @property
+    def active(self):
+        return self.proc.poll() is None
+
+    def recv(self, n):
+        try:
+            return os.read(self.proc.stdout.fileno(), n)
+        except ValueError:    # closed
+            return b''
+
+    def sendall(self, data):
+        try:
+            self.proc.stdin.write(data)
+            self.proc.stdin.flush()
+        except ValueError:    # closed, or shut down
+            raise BrokenPipeError("channel closed")
+
+    def close(self):
+        self.closed = True
+        super().close()
+        self.proc.wait()
+        for pipe in (self.proc.stdin, self.proc.stdout):
+            pipe.close()
+
+
+class NativeSshConn(SshConn):
+    """
+    An ssh connection to a host through the system's ssh, scp, with a
+    persistent ControlMaster.  Get one with SshConn(..., backend='openssh').
+
+    Operations:
+        do -- execute a command
+        get -- fetch a file from the host
+        put -- send a file to the host
+        forwardLocal, forwardRemote, socksProxy -- tunnels, through the
+            ControlMaster
+        exitMaster -- shut down the host's ControlMaster connection
+    """
+
+    def __init__(self, host, user, passwd=None, keyFname=None, port=22, tuning=None, backend='openssh',
+                 persistSecs=ControlPersistSecs, sshOptions=None):
+        """
+        As for SshConn; plus:
+
+        persistSecs : int
+            How long the ControlMaster connection outlasts its last
+            use.
+
+        sshOptions : dict
+            More ssh -o options, eg {'UserKnownHostsFile': '/dev/null'}.
+
+        Passwords aren't supported: ssh would prompt for them.  Of a
+        tuning profile, just the compression is used.
+        """
+        if passwd is not None:
+            raise ValueError("the openssh backend can't log in with a password; use a key")
+        self.host = host
+        self.user = user
+        self.port = port
+        self.tuning = getTuning(tuning)
+        self.sshClient = None   # what SshConn's methods would use; there's none here
+        self.sftpClient = None
+        self.tunnels = []
+        self.parent = None
+        self.masterPid = None
+        controlDir = os.path.join(tempfile.gettempdir(), 'doUtils-ssh-{}'.format(os.getuid()))
+        os.makedirs(controlDir, mode=0o700, exist_ok=True)
+        # Named here rather than with ssh's %C, so isActive() can look for it.
+        controlName = hashlib.sha1('{}@{}:{}'.format(user, host, port).encode('utf-8')).hexdigest()
+        options = {'ControlMaster': 'auto',
+                   'ControlPath': os.path.join(controlDir, controlName),
+                   'ControlPersist': str(persistSecs),
+                   'BatchMode': 'yes',
+                   'StrictHostKeyChecking': 'accept-new',
+                   'ServerAliveInterval': '30'}
+        options.update(sshOptions or {})
+        self.controlPath = options['ControlPath'] if '%' not in options['ControlPath'] else None
+        self.commonArgs = [a for k, v in options.items() for a in ('-o', '{}={}'.format(k, v))]
+        if keyFname is not None:
+            self.commonArgs += ['-i', keyFname, '-o', 'IdentitiesOnly=yes']
+        if self.tuning is not None and self.tuning.compress:
+            self.commonArgs.append('-C')
+        self.target = '{}@{}'.format(user, host)
+        with timeline.span(host, 'ssh connect+auth'):
+            if not self.isActive():
+                proc = subprocess.run(self.sshArgs('-M', '-N', '-f'), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.PIPE)
+                if proc.returncode != 0:
+                    raise ConnectionError("ssh to {} failed: {}".format(self.target, proc.stderr.decode('utf-8', 'replace').strip()))
+
+    def sshArgs(self, *args):
+        return ['ssh', '-p', str(self.port)] + self.commonArgs + list(args) + [self.target]
+
+    def do(self, cmd, envDict=None):
+        """"
+        Execute a shell command on the connected host.
+
+        cmd : string
+
+        envDict : dictionary
+             Dictionary of environment variables, if desired
+
+        Returns: tuple
+            3-tuple: stdin, stdout, and stderr for the command (file
+            objects like paramiko's, each with a .channel).
+        """
+        if envDict:
+            cmd = "export {}; {}".format(" ".join(shlex.quote("{}={}".format(k, v)) for k, v in envDict.items()), cmd)
+        proc = subprocess.Popen(self.sshArgs('-T') + ['--', cmd], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        channel = NativeChannel(proc)
+        stdin, stdout, stderr = (NativeChannelFile(channel, p) for p in (proc.stdin, proc.stdout, proc.stderr))
+        channel.files = [stdout, stderr]
+        return stdin, stdout, stderr
+
+    def scp(self, src, dst):
+        args = ['scp', '-q', '-P', str(self.port)] + self.commonArgs + [src, dst]
+        proc = subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise IOError("scp {} {} failed: {}".format(src, dst, proc.stderr.decode('utf-8', 'replace').strip()))
+
+    def get(self, remoteFpath, localfPath):
+        """"
+        Get file at remoteFpath on the host at the other
+        end of the connection, save it at localfPath locally.
+
+        remoteFpath : string
+        localFpath : string
+        """
+        self.scp('{}:{}'.format(self.target, remoteFpath), localfPath)
+
+    def put(self, localFpath, remoteFpath):
+        """
+        Put the file at localFpath on the local host, to the
+        host at the other end of the connection, at remoteFpath.
+
+        localFpath : string
+        remoteFpath : string
+        """
+        self.scp(localFpath, '{}:{}'.format(self.target, remoteFpath))
+
+    def putLarge(self, localFpath, remoteFpath, blockSize=LargeBlockBytes):
+        """scp already streams big files efficiently; same as put()."""
+        self.put(localFpath, remoteFpath)
+
+    def getLarge(self, remoteFpath, localfPath):
+        """scp already streams big files efficiently; same as get()."""
+        self.get(remoteFpath, localfPath)
+
+    def session(self):
+        """Each get() and put() is its own scp; nothing to keep apart."""
+        return self
+
+    def openTcpChannel(self, host, port):
+        """As for SshConn: an "ssh -W" through the ControlMaster (see
+        NativeTcpChannel)."""
+        proc = subprocess.Popen(self.sshArgs('-W', '{}:{}'.format(host, port)), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, bufsize=0)
+        return NativeTcpChannel(proc)
+
+    def openTunnel(self, kind, *args, **kwargs):
+        """As for SshConn; but a forwardRemote() is the ControlMaster's
+        ("ssh -O forward -R"), to a port here that relays it on (see
+        tunnel.NativeRemoteForward)."""
+        return super().openTunnel('NativeRemoteForward' if kind == 'RemoteForward' else kind, *args, **kwargs)
+
+    def controlForward(self, op, spec):
+        """
+        Ask the ControlMaster to add (op 'forward') or remove ('cancel')
+        a forward.
+
+        spec : string
+            As for ssh -R, eg '127.0.0.1:0:127.0.0.1:8000'.
+
+        Returns : string
+            What ssh said, eg the port it got for a port 0.
+        """
+        proc = subprocess.run(self.sshArgs('-O', op, '-R', spec), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise ConnectionError("ssh -O {} -R {} failed: {}".format(op, spec, proc.stderr.decode('utf-8', 'replace').strip()))
+        return proc.stdout.decode('utf-8', 'replace').strip()
+
+    def isActive(self):
+        """Is the host's ControlMaster connection up?  Cheap when it's
+        plainly down (no control socket) or plainly up (the master
+        process we last saw is still there); otherwise asks ssh."""
+        if self.controlPath is not None and not os.path.exists(self.controlPath):
+            self.masterPid = None
+            return False
+        if self.masterPid is not None:
+            try:
+                os.kill(self.masterPid, 0)
+                return True
+            except ProcessLookupError:
+                self.masterPid = None
+            except PermissionError:
+                return True
+        proc = subprocess.run(self.sshArgs('-O', 'check'), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            return False
+        # "Master running (pid=1234)"
+        pid = proc.stderr.decode('utf-8', 'replace').rpartition('pid=')[2].rstrip(')\r\n ')
+        self.masterPid = int(pid) if pid.isdigit() else None
+        return True
+
+    def close(self):
+        """Nothing to do: the ControlMaster connection lingers for
+        persistSecs, for the next SshConn to the host."""
+
+    def exitMaster(self):
+        """Shut down the host's ControlMaster connection now."""
+        subprocess.run(self.sshArgs('-O', 'exit'), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.masterPid = None
+
+###############################################################################
+
+
+class SshConnPool:
+    """
+    A pool of SshConns, one per (host, user, key), that threads can
+    share.  paramiko runs any number of channels over one transport, so
+    concurrent do()s on a host only need the one connection -- and
+    handshaking and authenticating once rather than per use saves a
+    lot.
+
+    Operations:
+        get -- an open SshConn to a host, connecting if need be
+        discard -- drop a host's connection (eg after an error)
+        closeAll -- close all the connections
+    """
+
+    def __init__(self, tuning=None, backend='paramiko'):
+        """
+        tuning : string or SshTuning
+            Tuning profile for the pool's connections (see
+            sshTuning.py).
+
+        backend : string
+            'paramiko' or 'openssh' (see SshConn).
+        """
+        self.tuning = tuning
+        self.backend = backend
+        self.conns = {}
+        self.keyLocks = {}
+        self.lock = threading.Lock()
+
+    def get(self, host, user, passwd=None, keyFname=None, port=22):
+        """
+        Get an open SshConn to host, as user (see SshConn).  Reuses
+        the pooled one if it's still up.
+        """
+        key = (host, user, keyFname, port)
+        with self.lock:
+            keyLock = self.keyLocks.setdefault(key, threading.Lock())
+        with keyLock:    # so connecting to one host doesn't hold up the others
+            conn = self.conns.get(key)
+            if conn is not None and conn.isActive():
+                return conn
+            conn = SshConn(host, user, passwd=passwd, keyFname=keyFname, port=port, tuning=self.tuning, backend=self.backend)
+            with self.lock:
+                self.conns[key] = conn
+            return conn
+
+    def discard(self, host, user, keyFname=None, port=22):
+        """Close and forget the pooled connection to host, if any."""
+        with self.lock:
+            conn = self.conns.pop((host, user, keyFname, port), None)
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception as e:
+                log.info("closing connection to {}: {}".format(host, e))
+
+    def closeAll(self):
+        with self.lock:
+            conns, self.conns = list(self.conns.values()), {}
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception as e:
+                log.info("closing connection: {}".format(e))
 
 
 
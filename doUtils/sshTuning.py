@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.sshTuning
+   :platform: Unix
+   :synopsis: Tuning profiles for ssh connections: ciphers, kex, compression, windows.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+Tuning profiles for ssh connections: ciphers, kex, compression, windows.
+
+By default paramiko offers its ciphers and key exchanges in a
+conservative order, uses modest channel windows, and doesn't compress.
+A throughput-bound sftp transfer does better with a cipher the CPU
+accelerates (AES-GCM, with AES-NI), and with windows big enough to keep
+a long fat pipe full (window >= bandwidth * RTT); text-heavy transfers
+over slow links do better compressed.  A profile says which of these
+to use:
+
+    * default -- paramiko's own choices
+    * fast -- AEAD ciphers and curve25519 kex first, no Nagle delay
+    * bulk -- as fast, with 16 MB windows, for big transfers over long
+      links (on short ones big windows just cost buffering)
+    * compressed -- as fast, with zlib compression, for text
+
+EG:
+
+    sConn = SshConn(ip, user, keyFname=pem, tuning='fast')
+
+Algorithms a profile prefers, but that this paramiko doesn't support
+(eg chacha20-poly1305, or AES-GCM before paramiko 3.3), are skipped; the
+other end picks from what's left as usual.  Tuning a transport needs
+SSHClient.connect()'s transport_factory (paramiko 3.2 on); with an older
+paramiko, just the compression setting is used (see connectArgs()).  To
+see which profile suits a host best, run
+chooseProfile(), or::
+
+    python -m doUtils.sshTuning HOST USER KEYFILE
+
+See:
+
+    * http://docs.paramiko.org/en/stable/api/transport.html
+    * https://www.psc.edu/hpn-ssh-home/ (on ssh and window sizes)
+
+"""
+
+import os
+import sys
+import time
+import socket
+import inspect
+import logging
+import tempfile
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+FastCiphers = ['aes128-gcm@openssh.com', 'aes256-gcm@openssh.com', 'chacha20-poly1305@openssh.com', 'aes128-ctr', 'aes256-ctr']
+FastKex = ['curve25519-sha256@libssh.org', 'curve25519-sha256', 'ecdh-sha2-nistp256']
+
+MB = 1024 * 1024
+
+# The bounds paramiko puts on channel windows and packets.
+MinWindowSize = 2 ** 15
+MaxWindowSize = 2 ** 32 - 1
+MinPacketSize = 2 ** 12
+MaxPacketSize = 2 ** 15
+
+
+class SshTuning:
+    """
+    How to set up an ssh connection's transport.  None for any setting
+    means paramiko's default.
+
+    Operations:
+        connectArgs -- for paramiko's SSHClient.connect()
+        transportFactory -- for paramiko's SSHClient.connect()
+        apply -- tune a new, not yet started, Transport
+    """
+
+    def __init__(self, name, ciphers=None, kex=None, compress=False, windowSize=None, maxPacketSize=None, noDelay=False):
+        """
+        name : string
+
+        ciphers, kex : list of string
+            Algorithms to offer first, best first.
+
+        compress : bool
+            Compress with zlib (if the other end agrees).
+
+        windowSize : int
+            Bytes a channel can have in flight before the other end
+            acknowledges them.
+
+        maxPacketSize : int
+            Largest packet to send on a channel.
+
+        noDelay : bool
+            Turn off Nagle's algorithm on the socket, so small
+            messages (commands, sftp requests) aren't held back.
+        """
+        self.name = name
+        self.ciphers = ciphers
+        self.kex = kex
+        self.compress = compress
+        self.windowSize = windowSize
+        self.maxPacketSize = maxPacketSize
+        self.noDelay = noDelay
+
+    def __repr__(self):
+        return "SshTuning({!r})".format(self.name)
+
+    @staticmethod
+    def preferring(preferred, current):
+        """current, reordered to start with those of preferred that are
+        in it.  (A transport's current algorithms are all ones it
+        supports, so the others of preferred are skipped.)
+
+        >>> SshTuning.preferring(['b', 'x', 'c'], ('a', 'b', 'c'))
+        ('b', 'c', 'a')
+        """
+        first = [a for a in preferred if a in current]
+        return tuple(first + [a for a in current if a not in first])
+
+    def apply(self, transport):
+        """Tune a Transport that hasn't started negotiating yet."""
+        if self.windowSize is not None:
+            transport.default_window_size = min(max(self.windowSize, MinWindowSize), MaxWindowSize)
+        if self.maxPacketSize is not None:
+            transport.default_max_packet_size = min(max(self.maxPacketSize, MinPacketSize), MaxPacketSize)
+        options = transport.get_security_options()
+        if self.ciphers:
+            options.ciphers = self.preferring(self.ciphers, options.ciphers)
+        if self.kex:
+            options.kex = self.preferring(self.kex, options.kex)
+        if self.noDelay:
+            sock = transport.sock
+            if isinstance(sock, socket.socket) and sock.family in (socket.AF_INET, socket.AF_INET6):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def transportFactory(self, sock, **kwargs):
+        """Make a tuned Transport; pass as SSHClient.connect()'s
+        transport_factory."""
+        import paramiko    # here rather than at top, to keep "import doUtils" quick
+        transport = paramiko.Transport(sock, **kwargs)
+        self.apply(transport)
+        return transport
+
+    def connectArgs(self):
+        """Keyword arguments for SSHClient.connect() that apply this
+        profile: just the compression, if this paramiko's connect()
+        doesn't take a transport_factory (before 3.2).
+
+        >>> sorted(Profiles['fast'].connectArgs()) in (['compress'], ['compress', 'transport_factory'])
+        True
+        """
+        args = {'compress': self.compress}
+        if canFactorTransports():
+            args['transport_factory'] = self.transportFactory
+        elif not canFactorTransports.warned:
+            canFactorTransports.warned = True
+            log.warning("this paramiko can't tune ssh transports (that needs 3.2 or later); only compression is used")
+        return args
+
+
+Profiles = {
+    'default': SshTuning('default'),
+    'fast': SshTuning('fast', ciphers=FastCiphers, kex=FastKex, noDelay=True),
+    'bulk': SshTuning('bulk', ciphers=FastCiphers, kex=FastKex, windowSize=16 * MB, maxPacketSize=32768, noDelay=True),
+    'compressed': SshTuning('compressed', ciphers=FastCiphers, kex=FastKex, compress=True, noDelay=True),
+}
+
+
+def canFactorTransports():
+    """Does this paramiko's SSHClient.connect() take a
+    transport_factory?"""
+    try:
+        return canFactorTransports.can
+    except AttributeError:
+        import paramiko    # here rather than at top, to keep "import doUtils" quick
+        canFactorTransports.can = 'transport_factory' in inspect.signature(paramiko.SSHClient.connect).parameters
+        return canFactorTransports.can
+
+
+canFactorTransports.warned = False
+
+
+def getTuning(tuning):
+    """
+    tuning : string, SshTuning, or None
+        A profile name (see Profiles), or a profile.
+
+    Returns : SshTuning, or None
+
+    >>> getTuning('fast').name
+    'fast'
+    >>> getTuning(None) is None
+    True
+    """
+    if tuning is None or isinstance(tuning, SshTuning):
+        return tuning
+    try:
+        return Profiles[tuning]
+    except KeyError:
+        raise ValueError("no ssh tuning profile {!r}; there's {}".format(tuning, ", ".join(sorted(Profiles))))
+
+###############################################################################
+
+
+def measureProfile(host, user, tuning, keyFname=None, passwd=None, port=22, fileMb=8, nCmds=10, textual=False):
+    """Time an ssh connection to host, made with a tuning profile.
+
+    fileMb : int
+        Size of the file to put, then get.
+
+    textual : bool
+        Make the file compressible text (rather than random bytes).
+
+    Returns : dict
+        'connectSecs' (handshake, auth and sftp open), 'cmdSecs' (mean
+        round trip of a trivial command), 'putMBps' and 'getMBps', and
+        the 'cipher' and 'compression' the two ends agreed on.
+    """
+    from doUtils.sshConn import SshConn
+    with tempfile.TemporaryDirectory(prefix='sshTuning-') as tmpDir:
+        localFpath = os.path.join(tmpDir, 'payload')
+        with open(localFpath, 'wb') as f:
+            if textual:
+                line = b"2018-04-01 12:00:00 INFO doUtils: some fairly typical log line\n"
+                f.write(line * (fileMb * MB // len(line)))
+            else:
+                f.write(os.urandom(fileMb * MB))
+        remoteFpath = 'sshTuning-{}.tmp'.format(os.getpid())
+
+        start = time.perf_counter()
+        sConn = SshConn(host, user, passwd=passwd, keyFname=keyFname, port=port, tuning=tuning)
+        connectSecs = time.perf_counter() - start
+        with sConn:
+            start = time.perf_counter()
+            for _ in range(nCmds):
+                _in, out, _err = sConn.do('true')
+                out.channel.recv_exit_status()
+            cmdSecs = (time.perf_counter() - start) / nCmds
+            start = time.perf_counter()
+            sConn.put(localFpath, remoteFpath)
+            putSecs = time.perf_counter() - start
+            start = time.perf_counter()
+            sConn.get(remoteFpath, localFpath + '.back')
+            getSecs = time.perf_counter() - start
+            sConn.do('rm -f {}'.format(remoteFpath))[1].channel.recv_exit_status()
+            transport = sConn.sshClient.get_transport()
+            return {'connectSecs': connectSecs,
+                    'cmdSecs': cmdSecs,
+                    'putMBps': fileMb / putSecs,
+                    'getMBps': fileMb / getSecs,
+                    'cipher': transport.remote_cipher,
+                    'compression': transport.remote_compression}
+
+
+def chooseProfile(host, user, keyFname=None, passwd=None, port=22, profiles=None, fileMb=8, textual=False):
+    """Try each tuning profile against host; pick the one with the best
+    transfer throughput.
+
+    profiles : list of string
+        Profile names to try; defaults to all (see Profiles).
+
+    Returns : tuple (string, dict)
+        The best profile's name, and each profile's measurements (see
+        measureProfile()).
+
+    >>> best, results = chooseProfile(ip, 'adminutil', keyFname=pem)  # doctest: +SKIP
+    """
+    results = {}
+    for name in profiles or sorted(Profiles):
+        try:
+            results[name] = measureProfile(host, user, name, keyFname=keyFname, passwd=passwd, port=port, fileMb=fileMb, textual=textual)
+        except Exception as e:
+            log.info("profile {} failed against {}: {}".format(name, host, e))
+            continue
+        log.info("profile {}: {}".format(name, results[name]))
+    if not results:
+        raise ValueError("no tuning profile could connect to {}".format(host))
+    best = max(results, key=lambda n: results[n]['putMBps'] + results[n]['getMBps'])
+    return best, results
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
+    else:
+        import argparse
+        logging.basicConfig(level=logging.INFO)
+        parser = argparse.ArgumentParser(description="Find the ssh tuning profile that suits a host best.")
+        parser.add_argument('host')
+        parser.add_argument('user')
+        parser.add_argument('keyFname', nargs='?')
+        parser.add_argument('--port', type=int, default=22)
+        parser.add_argument('--file-mb', type=int, default=8)
+        parser.add_argument('--textual', action='store_true', help="transfer compressible text rather than random bytes")
+        args = parser.parse_args()
+        best, results = chooseProfile(args.host, args.user, keyFname=args.keyFname, port=args.port, fileMb=args.file_mb, textual=args.textual)
+        print("{:12} {:>10} {:>8} {:>9} {:>9}  {}".format('profile', 'connect s', 'cmd ms', 'put MB/s', 'get MB/s', 'cipher'))
+        for name, r in sorted(results.items()):
+            print("{:12} {:10.3f} {:8.2f} {:9.1f} {:9.1f}  {}".format(name, r['connectSecs'], r['cmdSecs'] * 1000, r['putMBps'], r['getMBps'], r['cipher']))
+        print("best: {}".format(best))
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.timeline
+   :platform: Unix
+   :synopsis: Timing where a droplet launch spends its time, phase by phase.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+Timing where a droplet launch spends its time, phase by phase.
+
+makeDroplet() starts a Timeline for each launch, and records spans for
+its phases (API create, waiting on the create action, IP assignment).
+Once the droplet has an IP address, the timeline is known by it, so
+isUp(), SshConn() and waitUntilCloudInitDone() on that address add
+their spans (port open, ssh connect and auth, sftp open, cloud-init)
+to the same timeline.  When the launch is done -- waitUntilCloudInitDone
+or waitUntilReady finished, or finish() called -- the timeline goes to
+each sink added with addSink():
+
+    * JsonLinesSink -- one JSON object per launch, appended to a file
+    * PrometheusTextfileSink -- per-phase gauges and totals, for
+      node_exporter's textfile collector
+    * OtlpJsonSink -- OpenTelemetry's OTLP/JSON trace format, one
+      export request per line
+    * OpenTelemetrySink -- spans sent through the opentelemetry API
+      (if that's installed)
+
+It's also logged as a waterfall, eg:
+
+    launch droplet=12345 image=34567 region=sfo2 size=512mb  total   312.4s
+      api create       |#                     |     1.2s
+      action wait      | ###                  |    38.0s
+      ip assignment    |    #                 |     0.3s
+      port 22 open     |    ##                |    21.7s
+      ...
+
+With no timeline for a host, span() costs next to nothing.
+
+A timeline stays bound to its host's address until it's finished, until
+another launch binds the address (droplet addresses get reused), or
+for at most BindMaxSecs -- a launch that's never waited on doesn't keep
+collecting other connections' spans for ever.  Either way, it's
+finished then (with superseded=True or expired=True).
+
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import threading
+import contextlib
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+Sinks = []
+OpenTimelines = {}      # host -> Timeline
+RegistryLock = threading.Lock()
+BindMaxSecs = 60 * 60
+
+WaterfallWidth = 40
+
+
+def addSink(sink):
+    """Send each finished timeline to sink (something with an
+    emit(timeline) method)."""
+    Sinks.append(sink)
+
+
+def removeSink(sink):
+    Sinks.remove(sink)
+
+###############################################################################
+
+
+class Timeline:
+    """
+    The timed phases ("spans") of one launch.
+
+    Operations:
+        span -- context manager timing a phase
+        bindHost -- let later phases find this timeline by host
+        finish -- close the timeline, send it to the sinks
+        waterfall -- a textual picture of the phases
+        asDict -- for serializing
+    """
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.traceId = "{:032x}".format(random.getrandbits(128))
+        self.spanId = "{:016x}".format(random.getrandbits(64))
+        self.start = time.time()
+        self.end = None
+        self.spans = []
+        self.host = None
+        self.boundAt = None
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """Time the enclosed code as a phase called name."""
+        spanRec = {'name': name,
+                   'spanId': "{:016x}".format(random.getrandbits(64)),
+                   'start': time.time(),
+                   'end': None,
+                   'attrs': attrs,
+                   'error': None}
+        try:
+            yield spanRec
+        except BaseException as e:
+            spanRec['error'] = "{}: {}".format(type(e).__name__, e)
+            raise
+        finally:
+            spanRec['end'] = time.time()
+            with self.lock:
+                self.spans.append(spanRec)
+
+    def bindHost(self, host):
+        """From now on, span(host, ...) records into this timeline
+        (see BindMaxSecs).  An earlier launch's timeline still bound to
+        host is finished."""
+        self.host = host
+        self.boundAt = time.time()
+        with RegistryLock:
+            previous = OpenTimelines.get(host)
+            OpenTimelines[host] = self
+        if previous is not None and previous is not self:
+            previous.finish(superseded=True)
+        expireStale()
+
+    def finish(self, **attrs):
+        """Close the timeline, and send it to the sinks.  (Only the
+        first call counts.)"""
+        with self.lock:
+            if self.end is not None:
+                return
+            self.end = time.time()
+            self.attrs.update(attrs)
+        if self.host is not None:
+            with RegistryLock:
+                if OpenTimelines.get(self.host) is self:
+                    del OpenTimelines[self.host]
+        log.info("\n" + self.waterfall())
+        for sink in list(Sinks):
+            try:
+                sink.emit(self)
+            except Exception as e:
+                log.info("timeline sink {} failed: {}".format(type(sink).__name__, e))
+
+    def totalSecs(self):
+        return (self.end or time.time()) - self.start
+
+    def waterfall(self, width=WaterfallWidth):
+        """
+        Returns : string
+            One line per phase, with a bar showing when it ran within
+            the launch, and how long it took.
+        """
+        total = self.totalSecs() or 1e-9
+        attrs = " ".join("{}={}".format(k, v) for k, v in sorted(self.attrs.items()))
+        lines = ["{} {}  total {:7.1f}s".format(self.name, attrs, total)]
+        nameWidth = max([len(s['name']) for s in self.spans] + [10])
+        for s in sorted(self.spans, key=lambda s: s['start']):
+            first = int((s['start'] - self.start) / total * width)
+            last = max(first + 1, int((s['end'] - self.start) / total * width))
+            bar = " " * first + "#" * (last - first)
+            lines.append("  {:{}} |{:{}}| {:7.1f}s{}".format(s['name'], nameWidth, bar, width, s['end'] - s['start'], "  FAILED" if s['error'] else ""))
+        return "\n".join(lines)
+
+    def asDict(self):
+        return {'name': self.name,
+                'traceId': self.traceId,
+                'start': self.start,
+                'end': self.end,
+                'totalSecs': self.totalSecs(),
+                'attrs': self.attrs,
+                'spans': [dict(s, secs=s['end'] - s['start']) for s in sorted(self.spans, key=lambda s: s['start'])]}
+
+###############################################################################
+
+
+def isExpired(tl, now=None):
+    return tl.boundAt is not None and (now or time.time()) - tl.boundAt > BindMaxSecs
+
+
+def expireStale():
+    """Finish the bound timelines older than BindMaxSecs."""
+    now = time.time()
+    with RegistryLock:
+        stale = [tl for tl in OpenTimelines.values() if isExpired(tl, now)]
+    for tl in stale:
+        tl.finish(expired=True)
+
+
+def forHost(host):
+    """The open timeline bound to host, or None."""
+    tl = OpenTimelines.get(host)
+    if tl is not None and isExpired(tl):
+        tl.finish(expired=True)
+        return None
+    return tl
+
+
+def span(host, name, **attrs):
+    """A context manager timing a phase for host's launch, if it has an
+    open timeline; otherwise a no-op."""
+    tl = forHost(host) if host in OpenTimelines else None
+    return tl.span(name, **attrs) if tl is not None else contextlib.nullcontext()
+
+
+def finishHost(host, **attrs):
+    """Finish the open timeline for host, if there is one."""
+    tl = forHost(host)
+    if tl is not None:
+        tl.finish(**attrs)
+
+###############################################################################
+# Sinks.
+
+
+class JsonLinesSink:
+    """Append each timeline to a file, as one line of JSON."""
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self.lock = threading.Lock()
+
+    def emit(self, timeline):
+        line = json.dumps(timeline.asDict(), default=str)
+        with self.lock, open(self.fpath, 'a') as f:
+            f.write(line + "\n")
+
+
+class PrometheusTextfileSink:
+    """Keep a file for node_exporter's textfile collector: the phases of
+    the latest launch as gauges, plus running totals and counts per
+    phase.  The file is replaced atomically on each launch."""
+
+    def __init__(self, fpath, metric='doutils_launch_phase_seconds'):
+        self.fpath = fpath
+        self.metric = metric
+        self.sums = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def label(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+    def emit(self, timeline):
+        with self.lock:
+            latest = {}
+            for s in timeline.spans:
+                secs = s['end'] - s['start']
+                latest[s['name']] = latest.get(s['name'], 0.0) + secs
+            latest['total'] = timeline.totalSecs()
+            for phase, secs in latest.items():
+                self.sums[phase] = self.sums.get(phase, 0.0) + secs
+                self.counts[phase] = self.counts.get(phase, 0) + 1
+            lines = ["# HELP {} Seconds spent in each phase of the latest droplet launch.".format(self.metric),
+                     "# TYPE {} gauge".format(self.metric)]
+            lines += ['{}{{phase="{}"}} {:.6f}'.format(self.metric, self.label(p), v) for p, v in sorted(latest.items())]
+            lines += ["# HELP {0}_total Seconds spent in each launch phase, over all launches.".format(self.metric),
+                      "# TYPE {0}_total counter".format(self.metric)]
+            lines += ['{}_total{{phase="{}"}} {:.6f}'.format(self.metric, self.label(p), v) for p, v in sorted(self.sums.items())]
+            lines += ["# HELP {0}_launches_total Launches that went through each phase.".format(self.metric),
+                      "# TYPE {0}_launches_total counter".format(self.metric)]
+            lines += ['{}_launches_total{{phase="{}"}} {}'.format(self.metric, self.label(p), v) for p, v in sorted(self.counts.items())]
+            with open(self.fpath + '.tmp', 'w') as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(self.fpath + '.tmp', self.fpath)
+
+
+def otlpAttrs(attrs):
+    return [{'key': str(k), 'value': {'stringValue': str(v)}} for k, v in sorted(attrs.items())]
+
+
+class OtlpJsonSink:
+    """Append each timeline to a file as an OTLP/JSON trace export
+    request (one per line), which OpenTelemetry collectors' file
+    receivers and most tracing backends can import."""
+
+    def __init__(self, fpath, serviceName='doUtils'):
+        self.fpath = fpath
+        self.serviceName = serviceName
+        self.lock = threading.Lock()
+
+    def emit(self, timeline):
+        ns = lambda t: str(int(t * 1e9))    # noqa: E731
+        spans = [{'traceId': timeline.traceId,
+                  'spanId': timeline.spanId,
+                  'name': timeline.name,
+                  'kind': 1,
+                  'startTimeUnixNano': ns(timeline.start),
+                  'endTimeUnixNano': ns(timeline.end or time.time()),
+                  'attributes': otlpAttrs(timeline.attrs)}]
+        for s in timeline.spans:
+            spans.append({'traceId': timeline.traceId,
+                          'spanId': s['spanId'],
+                          'parentSpanId': timeline.spanId,
+                          'name': s['name'],
+                          'kind': 1,
+                          'startTimeUnixNano': ns(s['start']),
+                          'endTimeUnixNano': ns(s['end']),
+                          'attributes': otlpAttrs(s['attrs']),
+                          'status': {'code': 2, 'message': s['error']} if s['error'] else {}})
+        request = {'resourceSpans': [{'resource': {'attributes': otlpAttrs({'service.name': self.serviceName})},
+                                      'scopeSpans': [{'scope': {'name': ModuleName}, 'spans': spans}]}]}
+        with self.lock, open(self.fpath, 'a') as f:
+            f.write(json.dumps(request) + "\n")
+
+
+class OpenTelemetrySink:
+    """Send each timeline through the opentelemetry API, as a trace: a
+    span for the launch, with a child span per phase.  Needs the
+    opentelemetry-api package (and an SDK configured, for the spans to
+    go anywhere)."""
+
+    def __init__(self, tracer=None):
+        from opentelemetry import trace    # optional dependency
+        self.trace = trace
+        self.tracer = tracer or trace.get_tracer(ModuleName)
+
+    def emit(self, timeline):
+        ns = lambda t: int(t * 1e9)    # noqa: E731
+        root = self.tracer.start_span(timeline.name, start_time=ns(timeline.start), attributes={k: str(v) for k, v in timeline.attrs.items()})
+        ctx = self.trace.set_span_in_context(root)
+        for s in timeline.spans:
+            child = self.tracer.start_span(s['name'], context=ctx, start_time=ns(s['start']), attributes={k: str(v) for k, v in s['attrs'].items()})
+            if s['error']:
+                child.set_status(self.trace.Status(self.trace.StatusCode.ERROR, s['error']))
+            child.end(end_time=ns(s['end']))
+        root.end(end_time=ns(timeline.end or time.time()))
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.tunnel
+   :platform: Unix
+   :synopsis: Port forwards and a SOCKS proxy over an SshConn's connection, with throughput counters.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+Port forwards and a SOCKS proxy over an SshConn's connection, with throughput counters.
+
+Rather than running "ssh -L ..." by hand to reach a service on a
+droplet (a database, Jupyter, an HTTP API), ask the SshConn for a
+tunnel; all its client connections ride the one authenticated ssh
+connection, each in its own channel:
+
+    * LocalForward -- like ssh -L: connections to a local port go to
+      host:port as seen from the droplet
+    * RemoteForward -- like ssh -R: connections to a port on the
+      droplet come to host:port as seen from here
+    * SocksProxy -- like ssh -D: a local SOCKS5 proxy, whose
+      connections go out from the droplet
+
+EG:
+
+    db = sConn.forwardLocal(5432, remotePort=5432)     # then connect to localhost:5432
+    jupyter = sConn.forwardLocal(0, remotePort=8888)   # 0: any free port
+    print("http://localhost:{}/".format(jupyter.localPort))
+    proxy = sConn.socksProxy(1080)
+    print(db.stats())
+    sConn.close()    # closes its tunnels too
+
+A LocalForward or SocksProxy can keep a few channels opened ahead of
+need (warm), so a client connecting doesn't wait a round trip for one.
+(An ssh channel carries one TCP connection, start to end, so channels
+can't be handed from one client to the next; warming is the reuse
+there is.  Warm channels are already connected at the droplet's end,
+and are dropped after maxIdleSecs, as servers may time them out.)
+
+Each tunnel counts its connections and the bytes each way; stats()
+reports them, and the throughput.
+
+With SshConn's openssh backend, the channels are "ssh -W"s through the
+ControlMaster, and a RemoteForward is the ControlMaster's own ("ssh -O
+forward -R"), to a port here that relays it on (NativeRemoteForward),
+so it's counted just the same.
+
+"""
+
+import os
+import sys
+import time
+import socket
+import struct
+import logging
+import threading
+import weakref
+import ipaddress
+import collections
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+RelayBytes = 65536
+DefaultMaxIdleSecs = 30.0
+ForwardWaitSecs = 5.0       # for a RemoteForward to register, once its connections come
+
+
+def closeQuietly(*ends):
+    for end in ends:
+        try:
+            end.close()
+        except (OSError, EOFError):
+            pass
+
+
+class Tunnel:
+    """
+    What the kinds of tunnel have in common: counters, relaying, and
+    closing.
+
+    Operations:
+        stats -- connections, bytes each way, throughput
+        close
+    """
+
+    def __init__(self, sConn):
+        self.sConn = sConn
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.connections = 0
+        self.active = 0
+        self.failed = 0
+        self.bytesIn = 0        # arrived over the ssh connection
+        self.bytesOut = 0       # sent over it
+        self.closing = threading.Event()
+        self.ends = set()       # open sockets and channels, to close with the tunnel
+
+    def count(self, attr, n):
+        with self.lock:
+            setattr(self, attr, getattr(self, attr) + n)
+
+    def pump(self, src, dst, attr):
+        """Copy src to dst until src ends, then pass the end on (a
+        half-close: the other way may still have more to say)."""
+        try:
+            for data in iter(lambda: src.recv(RelayBytes), b''):
+                dst.sendall(data)
+                self.count(attr, len(data))
+            if isinstance(dst, socket.socket):
+                dst.shutdown(socket.SHUT_WR)
+            else:
+                dst.shutdown_write()
+        except (OSError, EOFError):
+            closeQuietly(src, dst)    # and so end the other way too
+
+    def relay(self, sock, channel):
+        """Relay between a socket here and its channel, until both ways
+        have ended."""
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.lock:
+            self.connections += 1
+            self.active += 1
+            self.ends.update((sock, channel))
+        inward = threading.Thread(target=self.pump, args=(channel, sock, 'bytesIn'), daemon=True)
+        inward.start()
+        try:
+            self.pump(sock, channel, 'bytesOut')
+            inward.join()
+        finally:
+            closeQuietly(sock, channel)
+            with self.lock:
+                self.active -= 1
+                self.ends.difference_update((sock, channel))
+
+    def stats(self):
+        """
+        Returns : dict
+            'connections' (so far), 'active', 'failed', 'bytesIn'
+            (arrived over the ssh connection), 'bytesOut' (sent over
+            it), 'secs' (open), and 'inMBps' and 'outMBps' (averaged
+            over that).
+        """
+        with self.lock:
+            secs = time.time() - self.started
+            return {'connections': self.connections, 'active': self.active, 'failed': self.failed,
+                    'bytesIn': self.bytesIn, 'bytesOut': self.bytesOut, 'secs': secs,
+                    'inMBps': self.bytesIn / secs / 1e6, 'outMBps': self.bytesOut / secs / 1e6}
+
+    def close(self):
+        self.closing.set()
+        with self.lock:
+            ends = list(self.ends)
+        closeQuietly(*ends)
+        if self in getattr(self.sConn, 'tunnels', []):
+            self.sConn.tunnels.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+###############################################################################
+
+
+class ListeningTunnel(Tunnel):
+    """A tunnel with a local listening socket (LocalForward and
+    SocksProxy), and a pool of warm channels per destination."""
+
+    def __init__(self, sConn, localPort, localHost, warm, maxIdleSecs):
+        super().__init__(sConn)
+        self.warm = warm
+        self.maxIdleSecs = maxIdleSecs
+        self.warmChannels = collections.defaultdict(collections.deque)    # (host, port) -> deque of (opened, channel)
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((localHost, localPort))
+        self.listener.listen(128)
+        self.localHost = localHost
+        self.localPort = self.listener.getsockname()[1]
+        self.ends.add(self.listener)
+
+    def start(self):
+        threading.Thread(target=self.serve, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def serve(self):
+        while not self.closing.is_set():
+            try:
+                clientSock, _addr = self.listener.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.handle, args=(clientSock,), daemon=True).start()
+
+    def channelTo(self, host, port):
+        """A channel to host:port -- a warm one if there is one -- and
+        top up the warm ones."""
+        channel = None
+        now = time.time()
+        with self.lock:
+            pool = self.warmChannels[(host, port)]
+            while pool and channel is None:
+                opened, candidate = pool.popleft()
+                if now - opened <= self.maxIdleSecs and candidate.active and not candidate.closed:
+                    channel = candidate
+                else:
+                    self.ends.discard(candidate)
+                    candidate.close()
+        if self.warm:
+            threading.Thread(target=self.topUp, args=(host, port), daemon=True).start()
+        return channel or self.sConn.openTcpChannel(host, port)
+
+    def topUp(self, host, port):
+        while not self.closing.is_set():
+            with self.lock:
+                if len(self.warmChannels[(host, port)]) >= self.warm:
+                    return
+            try:
+                channel = self.sConn.openTcpChannel(host, port)
+            except Exception as e:
+                log.info("can't warm a channel to {}:{}: {}".format(host, port, e))
+                return
+            with self.lock:
+                self.warmChannels[(host, port)].append((time.time(), channel))
+                self.ends.add(channel)
+
+    def handle(self, clientSock):
+        raise NotImplementedError
+
+    def close(self):
+        try:
+            self.listener.shutdown(socket.SHUT_RDWR)    # wakes serve()'s accept()
+        except OSError:
+            pass
+        super().close()
+
+
+class LocalForward(ListeningTunnel):
+    """
+    Like ssh -L: each connection to localHost:localPort is carried to
+    remoteHost:remotePort, as reached from the droplet.
+    """
+
+    def __init__(self, sConn, localPort, remoteHost='127.0.0.1', remotePort=None, localHost='127.0.0.1',
+                 warm=0, maxIdleSecs=DefaultMaxIdleSecs):
+        """
+        localPort : int
+            0 for any free port (see .localPort).
+
+        remoteHost, remotePort : string, int
+            Where connections go, from the droplet's point of view;
+            remotePort defaults to localPort.
+
+        warm : int
+            Channels to keep opened ahead of need.
+        """
+        super().__init__(sConn, localPort, localHost, warm, maxIdleSecs)
+        self.remoteHost = remoteHost
+        self.remotePort = remotePort or localPort
+        if warm:
+            threading.Thread(target=self.topUp, args=(self.remoteHost, self.remotePort), daemon=True).start()
+
+    def __repr__(self):
+        return "LocalForward({}:{} -> {}:{})".format(self.localHost, self.localPort, self.remoteHost, self.remotePort)
+
+    def handle(self, clientSock):
+        try:
+            channel = self.channelTo(self.remoteHost, self.remotePort)
+        except Exception as e:
+            log.info("{}: can't open a channel: {}".format(self, e))
+            self.count('failed', 1)
+            clientSock.close()
+            return
+        self.relay(clientSock, channel)
+
+
+class SocksProxy(ListeningTunnel):
+    """
+    Like ssh -D: a SOCKS5 proxy (no authentication; CONNECT only) on
+    localHost:localPort, whose connections go out from the droplet.
+    """
+
+    def __init__(self, sConn, localPort=1080, localHost='127.0.0.1', warm=0, maxIdleSecs=DefaultMaxIdleSecs):
+        super().__init__(sConn, localPort, localHost, warm, maxIdleSecs)
+
+    def __repr__(self):
+        return "SocksProxy({}:{})".format(self.localHost, self.localPort)
+
+    @staticmethod
+    def recvExactly(sock, n):
+        data = b''
+        while len(data) < n:
+            chunk = sock.recv(n - len(data))
+            if not chunk:
+                raise EOFError("client closed")
+            data += chunk
+        return data
+
+    def handle(self, clientSock):
+        reply = lambda code: clientSock.sendall(struct.pack('!BBBB', 5, code, 0, 1) + b'\0' * 6)    # noqa: E731
+        try:
+            version, nMethods = self.recvExactly(clientSock, 2)
+            self.recvExactly(clientSock, nMethods)
+            if version != 5:
+                raise ValueError("SOCKS version {}".format(version))
+            clientSock.sendall(b'\x05\x00')    # no authentication
+            version, cmd, _rsv, addrType = self.recvExactly(clientSock, 4)
+            if addrType == 1:
+                host = str(ipaddress.IPv4Address(self.recvExactly(clientSock, 4)))
+            elif addrType == 3:
+                host = self.recvExactly(clientSock, self.recvExactly(clientSock, 1)[0]).decode('idna')
+            elif addrType == 4:
+                host = str(ipaddress.IPv6Address(self.recvExactly(clientSock, 16)))
+            else:
+                raise ValueError("SOCKS address type {}".format(addrType))
+            (port,) = struct.unpack('!H', self.recvExactly(clientSock, 2))
+            if cmd != 1:
+                reply(7)    # command not supported
+                raise ValueError("SOCKS command {}".format(cmd))
+        except (OSError, EOFError, ValueError) as e:
+            log.info("{}: bad request: {}".format(self, e))
+            self.count('failed', 1)
+            clientSock.close()
+            return
+        try:
+            channel = self.channelTo(host, port)
+        except Exception as e:
+            log.info("{}: can't reach {}:{}: {}".format(self, host, port, e))
+            self.count('failed', 1)
+            try:
+                reply(5)    # connection refused
+            except OSError:
+                pass
+            clientSock.close()
+            return
+        reply(0)
+        self.relay(clientSock, channel)
+
+###############################################################################
+
+
+class ForwardDispatcher:
+    """
+    Hands each connection to a forwarded port to its RemoteForward.  A
+    paramiko Transport has just the one handler for all of its
+    tcpip-forwards (each request_port_forward() replaces the last's, and
+    cancel_port_forward() drops it), so each transport gets one of
+    these (see dispatcherFor()), as that handler for good.
+
+    Operations:
+        register, unregister -- a RemoteForward's port
+        dispatch -- the transport's handler
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.forwards = {}      # (address, port) -> RemoteForward
+        self.changed = threading.Condition()
+
+    def register(self, forward, address, port):
+        """
+        Ask for a tcpip-forward, and send its connections to forward.
+
+        Returns : int
+            The port (the server's choice, for 0).
+        """
+        port = self.transport.request_port_forward(address, port, handler=self.dispatch)
+        with self.changed:
+            self.forwards[(address, port)] = forward
+            self.changed.notify_all()
+        return port
+
+    def unregister(self, address, port):
+        """Cancel a tcpip-forward, leaving the handler for the rest.
+        (Not cancel_port_forward(), which would drop it.)"""
+        with self.changed:
+            self.forwards.pop((address, port), None)
+        if self.transport.is_active():
+            self.transport.global_request('cancel-tcpip-forward', (address, port), wait=True)
+
+    def find(self, address, port):
+        """The RemoteForward for a server's (address, port): exactly,
+        or else the only one on that port (a server may name the
+        address differently)."""
+        forward = self.forwards.get((address, port))
+        if forward is None:
+            onPort = [f for (_a, p), f in self.forwards.items() if p == port]
+            forward = onPort[0] if len(onPort) == 1 else None
+        return forward
+
+    def dispatch(self, channel, origin, server):
+        threading.Thread(target=self.deliver, args=(channel, server), daemon=True).start()
+
+    def deliver(self, channel, server):
+        # A connection can come before register() has heard its port.
+        with self.changed:
+            forward = None
+            deadline = time.time() + ForwardWaitSecs
+            while forward is None and time.time() < deadline:
+                forward = self.find(*server)
+                if forward is None:
+                    self.changed.wait(deadline - time.time())
+        if forward is None:
+            log.info("no forward for a connection to {}:{}".format(*server))
+            channel.close()
+            return
+        forward.handle(channel)
+
+
+Dispatchers = weakref.WeakKeyDictionary()     # paramiko Transport -> its ForwardDispatcher
+DispatchersLock = threading.Lock()
+
+
+def dispatcherFor(transport):
+    """transport's ForwardDispatcher, made the first time."""
+    with DispatchersLock:
+        if transport not in Dispatchers:
+            Dispatchers[transport] = ForwardDispatcher(transport)
+        return Dispatchers[transport]
+
+
+class RemoteForward(Tunnel):
+    """
+    Like ssh -R: each connection to remoteBind:remotePort on the droplet
+    is carried to localHost:localPort, as reached from here.
+    """
+
+    def __init__(self, sConn, remotePort, localHost='127.0.0.1', localPort=None, remoteBind='127.0.0.1'):
+        """
+        remotePort : int
+            0 for any free port on the droplet (see .remotePort).
+
+        localHost, localPort : string, int
+            Where connections go, from here; localPort defaults to
+            remotePort.
+
+        remoteBind : string
+            The droplet's address to listen on ('' for all of them;
+            needs GatewayPorts in its sshd_config).
+        """
+        super().__init__(sConn)
+        self.localHost = localHost
+        self.localPort = localPort or remotePort
+        self.remoteBind = remoteBind
+        self.dispatcher = dispatcherFor(sConn.sshClient.get_transport())
+        self.remotePort = self.dispatcher.register(self, remoteBind, remotePort)
+
+    def __repr__(self):
+        return "RemoteForward({}:{} -> {}:{})".format(self.remoteBind, self.remotePort, self.localHost, self.localPort)
+
+    def handle(self, channel):
+        try:
+            sock = socket.create_connection((self.localHost, self.localPort))
+        except OSError as e:
+            log.info("{}: can't connect: {}".format(self, e))
+            self.count('failed', 1)
+            channel.close()
+            return
+        self.relay(sock, channel)
+
+    def close(self):
+        try:
+            self.dispatcher.unregister(self.remoteBind, self.remotePort)
+        except Exception as e:
+            log.info("{}: cancelling: {}".format(self, e))
+        super().close()
+
+
+class NativeRemoteForward(ListeningTunnel):
+    """
+    A RemoteForward for SshConn's openssh backend: the ControlMaster
+    forwards remoteBind:remotePort on the droplet to a listening port
+    here, whose connections are relayed on to localHost:localPort.
+    """
+
+    def __init__(self, sConn, remotePort, localHost='127.0.0.1', localPort=None, remoteBind='127.0.0.1'):
+        """As for RemoteForward."""
+        super().__init__(sConn, 0, '127.0.0.1', 0, DefaultMaxIdleSecs)
+        self.localHost, self.localPort = localHost, localPort or remotePort
+        self.remoteBind = remoteBind
+        self.spec = None
+        try:
+            said = sConn.controlForward('forward', self.forwardSpec(remotePort))
+            self.remotePort = int(said) if remotePort == 0 else remotePort
+            self.spec = self.forwardSpec(self.remotePort)
+        except Exception:
+            closeQuietly(self.listener)
+            raise
+
+    def forwardSpec(self, remotePort):
+        return '{}:{}:127.0.0.1:{}'.format(self.remoteBind or '*', remotePort, self.listener.getsockname()[1])
+
+    def __repr__(self):
+        return "RemoteForward({}:{} -> {}:{})".format(self.remoteBind, self.remotePort, self.localHost, self.localPort)
+
+    def handle(self, relayedSock):
+        try:
+            sock = socket.create_connection((self.localHost, self.localPort))
+        except OSError as e:
+            log.info("{}: can't connect: {}".format(self, e))
+            self.count('failed', 1)
+            relayedSock.close()
+            return
+        self.relay(sock, relayedSock)
+
+    def close(self):
+        if self.spec is not None:
+            try:
+                self.sConn.controlForward('cancel', self.spec)
+            except Exception as e:
+                log.info("{}: cancelling: {}".format(self, e))
+            self.spec = None
+        super().close()
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
@@ -24,7 +24,6 @@ See:
 import os
 import sys
 import logging
-import digitalocean
 from doUtils.keypair import Keypair
 
 ###############################################################################
@@ -48,21 +47,35 @@ class SshKeypair(Keypair):
 
         username : string
 
+        >>> import digitalocean
         >>> key = SshKeypair('Bob')
         >>> key.username == 'Bob' and type(key.pemFilePathnameAsStr) == str and type(key.doSshKey) == digitalocean.SSHKey
         True
 
         """
+        import digitalocean    # here rather than at top, to keep "import doUtils" quick
         super(SshKeypair, self).__init__()
         self.writeToDisk(passPhrase="")
         publicKey = self.publicKeyOpensshAsBytes.decode('utf-8')
         self.username = username
-        self.doSshKey = digitalocean.SSHKey()
+        self.doSshKey = digitalocean.SSHKey(**getApiEndpointKwargs())
         self.doSshKey.token = getApiToken()
         self.doSshKey.public_key = publicKey
         self.doSshKey.name = os.path.basename(self.pemFilePathnameAsStr)
         self.doSshKey.create()
 
+    def destroy(self):
+        """
+        Unregister the key with Digital Ocean, and delete the key file
+        -- once the droplets made with it are gone (or no longer need
+        logging in to).
+        """
+        self.doSshKey.destroy()
+        try:
+            os.remove(self.pemFilePathnameAsStr)
+        except FileNotFoundError:
+            pass
+
 ###############################################################################
 # API token stuff.
 
@@ -95,6 +108,31 @@ def getApiToken():
         except KeyError:
             raise ApiTokenIsMissingError
 
+
+# The optional environment variable DigitalOceanApiEndpoint points us at
+# a different API server -- eg a local stand-in, for benchmarking (see
+# benchmarks/fakeDoApi.py).
+
+
+def getApiEndpoint():
+    """
+    Fetch the Digital Ocean API endpoint URL from the environment, if
+    it's set there.
+
+    Returns: string
+        The URL (eg 'http://127.0.0.1:8080/v2/'), or None for the
+        real API.
+
+    """
+    return os.environ.get("DigitalOceanApiEndpoint") or None
+
+
+def getApiEndpointKwargs():
+    """Keyword arguments for python-digitalocean objects, pointing
+    them at getApiEndpoint() if it's set."""
+    endPoint = getApiEndpoint()
+    return {'end_point': endPoint} if endPoint else {}
+
 ###############################################################################
 
 def getManager():
@@ -103,6 +141,7 @@ def getManager():
 
     Returns: Manager object (see python-digitalocean)
 
+    >>> import digitalocean
     >>> manager = getManager()
     >>> type(manager) == digitalocean.Manager
     True
@@ -111,13 +150,34 @@ def getManager():
     try:
         return getManager.manager
     except AttributeError:
+        import digitalocean
         doToken = getApiToken()
-        getManager.manager = digitalocean.Manager(token=doToken)
+        getManager.manager = digitalocean.Manager(token=doToken, **getApiEndpointKwargs())
         return getManager.manager
 
 ###############################################################################
 
 
+def getCacheDir():
+    """Where doUtils keeps things between runs (measurements, journals,
+    cached results): $XDG_CACHE_HOME/doUtils, or ~/.cache/doUtils.
+    Created if need be.
+
+    Returns: string
+        The directory's pathname.
+
+    >>> os.path.isdir(getCacheDir())
+    True
+
+    """
+    cacheHome = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.environ["HOME"], ".cache")
+    cacheDir = os.path.join(cacheHome, "doUtils")
+    os.makedirs(cacheDir, exist_ok=True)
+    return cacheDir
+
+###############################################################################
+
+
 if __name__ == "__main__":   # pragma: no cover
     if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
         # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
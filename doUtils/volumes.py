@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+"""
+.. module:: doUtils.volumes
+   :platform: Unix
+   :synopsis: Data volumes for droplets: made from snapshots, attached at creation, mounted by cloud-init.
+
+.. moduleauthor:: John Kimball <jjkimball@acm.org>
+
+Data volumes for droplets: made from snapshots, attached at creation, mounted by cloud-init.
+
+Copying a dataset to each new droplet with SshConn.put() costs time in
+proportion to its size, every launch.  Instead, put the dataset on a
+block storage volume once, snapshot it, and have each droplet made
+with a volume of its own, made from the snapshot: the data's there
+when the droplet boots, at block-device speed, with no sftp traffic.
+makeDroplet(volumes=...) makes the volumes (see makeVolumes()),
+creates the droplet with them attached, and has cloud-init mount them
+(see makeUserData(volumes=...)).
+
+EG, once:
+
+    dParms = makeDroplet(iId, volumes=[{'sizeGb': 100, 'mountPoint': '/data'}])
+    ... fill /data on it ...
+    snapshotId = snapshotVolume(dParms['volumes'][0], 'genomes-2018-04')
+
+and then for each droplet:
+
+    dParms = makeDroplet(iId, volumes=[{'snapshot': snapshotId, 'mountPoint': '/data', 'readOnly': True}])
+    ...
+    dParms['droplet'].destroy()
+    destroyVolumes(dParms)
+
+A volume is a spec -- a dictionary with:
+
+    * mountPoint -- where to mount it (required)
+    * snapshot -- a volume snapshot's id, to make it from; or
+    * sizeGb -- its size, for an empty, formatted, volume (for one
+      from a snapshot, defaults to the snapshot's size)
+    * volume -- instead, an existing volume's id (a volume can only be
+      attached to one droplet at a time)
+    * name, fsType ('ext4' or 'xfs'), readOnly -- optional
+
+Volumes made here are tagged doutils, so reap() (see reaper.py) finds
+ones left behind.  They must be in the droplet's region.
+
+"""
+
+import os
+import sys
+import time
+import logging
+import doUtils
+import doUtils.utils
+
+###############################################################################
+
+ModuleName = __name__ if __name__ != '__main__' else os.path.basename(__file__)
+log = logging.getLogger(ModuleName)
+
+###############################################################################
+
+VolumeDevicePrefix = '/dev/disk/by-id/scsi-0DO_Volume_'
+VolumeTag = 'doutils'
+DefaultFsType = 'ext4'
+
+
+def volumeDevice(name):
+    """
+    The device a droplet sees a volume as.
+
+    >>> volumeDevice('data-1')
+    '/dev/disk/by-id/scsi-0DO_Volume_data-1'
+    """
+    return VolumeDevicePrefix + name
+
+
+def newVolumeName(i=0):
+    """A volume name (unique, in practice): lowercase, digits and dashes."""
+    return "data-{:x}-{}".format(time.time_ns(), i)
+
+
+def makeVolume(spec, region, tags=(), i=0):
+    """
+    Make (or find) the volume for spec (see above).
+
+    Returns : dict
+        'id', 'name', 'device', 'mountPoint', 'fsType', 'readOnly', and
+        'made' (whether it was made here, rather than existing).
+    """
+    import digitalocean    # here rather than at top, to keep "import doUtils" quick
+    if 'mountPoint' not in spec:
+        raise ValueError("volume spec {} has no mountPoint".format(spec))
+    apiArgs = dict(token=doUtils.getApiToken(), **doUtils.utils.getApiEndpointKwargs())
+    fsType = spec.get('fsType', DefaultFsType)
+    if spec.get('volume'):
+        volume = digitalocean.Volume(id=spec['volume'], **apiArgs).load()
+        made = False
+    else:
+        # Volume's create methods send its attributes, ignoring their arguments.
+        volumeArgs = dict(name=spec.get('name') or newVolumeName(i), region=region,
+                          tags=[VolumeTag] + list(tags), description='doUtils data volume', **apiArgs)
+        if spec.get('snapshot'):
+            sizeGb = spec.get('sizeGb')
+            if not sizeGb:
+                sizeGb = digitalocean.Snapshot(id=spec['snapshot'], **apiArgs).load().min_disk_size
+            volume = digitalocean.Volume(snapshot_id=spec['snapshot'], size_gigabytes=sizeGb, **volumeArgs).create_from_snapshot()
+        elif spec.get('sizeGb'):
+            volume = digitalocean.Volume(size_gigabytes=spec['sizeGb'], filesystem_type=fsType, **volumeArgs).create()
+        else:
+            raise ValueError("volume spec {} needs a snapshot, sizeGb, or volume".format(spec))
+        made = True
+        log.info("made volume {} ({})".format(volume.name, volume.id))
+    return {'id': volume.id, 'name': volume.name, 'device': volumeDevice(volume.name), 'mountPoint': spec['mountPoint'],
+            'fsType': fsType, 'readOnly': bool(spec.get('readOnly')), 'made': made}
+
+
+def makeVolumes(specs, region, tags=()):
+    """
+    makeVolume() for each spec.  If one fails, the ones made so far are
+    destroyed.
+
+    Returns : list of dict
+        As from makeVolume().
+    """
+    volumes = []
+    try:
+        for i, spec in enumerate(specs):
+            volumes.append(makeVolume(spec, region, tags, i))
+    except BaseException:
+        destroyVolumes({'volumes': volumes})
+        raise
+    return volumes
+
+
+def destroyVolumes(dParms):
+    """Destroy the volumes makeDroplet() made for a droplet (once it's
+    been destroyed, or the volumes detached).  Existing volumes it was
+    given are left alone."""
+    import digitalocean    # here rather than at top, to keep "import doUtils" quick
+    for v in dParms.get('volumes') or []:
+        if v.get('made'):
+            digitalocean.Volume(id=v['id'], token=doUtils.getApiToken(), **doUtils.utils.getApiEndpointKwargs()).destroy()
+            log.info("destroyed volume {} ({})".format(v['name'], v['id']))
+
+
+def snapshotVolume(volume, name):
+    """
+    Snapshot a volume (eg one with a dataset on it), for droplets'
+    volumes to be made from.
+
+    volume : dict or string
+        As in makeDroplet()'s 'volumes'; or a volume's id.
+
+    Returns : string
+        The snapshot's id.
+    """
+    import digitalocean    # here rather than at top, to keep "import doUtils" quick
+    volumeId = volume['id'] if isinstance(volume, dict) else volume
+    v = digitalocean.Volume(id=volumeId, token=doUtils.getApiToken(), **doUtils.utils.getApiEndpointKwargs())
+    return v.snapshot(name)['snapshot']['id']
+
+
+###############################################################################
+
+
+if __name__ == "__main__":   # pragma: no cover
+    if len(sys.argv) > 1 and sys.argv[1].lower() == "--unittest":
+        # 'THIS.py --unitTest' or 'THIS.py --unitTest -v'
+        import doctest
+        logging.basicConfig(level=logging.INFO)    # default to stderr. alt: filename='unittest-{}.log'.format(ModuleName)
+        doctest.testmod()
+        log.info("tests done")
@@ -0,0 +1,85 @@
+# Shared by the offline tests: a fake Digital Ocean API
+# (benchmarks/fakeDoApi.py) and a local ssh server
+# (benchmarks/localSshServer.py), in a scratch $HOME -- so no account,
+# droplets, or network are needed.
+#
+# EG:
+#
+#    with offline.offline() as (api, sshd):
+#        dParms = doUtils.makeDroplet('1001')
+#        sConn = doUtils.SshConn(dParms['ip address'], dParms['username'], keyFname=dParms['pemFilePathname'], port=sshd.port)
+
+import os
+import sys
+import logging
+import tempfile
+import contextlib
+
+TestsDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TestsDir, '..'))
+sys.path.insert(0, os.path.join(TestsDir, '..', 'benchmarks'))
+import fakeDoApi          # noqa: E402
+import localSshServer     # noqa: E402
+
+# isUp()'s port probes look like failed handshakes to the ssh server.
+logging.getLogger('paramiko.transport').setLevel(logging.CRITICAL)
+
+EnvVars = ['HOME', 'XDG_CACHE_HOME', 'DigitalOceanApiKey', 'DigitalOceanApiEndpoint', 'DIGITALOCEAN_END_POINT']
+
+
+def forgetCached():
+    """Drop what doUtils keeps from one API (or $HOME) to the next."""
+    import doUtils.utils
+    import doUtils.journal
+    for fn, attr in ((doUtils.utils.getApiToken, 'apiKey'), (doUtils.utils.getManager, 'manager'),
+                     (doUtils.journal.getJournal, 'default')):
+        fn.__dict__.pop(attr, None)
+
+
+@contextlib.contextmanager
+def offline(sshServer=True, cloudInitDelay=0.0, sshHost='127.0.0.1', **apiArgs):
+    """
+    Point doUtils at a fresh fake API, in a scratch $HOME (key files go
+    in its Downloads) and cache dir.
+
+    sshServer : bool
+        Also start a local ssh server; droplets' addresses are this
+        machine's, so connect to its port.
+
+    sshHost : string
+        Where the ssh server listens; '0.0.0.0' to answer on all of
+        127.0.0.0/8, so each of 127.0.0.1, 127.0.0.2, ... can stand for
+        a different host.
+
+    apiArgs : keyword arguments for fakeDoApi.FakeDoApi; actionDelay
+        defaults to 0.
+
+    Yields : tuple (FakeDoApi, LocalSshServer or None)
+    """
+    saved = {k: os.environ.get(k) for k in EnvVars}
+    with tempfile.TemporaryDirectory(prefix='doUtils-test-') as home:
+        os.makedirs(os.path.join(home, 'Downloads'))
+        api = fakeDoApi.FakeDoApi(**dict({'actionDelay': 0}, **apiArgs))
+        os.environ['HOME'] = home
+        os.environ['XDG_CACHE_HOME'] = os.path.join(home, 'cache')
+        os.environ['DigitalOceanApiKey'] = 'x' * 64
+        os.environ['DigitalOceanApiEndpoint'] = api.start()
+        # For the objects python-digitalocean makes itself (eg Droplet.get_actions()'s).
+        os.environ['DIGITALOCEAN_END_POINT'] = api.endPoint
+        forgetCached()
+        sshd = None
+        try:
+            if sshServer:
+                sshd = localSshServer.LocalSshServer(cloudInitDelay=cloudInitDelay, host=sshHost)
+                sshd.start()
+            yield api, sshd
+        finally:
+            if sshd is not None:
+                sshd.stop()
+            api.stop()
+            for k, v in saved.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+            forgetCached()
@@ -0,0 +1,53 @@
+# Check AgentConn's calls, and what a timed-out one leaves, offline.
+# Exercises:
+#    deployAgent, and AgentConn's run and stat, against the local ssh
+#    server (see offline.py); a call that times out closes its
+#    connection, so a later call raises rather than getting the late
+#    reply, and a new AgentConn gets the right answers.
+
+import os
+import signal
+import logging
+import offline
+import doUtils
+
+logging.basicConfig(level=logging.INFO)
+
+
+def test_agent():
+
+    log = logging.getLogger('test_agent')
+
+    with offline.offline() as (_api, sshd):
+        keyFname = doUtils.SshKeypair('tester').pemFilePathnameAsStr
+        with doUtils.SshConn('127.0.0.1', 'tester', keyFname=keyFname, port=sshd.port) as sConn:
+            log.info("deploy the agent (in the server's root)...")
+            with doUtils.deployAgent(sConn) as agent:
+                agentPid = agent.ping()['pid']
+                try:
+                    assert agent.run('echo hi')['stdout'] == 'hi\n'
+                    assert agent.stat(['nosuch']) == [None]
+
+                    log.info("a call that times out breaks its connection...")
+                    slow = doUtils.AgentConn(sConn, timeout=1.0)
+                    try:
+                        slow.run('sleep 1.5; echo slow')
+                        assert False, "should have timed out"
+                    except TimeoutError:
+                        pass
+                    try:
+                        slow.run('echo fast')
+                        assert False, "should have raised"
+                    except ConnectionError as e:
+                        assert 'make a new AgentConn' in str(e)
+                    slow.close()
+
+                    log.info("...and a new one gets the right answers, even once the late reply's due...")
+                    with doUtils.AgentConn(sConn, timeout=1.0) as fresh:
+                        assert fresh.run('echo fast')['stdout'] == 'fast\n'
+                        assert fresh.run('sleep 0.7; echo later')['stdout'] == 'later\n'
+                        assert fresh.run('echo fast')['stdout'] == 'fast\n'
+                finally:
+                    os.kill(agentPid, signal.SIGTERM)
+
+    log.info("DONE")
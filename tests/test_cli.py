@@ -0,0 +1,76 @@
+# Check the doutils command against its daemon, offline.
+# Exercises:
+#    cli.main's daemon start, status and stop, and up, ls, exec, put,
+#    get and down, each through a daemon (in its own process) -- against
+#    the fake API and the local ssh server (see offline.py); and that
+#    the daemon doesn't remember a host that wasn't a droplet once it
+#    becomes one.
+
+import os
+import json
+import logging
+import offline
+import doUtils
+from doUtils import cli
+
+logging.basicConfig(level=logging.INFO)
+
+
+def test_cli(capsys):
+
+    log = logging.getLogger('test_cli')
+
+    with offline.offline() as (api, sshd):
+        home = os.environ['HOME']
+        sock = os.path.join(home, 'daemon.sock')
+        keyFname = doUtils.SshKeypair('tester').pemFilePathnameAsStr
+        port = str(sshd.port)
+
+        def doutils(*argv):
+            capsys.readouterr()
+            status = cli.main(['--socket', sock] + list(argv))
+            out = capsys.readouterr().out
+            return status, out
+
+        log.info("start the daemon...")
+        status, out = doutils('daemon', 'start')
+        assert status == 0 and out.startswith("daemon started")
+        try:
+            log.info("exec on an address that's no droplet yet, as a given user with a given key...")
+            assert doutils('exec', '--user', 'tester', '--key', keyFname, '--port', port, '127.0.0.1', 'echo', 'hi') == (0, 'hi\n')
+
+            log.info("up makes a droplet (at that address)...")
+            status, out = doutils('up', '1001', '--json')
+            made = json.loads(out)
+            assert status == 0 and len(made) == 1 and made[0]['ip'] == '127.0.0.1'
+            dropletId = made[0]['id']
+            status, out = doutils('ls', '--json')
+            assert status == 0 and [d['id'] for d in json.loads(out)] == [dropletId]
+
+            log.info("...and now the address is found to be it, with its user and key...")
+            assert doutils('exec', '--port', port, '127.0.0.1', 'echo', 'hi') == (0, 'hi\n')
+            assert doutils('exec', '--port', port, str(dropletId), 'exit', '3')[0] == 3
+
+            log.info("put and get...")
+            localFpath = os.path.join(home, 'data.txt')
+            with open(localFpath, 'w') as f:
+                f.write("some data\n")
+            assert doutils('put', '--port', port, str(dropletId), localFpath, 'data.txt')[0] == 0
+            assert doutils('get', '--port', port, str(dropletId), 'data.txt', localFpath + '.back')[0] == 0
+            with open(localFpath + '.back') as f:
+                assert f.read() == "some data\n"
+
+            log.info("it was all the daemon's doing...")
+            status, out = doutils('daemon', 'status')
+            requests, connections = [int(out.split(' ' + what)[0].split()[-1]) for what in ('requests', 'ssh connections')]
+            assert status == 0 and requests >= 7 and connections == 2
+
+            log.info("down destroys the droplet...")
+            assert doutils('down', str(dropletId)) == (0, "destroyed {}\n".format(dropletId))
+            assert api.state.droplets == {}
+        finally:
+            status, out = doutils('daemon', 'stop')
+        assert status == 0 and out.startswith("daemon stopped")
+        assert doutils('daemon', 'status')[0] == 1
+
+    log.info("DONE")
@@ -0,0 +1,104 @@
+# Check Collector's framing, offline.
+# Exercises:
+#    Collector against the local ssh server (see offline.py): a tailed
+#    file's new lines and /proc samples arriving in frames, and written
+#    out; and Collector.receive given frames split across reads, and a
+#    bad frame -- which drops just that host's channel, keeping the
+#    frames before it.
+
+import os
+import gzip
+import json
+import time
+import zlib
+import logging
+import offline
+import doUtils
+from doUtils.collector import Collector, CollectedHost
+from doUtils.collectorRemote import FrameHeader
+
+logging.basicConfig(level=logging.INFO)
+
+
+def frame(records):
+    data = zlib.compress(json.dumps(records).encode('utf-8'))
+    return FrameHeader.pack(len(data)) + data
+
+
+class FakeChannel:
+    """Hands out given chunks of a channel's output, one per recv()."""
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.closed = False
+
+    def recv_stderr_ready(self):
+        return False
+
+    def recv(self, n):
+        return self.chunks.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+def collected(outDir):
+    records = []
+    for fname in sorted(os.listdir(outDir)):
+        with gzip.open(os.path.join(outDir, fname), 'rt') as f:
+            records.extend(json.loads(line) for line in f)
+    return records
+
+
+def test_collector():
+
+    log = logging.getLogger('test_collector')
+
+    with offline.offline() as (_api, sshd):
+        home = os.environ['HOME']
+        keyFname = doUtils.SshKeypair('tester').pemFilePathnameAsStr
+        logFpath = os.path.join(sshd.root, 'job.log')
+        with open(logFpath, 'w') as f:
+            f.write("before\n")
+
+        log.info("a tailed file's new lines, and samples, come back...")
+        outDir = os.path.join(home, 'collected')
+        coll = Collector(['127.0.0.1'], files=['job.log'], outDir=outDir, user='tester', keyFname=keyFname, port=sshd.port,
+                         intervalSecs=0.1, batchSecs=0.2)
+        coll.start()
+        try:
+            time.sleep(0.5)
+            with open(logFpath, 'a') as f:
+                f.write("one\ntwo\n")
+            deadline = time.time() + 30
+            while coll.stats()['records'] < 3 and time.time() < deadline:
+                time.sleep(0.1)
+        finally:
+            coll.stop()
+        assert coll.pool.conns == {}    # its own pool, closed by stop()
+        stats = coll.stats()
+        assert stats['hosts']['127.0.0.1']['error'] is None and stats['batches'] >= 1
+        records = collected(outDir)
+        assert [r['line'] for r in records if r['kind'] == 'log'] == ['one', 'two']
+        assert all(r['host'] == '127.0.0.1' and 'cpuPct' in r for r in records if r['kind'] == 'sample')
+
+        log.info("frames split across reads are put back together...")
+        outDir = os.path.join(home, 'framed')
+        coll = Collector([], outDir=outDir)
+        h = CollectedHost('10.0.0.1', 'tester', None, 22)
+        good = frame([{'t': 1.0, 'kind': 'log', 'path': 'a.log', 'offset': 4, 'lines': ['abc']}])
+        h.channel = FakeChannel([good[:3], good[3:] + good[:-2], good[-2:]])
+        for _ in range(3):
+            coll.receive(h)
+        assert h.batches == 2 and h.records == 2 and h.buffer == b'' and h.offsets == {'a.log': 4}
+
+        log.info("a bad frame drops that host, but keeps the good frames before it...")
+        bad = FrameHeader.pack(5) + b'junk!'
+        channel = h.channel = FakeChannel([good + bad + good])
+        coll.receive(h)
+        assert h.batches == 3 and h.records == 3
+        assert h.channel is None and channel.closed and 'bad frame' in h.error and h.retryAt > time.time()
+        coll.writer.close()
+        assert [r['line'] for r in collected(outDir)] == ['abc'] * 3
+
+    log.info("DONE")
@@ -0,0 +1,56 @@
+# Check DropletPool's sizing, offline.
+# Exercises:
+#    DropletPool's targetSize, scale, launch, stats, shutdown, against
+#    the fake API (see offline.py)
+#
+# The pool's droplets never get ready here (nothing answers ssh on
+# their port 22), so every launch fails and is cleaned up.
+
+import os
+import time
+import queue
+import logging
+import offline
+from doUtils.dropletPool import DropletPool
+
+logging.basicConfig(level=logging.INFO)
+
+
+def test_dropletPool():
+
+    log = logging.getLogger('test_dropletPool')
+
+    log.info("the target size is demand plus standbys, within bounds...")
+    pool = DropletPool('1001', minSize=1, maxSize=5, warmStandby=1)
+    assert pool.targetSize(0, now=1000.0) == 1
+    assert pool.targetSize(2, now=1000.0) == 3
+    assert pool.targetSize(50, now=1000.0) == 5
+
+    log.info("...and allows for rising demand over a boot time...")
+    pool = DropletPool('1001', maxSize=20, warmStandby=0)
+    pool.targetSize(0, now=1000.0)
+    assert pool.targetSize(3, now=1090.0) == 9    # 3, plus 3 per 90 s over the 180 s guessed boot time
+
+    with offline.offline(sshServer=False) as (api, _sshd):
+        log.info("scale() launches to the target...")
+        work = queue.Queue()
+        for i in range(3):
+            work.put(i)
+        pool = DropletPool('1001', maxSize=10, warmStandby=1, demand=work, nTries=1)
+        assert pool.scale() == 4
+        deadline = time.time() + 60
+        while pool.stats()['booting'] and time.time() < deadline:
+            time.sleep(0.2)
+        stats = pool.stats()
+        assert stats['booting'] == 0 and stats['failedBoots'] == 4 and stats['idle'] == 0
+
+        log.info("...with one keypair for all the droplets, and failed ones destroyed...")
+        assert len(api.state.keys) == 1
+        assert api.state.droplets == {}
+
+        log.info("shutdown() deletes the keypair...")
+        pool.shutdown()
+        assert api.state.keys == {}
+        assert [f for f in os.listdir(os.path.join(os.environ['HOME'], 'Downloads')) if f.endswith('.pem')] == []
+
+    log.info("DONE")
@@ -0,0 +1,64 @@
+# Check waitForFleet, offline.
+# Exercises:
+#    waitForFleet against the local ssh server (see offline.py),
+#    answering on all of 127.0.0.0/8 so each address is a host: it
+#    returns once minReady are ready, the rest pending; a host whose
+#    cloud-init finished with errors is failed; and the connections
+#    opened to hosts that aren't ready are closed and out of the pool.
+
+import time
+import logging
+import offline
+import doUtils
+
+logging.basicConfig(level=logging.INFO)
+
+
+def pooledHosts(pool, want):
+    """The hosts pool has connections to, once they're want (a
+    connection still being opened when waitForFleet returned is
+    closed as it's made)."""
+    deadline = time.time() + 10
+    while {k[0] for k in pool.conns} != want and time.time() < deadline:
+        time.sleep(0.05)
+    return {k[0] for k in pool.conns}
+
+
+def test_fleetReady():
+
+    log = logging.getLogger('test_fleetReady')
+
+    with offline.offline(sshHost='0.0.0.0') as (_api, sshd):
+        keyFname = doUtils.SshKeypair('tester').pemFilePathnameAsStr
+        sshd.cloudInitErrors = {'127.0.0.2': None, '127.0.0.3': ['runcmd failed']}    # never finishes; fails
+        fleetArgs = {'user': 'tester', 'keyFname': keyFname, 'port': sshd.port, 'pollSecs': 0.1}
+
+        log.info("minReady are ready, the rest pending...")
+        pool = doUtils.SshConnPool()
+        try:
+            status = doUtils.waitForFleet(['127.0.0.1', '127.0.0.2'], minReady=1, timeout=30, pool=pool, **fleetArgs)
+            assert status['ready'] == ['127.0.0.1'] and status['pending'] == ['127.0.0.2'] and status['failed'] == []
+            assert status['secs'] < 10 and status['cloudInit']['127.0.0.1']['done']
+            _in, out, _err = status['connections']['127.0.0.1'].do('echo hi')
+            assert out.read() == b'hi\n'
+            assert list(status['connections']) == ['127.0.0.1'] and pooledHosts(pool, {'127.0.0.1'}) == {'127.0.0.1'}
+        finally:
+            pool.closeAll()
+
+        log.info("one whose cloud-init had errors is failed, and its connection closed...")
+        pool = doUtils.SshConnPool()
+        try:
+            # (Alone: once one fails, minReady=all can't be met, so it'd return without waiting for the rest.)
+            status = doUtils.waitForFleet(['127.0.0.3'], timeout=30, pool=pool, **fleetArgs)
+            assert status['ready'] == [] and status['failed'] == ['127.0.0.3'] and status['pending'] == []
+            assert 'runcmd failed' in status['errors']['127.0.0.3']
+            assert pool.conns == {}
+
+            log.info("...and one still pending at the timeout is too...")
+            status = doUtils.waitForFleet(['127.0.0.1', '127.0.0.2'], timeout=1, pool=pool, **fleetArgs)
+            assert status['ready'] == ['127.0.0.1'] and status['pending'] == ['127.0.0.2']
+            assert pooledHosts(pool, {'127.0.0.1'}) == {'127.0.0.1'}
+        finally:
+            pool.closeAll()
+
+    log.info("DONE")
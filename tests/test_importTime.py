@@ -0,0 +1,35 @@
+# Check that "import doUtils" stays quick.
+# Exercises:
+#    the lazy name lookup in doUtils/__init__.py, doUtils/cli.py's imports, and
+#    benchmarks/bench_importTime.py
+
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+import bench_importTime    # noqa: E402
+
+logging.basicConfig(level=logging.INFO)
+
+
+def test_importTime():
+
+    log = logging.getLogger('test_importTime')
+
+    log.info("import doUtils shouldn't pull in the heavy packages...")
+    assert bench_importTime.heavyModulesLoaded() == []
+
+    log.info("...and should be under the regression threshold...")
+    importMs = bench_importTime.importTimeUs(nRuns=3) / 1000
+    log.info("import doUtils: {:.1f} ms".format(importMs))
+    assert importMs < bench_importTime.DefaultThresholdMs
+
+    log.info("nor should the doutils command's client side (it leaves them to the daemon)...")
+    assert bench_importTime.heavyModulesLoaded("import doUtils.cli") == []
+
+    log.info("public names still resolve...")
+    proc = bench_importTime.runPython("import doUtils; print(doUtils.makeDroplet.__name__, doUtils.SshConn.__name__)")
+    assert proc.stdout.split() == ['makeDroplet', 'SshConn']
+
+    log.info("DONE")
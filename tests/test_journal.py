@@ -0,0 +1,94 @@
+# Check launch journaling and resuming, offline.
+# Exercises:
+#    makeDroplet's journal records, waitUntilCloudInitDone finishing a
+#    launch, resumeLaunches after a "crash" (at each of: before keys,
+#    after keys, after the droplet was created), and an adopted droplet's
+#    launch being finished at once -- against the fake API and the local
+#    ssh server (see offline.py).
+
+import os
+import logging
+import offline
+import doUtils
+import doUtils.droplet
+from doUtils import journal
+from doUtils.journal import LaunchJournal
+
+logging.basicConfig(level=logging.INFO)
+
+
+def crash():
+    """Forget what this process knew about its launches, as a
+    restarted controller would."""
+    journal.OpenLaunches.clear()
+
+
+def test_journal():
+
+    log = logging.getLogger('test_journal')
+
+    with offline.offline() as (api, sshd):
+        jrnl = LaunchJournal(os.path.join(os.environ['HOME'], 'launches.jsonl'))
+        keyFname = None
+
+        def cloudInit(dParms):
+            with doUtils.SshConn(dParms['ip address'], dParms['username'], keyFname=dParms['pemFilePathname'], port=sshd.port) as sConn:
+                return doUtils.waitUntilCloudInitDone(sConn, nTries=2)['done']
+
+        log.info("makeDroplet journals a launch's phases, up to its address...")
+        dParms = doUtils.makeDroplet('1001', journal=jrnl)
+        keyFname = dParms['pemFilePathname']
+        state = jrnl.launches()[dParms['launch']]
+        assert state['phases'] == ['started', 'keys', 'creating', 'created', 'ip']
+        assert [s['launch'] for s in jrnl.pending()] == [dParms['launch']]
+
+        log.info("...and waitUntilCloudInitDone finishes it...")
+        assert cloudInit(dParms)
+        assert jrnl.launches()[dParms['launch']]['phase'] == 'ready' and jrnl.pending() == []
+
+        log.info("a launch interrupted after its droplet was made is picked up, not made again...")
+        dParms = doUtils.makeDroplet('1001', journal=jrnl)
+        crash()
+        nDroplets = len(api.state.droplets)
+        resumed = doUtils.resumeLaunches(jrnl)
+        assert [(r['resumed'], r['droplet'].id) for r in resumed] == [(True, dParms['droplet'].id)]
+        assert len(api.state.droplets) == nDroplets
+        assert cloudInit(resumed[0]) and jrnl.pending() == []
+
+        log.info("one interrupted after its keys were made gets its droplet made...")
+        crash()
+        launchId = journal.newLaunchId()
+        jrnl.record(launchId, 'started', image='1001', region='sfo2', size='512mb')
+        jrnl.record(launchId, 'keys', username='adminutil', keyname=os.path.basename(keyFname), keyIds=[], pemFilePathname=keyFname,
+                    userData='#cloud-config\n', tags=[journal.launchTag(launchId)], lease=None)
+        resumed = doUtils.resumeLaunches(jrnl)
+        assert len(resumed) == 1 and len(api.state.droplets) == nDroplets + 1
+        assert jrnl.launches()[launchId]['phases'][-3:] == ['creating', 'created', 'ip']
+        assert cloudInit(resumed[0]) and jrnl.launches()[launchId]['phase'] == 'ready'
+
+        log.info("and one interrupted before then is abandoned...")
+        launchId = journal.newLaunchId()
+        jrnl.record(launchId, 'started', image='1001', region='sfo2', size='512mb')
+        assert doUtils.resumeLaunches(jrnl) == [] and jrnl.launches()[launchId]['phase'] == 'abandoned'
+
+        log.info("an adopted droplet's launch is finished at once...")
+        doUtils.droplet.LeaseSettleSecs = 0.1
+        try:
+            made = doUtils.makeDroplet('1001', acquire=True, journal=jrnl)
+            crash()
+            doUtils.releaseDroplet(made)
+            adopted = doUtils.makeDroplet('1001', acquire=True, journal=jrnl)
+        finally:
+            doUtils.droplet.LeaseSettleSecs = 2
+        state = jrnl.launches()[adopted['launch']]
+        assert adopted['adopted'] and state['phase'] == 'ready'
+        log.info("...recording its own cloud-config's fingerprint, not the user data passed in...")
+        assert adopted['userData'] is None and 'userData' not in state
+        assert adopted['fingerprint'] == made['fingerprint'] == state['fingerprint']
+
+        log.info("compact() keeps just the unfinished launches...")
+        jrnl.compact()
+        assert list(jrnl.launches()) == [made['launch']]
+        crash()
+
+    log.info("DONE")
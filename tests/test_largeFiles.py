@@ -0,0 +1,39 @@
+# Check putLarge and getLarge, offline.
+# Exercises:
+#    SshConn's putLarge and getLarge, round trips through the local ssh
+#    server (see offline.py) of an empty file, one byte, one block
+#    (LargeBlockBytes), and a size that's no multiple of the block
+#    size -- each arriving whole, byte for byte.
+
+import os
+import logging
+import offline
+import doUtils
+from doUtils.sshConn import LargeBlockBytes
+
+logging.basicConfig(level=logging.INFO)
+
+
+def test_largeFiles():
+
+    log = logging.getLogger('test_largeFiles')
+
+    with offline.offline() as (_api, sshd):
+        home = os.environ['HOME']
+        keyFname = doUtils.SshKeypair('tester').pemFilePathnameAsStr
+        with doUtils.SshConn('127.0.0.1', 'tester', keyFname=keyFname, port=sshd.port) as sConn:
+            for size in (0, 1, LargeBlockBytes, 2 * LargeBlockBytes + 12345):
+                log.info("round trip of {} bytes...".format(size))
+                data = os.urandom(size)
+                localFpath = os.path.join(home, 'large{}.bin'.format(size))
+                with open(localFpath, 'wb') as f:
+                    f.write(data)
+                remoteFpath = 'large{}.bin'.format(size)
+                sConn.putLarge(localFpath, remoteFpath)
+                with open(os.path.join(sshd.root, remoteFpath), 'rb') as f:
+                    assert f.read() == data
+                sConn.getLarge(remoteFpath, localFpath + '.back')
+                with open(localFpath + '.back', 'rb') as f:
+                    assert f.read() == data
+
+    log.info("DONE")
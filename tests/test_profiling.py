@@ -0,0 +1,95 @@
+# Check profiling's wrapping and unwrapping, offline.
+# Exercises:
+#    profiling's enable (a function, also where it was imported by name,
+#    and a method), stats (calls, errors, peak memory), a call's memory
+#    not being measured while another thread's is, report, writeJson,
+#    writePrometheus, and disable putting the originals back -- with
+#    SshConn.do run against the local ssh server (see offline.py).
+
+import os
+import json
+import logging
+import threading
+import tracemalloc
+import offline
+import doUtils
+import doUtils.droplet
+import doUtils.sshConn
+import doUtils.cloudConfig
+from doUtils import profiling
+
+logging.basicConfig(level=logging.INFO)
+
+
+def test_profiling():
+
+    log = logging.getLogger('test_profiling')
+
+    with offline.offline() as (_api, sshd):
+        originalMakeUserData = doUtils.cloudConfig.makeUserData
+        originalDo = doUtils.sshConn.SshConn.do
+        profiling.reset()
+        wasTracing = tracemalloc.is_tracing()
+
+        log.info("enable() wraps a function, where it's imported too, and a method...")
+        profiling.enable(targets=['doUtils.cloudConfig:makeUserData', 'doUtils.sshConn:SshConn.do', 'doUtils.nosuch:thing'])
+        try:
+            assert profiling.isEnabled() and tracemalloc.is_tracing()
+            assert doUtils.cloudConfig.makeUserData.profiledOriginal is originalMakeUserData
+            assert doUtils.droplet.makeUserData is doUtils.cloudConfig.makeUserData
+            assert doUtils.sshConn.SshConn.do.profiledOriginal is originalDo
+
+            log.info("...whose calls, and failed calls, are counted...")
+            for _ in range(2):
+                doUtils.cloudConfig.makeUserData(keyless=True)
+            try:
+                doUtils.droplet.makeUserData(noSuchArg=True)
+                assert False, "should have raised"
+            except TypeError:
+                pass
+            keyFname = doUtils.SshKeypair('tester').pemFilePathnameAsStr
+            with doUtils.SshConn('127.0.0.1', 'tester', keyFname=keyFname, port=sshd.port) as sConn:
+                _in, out, _err = sConn.do('echo hi')
+                assert out.read() == b'hi\n'
+            stats = profiling.stats()
+            assert stats['makeUserData']['calls'] == 3 and stats['makeUserData']['errors'] == 1
+            assert stats['makeUserData']['maxPeakBytes'] > 0 and stats['makeUserData']['wallSecs'] > 0
+            assert stats['SshConn.do']['calls'] == 1 and 'thing' not in stats
+
+            log.info("a call's peak memory is measured alone...")
+            frame = profiling.Frame(True)
+            data = bytearray(1024 * 1024)
+            assert frame.finish()[2] >= len(data) * 0.9    # other threads (earlier tests' connections) may free some meanwhile
+            del data
+
+            log.info("...but not while another thread's is being measured...")
+            outer = profiling.Frame(True)
+            inner = []
+            thread = threading.Thread(target=lambda: inner.append(profiling.Frame(True).finish()))
+            thread.start()
+            thread.join()
+            assert inner[0][2] is None and outer.finish()[2] is None
+            assert profiling.OpenFrames == set()
+
+            log.info("report() and the files have the totals...")
+            assert profiling.report().splitlines()[0].split()[:2] == ['name', 'calls']
+            jsonFpath = os.path.join(os.environ['HOME'], 'profile.json')
+            profiling.writeJson(jsonFpath)
+            with open(jsonFpath) as f:
+                assert json.load(f)['stats']['makeUserData']['calls'] == 3
+            promFpath = os.path.join(os.environ['HOME'], 'calls.prom')
+            profiling.writePrometheus(promFpath)
+            with open(promFpath) as f:
+                assert 'doutils_call_total{name="makeUserData"} 3' in f.read().splitlines()
+        finally:
+            profiling.disable()
+
+        log.info("disable() puts the originals back, everywhere, and keeps the stats...")
+        assert not profiling.isEnabled() and tracemalloc.is_tracing() == wasTracing
+        assert doUtils.cloudConfig.makeUserData is originalMakeUserData and doUtils.droplet.makeUserData is originalMakeUserData
+        assert doUtils.sshConn.SshConn.do is originalDo
+        assert profiling.stats()['makeUserData']['calls'] == 3
+        profiling.reset()
+        assert profiling.stats() == {}
+
+    log.info("DONE")
@@ -0,0 +1,62 @@
+# Check reap()'s policies, and its dry run, offline.
+# Exercises:
+#    findStale, reap (dry run, then for real) and formatReport, against
+#    the fake API (see offline.py), a day or two "later": an old
+#    droplet is reaped, one tagged doutils-keep and a leased one aren't
+#    (until its lease is old too); the key files the kept ones need are
+#    kept; and a dry run deletes nothing.
+
+import os
+import time
+import logging
+import offline
+import doUtils
+import doUtils.droplet
+from doUtils.reaper import reap, formatReport, KeepTag
+
+logging.basicConfig(level=logging.INFO)
+
+
+def test_reaper():
+
+    log = logging.getLogger('test_reaper')
+
+    with offline.offline(sshServer=False) as (api, _sshd):
+        log.info("make an old droplet, a kept one, and a leased one...")
+        old = doUtils.makeDroplet('1001')
+        kept = doUtils.makeDroplet('1001')
+        api.state.droplets[kept['droplet'].id]['tags'].add(KeepTag)
+        doUtils.droplet.LeaseSettleSecs = 0.1
+        try:
+            leased = doUtils.makeDroplet('1001', acquire=True)
+        finally:
+            doUtils.droplet.LeaseSettleSecs = 2
+        later = time.time() + 48 * 3600
+        pems = {d['droplet'].id: d['pemFilePathname'] for d in (old, kept, leased)}
+        nKeys = len(api.state.keys)
+
+        log.info("a dry run reports just the old droplet, and its key file...")
+        report = reap(now=later, maxLeaseHours=1000)
+        assert report['dryRun'] and report['errors'] == []
+        assert [s['id'] for s in report['droplets']] == [old['droplet'].id] and report['kept']['droplets'] == 2
+        assert [s['path'] for s in report['pems']] == [pems[old['droplet'].id]] and report['kept']['pems'] == 2
+        assert len(report['keys']) == nKeys
+        assert formatReport(report).startswith("Would reap: 1 droplets, {} keys, 1 key files".format(nKeys))
+
+        log.info("...and deletes nothing...")
+        assert set(api.state.droplets) == set(pems) and len(api.state.keys) == nKeys
+        assert all(os.path.exists(path) for path in pems.values())
+
+        log.info("a lease older than maxLeaseHours is reaped too...")
+        report = reap(now=later, maxLeaseHours=24)
+        assert sorted(s['id'] for s in report['droplets']) == sorted([old['droplet'].id, leased['droplet'].id])
+        assert [s['why'] for s in report['droplets'] if s['id'] == leased['droplet'].id][0].startswith('leased')
+
+        log.info("for real, it deletes what it reported...")
+        report = reap(now=later, maxLeaseHours=1000, dryRun=False, ratePerSec=0)
+        assert not report['dryRun'] and report['errors'] == []
+        assert set(api.state.droplets) == {kept['droplet'].id, leased['droplet'].id} and api.state.keys == {}
+        assert [path for path in pems.values() if os.path.exists(path)] == [pems[kept['droplet'].id], pems[leased['droplet'].id]]
+        assert formatReport(report).startswith("Reaped: 1 droplets")
+
+    log.info("DONE")
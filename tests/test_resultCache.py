@@ -0,0 +1,81 @@
+# Check runCached's cache, offline.
+# Exercises:
+#    runCached and ResultCache: a miss runs the job (as a RemoteJob on the
+#    local ssh server, see offline.py) and caches its outputs; a hit
+#    restores them without connecting; a job that's too slow is left
+#    running, uncached.
+
+import os
+import logging
+import offline
+import doUtils
+from doUtils.resultCache import ResultCache, runCached
+
+logging.basicConfig(level=logging.INFO)
+
+Script = """\
+mkdir -p results
+sort data.txt > results/sorted.txt
+echo sorted
+"""
+
+
+def test_resultCache():
+
+    log = logging.getLogger('test_resultCache')
+
+    with offline.offline() as (_api, sshd):
+        home = os.environ['HOME']
+        keyFname = doUtils.SshKeypair('tester').pemFilePathnameAsStr
+        scriptFpath = os.path.join(home, 'sort.sh')
+        with open(scriptFpath, 'w') as f:
+            f.write(Script)
+        dataFpath = os.path.join(home, 'data.txt')
+        with open(dataFpath, 'w') as f:
+            f.write("pear\napple\nfig\n")
+        cache = ResultCache(maxBytes=1024 * 1024)
+        conns = []
+
+        def connect():
+            conns.append(doUtils.SshConn('127.0.0.1', 'tester', keyFname=keyFname, port=sshd.port))
+            return conns[-1]
+
+        try:
+            log.info("a miss runs the job, and caches its outputs...")
+            r = runCached(scriptFpath, [dataFpath], os.path.join(home, 'out1'), connect, outputs=['results'], imageID='1001',
+                          cache=cache, pollSecs=0.1)
+            assert r['exitCode'] == 0 and r['stdout'] == 'sorted\n' and not r['cached'] and len(conns) == 1
+            with open(os.path.join(home, 'out1', 'results', 'sorted.txt')) as f:
+                assert f.read() == "apple\nfig\npear\n"
+            assert cache.stats()['entries'] == 1 and cache.stats()['misses'] == 1
+
+            log.info("a hit restores them, without connecting...")
+            r = runCached(scriptFpath, [dataFpath], os.path.join(home, 'out2'), connect, outputs=['results'], imageID='1001',
+                          cache=cache, pollSecs=0.1)
+            assert r['exitCode'] == 0 and r['stdout'] == 'sorted\n' and r['cached'] and len(conns) == 1
+            with open(os.path.join(home, 'out2', 'results', 'sorted.txt')) as f:
+                assert f.read() == "apple\nfig\npear\n"
+            assert cache.stats()['hits'] == 1
+
+            log.info("...but not for another image...")
+            r = runCached(scriptFpath, [dataFpath], os.path.join(home, 'out3'), connect, outputs=['results'], imageID='1002',
+                          cache=cache, pollSecs=0.1)
+            assert not r['cached'] and len(conns) == 2
+
+            log.info("a job that outlasts its timeout is left running, and not cached...")
+            with open(scriptFpath, 'a') as f:
+                f.write("sleep 2\n")
+            try:
+                runCached(scriptFpath, [dataFpath], os.path.join(home, 'out4'), connect, outputs=['results'], imageID='1001',
+                          cache=cache, pollSecs=0.1, timeout=0.3)
+                assert False, "should have timed out"
+            except TimeoutError as e:
+                log.info("timed out: {}".format(e))
+            jobsDir = os.path.join(sshd.root, 'doUtilsJobs')
+            assert len(os.listdir(jobsDir)) == 1 and cache.stats()['entries'] == 2
+            assert not os.path.exists(os.path.join(home, 'out4'))
+        finally:
+            for sConn in conns:
+                sConn.close()
+
+    log.info("DONE")
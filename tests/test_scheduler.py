@@ -0,0 +1,65 @@
+# Check FleetScheduler's retries, offline.
+# Exercises:
+#    FleetScheduler's addHost, run, stats: commands and callables, tasks
+#    retried on another host, tasks out of retries, and a host that's
+#    dropped -- against the local ssh server (see offline.py), which
+#    answers on 127.0.0.1 and 127.0.0.2 as two hosts.
+
+import socket
+import logging
+import offline
+import doUtils
+from doUtils.scheduler import FleetScheduler
+
+logging.basicConfig(level=logging.INFO)
+
+
+def failsOn(badHost):
+    def task(sConn):
+        if sConn.host == badHost:
+            raise ConnectionError("{} is no good".format(badHost))
+        return sConn.host
+    return task
+
+
+def alwaysFails(sConn):
+    raise RuntimeError("never works")
+
+
+def test_scheduler():
+
+    log = logging.getLogger('test_scheduler')
+
+    with offline.offline(sshHost='0.0.0.0') as (_api, sshd):
+        keyFname = doUtils.SshKeypair('tester').pemFilePathnameAsStr
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            deadPort = sock.getsockname()[1]    # nothing listens here
+
+        log.info("run commands and callables on two hosts (and one that's down)...")
+        tasks = ['echo {}'.format(i) for i in range(6)] + [failsOn('127.0.0.2'), alwaysFails]
+        sched = FleetScheduler(tasks, user='tester', keyFname=keyFname, port=sshd.port, slotsPerHost=2, maxRetries=2, maxHostErrors=3)
+        sched.addHost('127.0.0.1')
+        sched.addHost('127.0.0.2')
+        sched.addHost('127.0.0.3', port=deadPort)
+        try:
+            results = sched.run(timeout=60)
+        finally:
+            sched.pool.closeAll()
+
+        log.info("the commands' output came back...")
+        assert [r['stdout'] for r in results[:6]] == ['{}\n'.format(i) for i in range(6)]
+        assert all(r['status'] == 0 and r['host'] != '127.0.0.3' for r in results[:6])
+
+        log.info("a task that failed on one host was retried on another...")
+        assert results[6]['result'] == '127.0.0.1'
+
+        log.info("one that fails everywhere gave up after its retries...")
+        assert 'never works' in results[7]['error'] and results[7]['attempts'] == 3
+
+        log.info("and the dead host was dropped...")
+        stats = sched.stats()
+        assert stats['hosts']['127.0.0.3'] == {'done': 0, 'meanSecs': None, 'alive': False}
+        assert stats['hosts']['127.0.0.1']['alive'] and stats['done'] == 7 and stats['failed'] == 1
+
+    log.info("DONE")
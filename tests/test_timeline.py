@@ -0,0 +1,111 @@
+# Check launch timelines and their sinks, offline.
+# Exercises:
+#    Timeline's span (nested, timed, failed), bindHost (superseding, and
+#    expiring after BindMaxSecs), the module's span and finishHost, and
+#    the JSON lines, Prometheus textfile and OTLP/JSON sinks -- and a
+#    launch's phases, from makeDroplet to waitUntilCloudInitDone,
+#    against the fake API and the local ssh server (see offline.py).
+
+import os
+import json
+import time
+import logging
+import offline
+import doUtils
+from doUtils import timeline
+from doUtils.timeline import Timeline, JsonLinesSink, PrometheusTextfileSink, OtlpJsonSink
+
+logging.basicConfig(level=logging.INFO)
+
+
+def readLines(fpath):
+    with open(fpath) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_timeline():
+
+    log = logging.getLogger('test_timeline')
+
+    with offline.offline() as (_api, sshd):
+        home = os.environ['HOME']
+        for tl in list(timeline.OpenTimelines.values()):    # earlier tests' launches, lest they end up in these sinks
+            tl.finish()
+        sinks = [JsonLinesSink(os.path.join(home, 'launches.jsonl')), PrometheusTextfileSink(os.path.join(home, 'launches.prom')),
+                 OtlpJsonSink(os.path.join(home, 'launches.otlp.jsonl'))]
+        for sink in sinks:
+            timeline.addSink(sink)
+        try:
+            log.info("spans nest, and are timed...")
+            tl = Timeline('launch', image='1001')
+            with tl.span('outer'):
+                with tl.span('inner', step=1):
+                    time.sleep(0.05)
+                try:
+                    with tl.span('broken'):
+                        raise ValueError("no good")
+                except ValueError:
+                    pass
+            spans = {s['name']: s for s in tl.spans}
+            assert [s['name'] for s in tl.spans] == ['inner', 'broken', 'outer']
+            assert spans['outer']['start'] <= spans['inner']['start'] and spans['inner']['end'] <= spans['outer']['end']
+            assert spans['inner']['end'] - spans['inner']['start'] >= 0.05 and spans['inner']['attrs'] == {'step': 1}
+            assert spans['broken']['error'] == "ValueError: no good" and spans['outer']['error'] is None
+
+            log.info("once bound, spans for its host go to it; finishHost sends it to the sinks...")
+            tl.bindHost('10.0.0.1')
+            with timeline.span('10.0.0.1', 'ssh'):
+                pass
+            with timeline.span('10.0.0.2', 'elsewhere'):    # no timeline: a no-op
+                pass
+            timeline.finishHost('10.0.0.1', ready=True)
+            assert tl.end is not None and tl.attrs['ready'] and timeline.forHost('10.0.0.1') is None
+            assert [s['name'] for s in tl.asDict()['spans']] == ['outer', 'inner', 'broken', 'ssh']
+            tl.finish()    # only the first counts
+            assert len(readLines(sinks[0].fpath)) == 1
+
+            log.info("another launch at the address supersedes it...")
+            first, second = Timeline('launch'), Timeline('launch')
+            first.bindHost('10.0.0.3')
+            second.bindHost('10.0.0.3')
+            assert first.attrs == {'superseded': True} and timeline.forHost('10.0.0.3') is second
+            second.finish()
+
+            log.info("...and one bound for over BindMaxSecs expires...")
+            stale = Timeline('launch')
+            stale.bindHost('10.0.0.4')
+            stale.boundAt -= timeline.BindMaxSecs + 1
+            assert timeline.forHost('10.0.0.4') is None and stale.attrs == {'expired': True}
+            with timeline.span('10.0.0.4', 'late'):
+                pass
+            assert stale.spans == []
+
+            log.info("a launch's phases, from makeDroplet to cloud-init...")
+            dParms = doUtils.makeDroplet('1001')
+            with doUtils.SshConn(dParms['ip address'], dParms['username'], keyFname=dParms['pemFilePathname'], port=sshd.port) as sConn:
+                assert doUtils.waitUntilCloudInitDone(sConn, nTries=2)['done']
+            launch = readLines(sinks[0].fpath)[-1]
+            phases = [s['name'] for s in launch['spans']]
+            assert {'api create', 'action wait', 'ip assignment', 'ssh connect+auth', 'cloud-init'} <= set(phases)
+            assert launch['attrs']['cloudInitDone'] and timeline.forHost(dParms['ip address']) is None
+
+            log.info("the sinks wrote each finished launch...")
+            launches = readLines(sinks[0].fpath)
+            assert len(launches) == 5 and launches[0]['spans'][1]['secs'] >= 0.05
+            with open(sinks[1].fpath) as f:
+                prom = f.read().splitlines()
+            assert 'doutils_launch_phase_seconds_launches_total{phase="total"} 5' in prom
+            assert 'doutils_launch_phase_seconds_launches_total{phase="inner"} 1' in prom
+            assert any(line.startswith('doutils_launch_phase_seconds{phase="api create"} ') for line in prom)
+            otlp = readLines(sinks[2].fpath)
+            assert len(otlp) == 5
+            spans = otlp[0]['resourceSpans'][0]['scopeSpans'][0]['spans']
+            root, children = spans[0], spans[1:]
+            assert root['name'] == 'launch' and {'key': 'image', 'value': {'stringValue': '1001'}} in root['attributes']
+            assert all(c['parentSpanId'] == root['spanId'] and c['traceId'] == root['traceId'] for c in children)
+            assert [c['status'] for c in children if c['name'] == 'broken'] == [{'code': 2, 'message': "ValueError: no good"}]
+        finally:
+            for sink in sinks:
+                timeline.removeSink(sink)
+
+    log.info("DONE")
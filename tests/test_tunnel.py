@@ -0,0 +1,111 @@
+# Check SshConn's tunnels, offline.
+# Exercises:
+#    forwardLocal (cold and warm), socksProxy, and two forwardRemotes on
+#    one connection -- each round trip through the local ssh server (see
+#    offline.py) to an echo server here, with both ssh backends; and
+#    that each tunnel counted its bytes.
+
+import time
+import socket
+import struct
+import logging
+import threading
+import offline
+import doUtils
+
+logging.basicConfig(level=logging.INFO)
+
+# The server's host key is new each run; keep it out of known_hosts.
+NativeOptions = {'UserKnownHostsFile': '/dev/null', 'StrictHostKeyChecking': 'no', 'LogLevel': 'ERROR'}
+
+
+def echoServer(tag):
+    """A server, in a thread, that answers each line with tag and the
+    line; returns its port."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(100)
+
+    def answer(client):
+        with client, client.makefile('rb') as f:
+            for line in f:
+                client.sendall(tag + b' ' + line)
+
+    def serve():
+        while True:
+            client, _addr = sock.accept()
+            threading.Thread(target=answer, args=(client,), daemon=True).start()
+    threading.Thread(target=serve, daemon=True).start()
+    return sock.getsockname()[1]
+
+
+def roundTrip(port, data=b'ping', socksTo=None):
+    """Send a line to port here (through a SOCKS proxy there, to
+    socksTo's port, if given), and read the answer."""
+    with socket.create_connection(('127.0.0.1', port), timeout=10) as sock:
+        if socksTo is not None:
+            sock.sendall(b'\x05\x01\x00')
+            assert sock.recv(2) == b'\x05\x00'
+            sock.sendall(b'\x05\x01\x00\x01' + socket.inet_aton('127.0.0.1') + struct.pack('!H', socksTo))
+            assert sock.recv(10)[:2] == b'\x05\x00'
+        sock.sendall(data + b'\n')
+        with sock.makefile('rb') as f:
+            return f.readline()
+
+
+def settled(tunnel):
+    """tunnel's stats, once its connections have all ended."""
+    deadline = time.time() + 10
+    while tunnel.stats()['active'] and time.time() < deadline:
+        time.sleep(0.05)
+    return tunnel.stats()
+
+
+def test_tunnel():
+
+    log = logging.getLogger('test_tunnel')
+
+    with offline.offline() as (_api, sshd):
+        keyFname = doUtils.SshKeypair('tester').pemFilePathnameAsStr
+        aPort, bPort = echoServer(b'a'), echoServer(b'b')
+
+        for backend, backendArgs in (('paramiko', {}), ('openssh', {'sshOptions': NativeOptions})):
+            log.info("{}: connect...".format(backend))
+            sConn = doUtils.SshConn('127.0.0.1', 'tester', keyFname=keyFname, port=sshd.port, backend=backend, **backendArgs)
+            try:
+                log.info("{}: forwardLocal, cold and warm...".format(backend))
+                for warm in (0, 2):
+                    with sConn.forwardLocal(0, remotePort=aPort, warm=warm) as fwd:
+                        for i in range(3):
+                            assert roundTrip(fwd.localPort, b'%d' % i) == b'a %d\n' % i
+                        stats = settled(fwd)
+                        assert stats['connections'] == 3 and stats['failed'] == 0
+                        assert stats['bytesOut'] == 3 * 2 and stats['bytesIn'] == 3 * 4
+
+                log.info("{}: socksProxy...".format(backend))
+                with sConn.socksProxy(0) as proxy:
+                    assert roundTrip(proxy.localPort, socksTo=bPort) == b'b ping\n'
+                    assert settled(proxy)['connections'] == 1
+
+                log.info("{}: two forwardRemotes on one connection each get their own connections...".format(backend))
+                fwdA = sConn.forwardRemote(0, localPort=aPort)
+                fwdB = sConn.forwardRemote(0, localPort=bPort)
+                try:
+                    assert fwdA.remotePort != fwdB.remotePort
+                    for _ in range(2):
+                        assert roundTrip(fwdA.remotePort) == b'a ping\n'
+                        assert roundTrip(fwdB.remotePort) == b'b ping\n'
+                    assert settled(fwdA)['connections'] == 2 and settled(fwdB)['connections'] == 2
+                    log.info("{}: ...and closing one leaves the other...".format(backend))
+                    fwdA.close()
+                    assert roundTrip(fwdB.remotePort) == b'b ping\n'
+                finally:
+                    fwdA.close()
+                    fwdB.close()
+                assert sConn.tunnels == []
+            finally:
+                sConn.close()
+                if backend == 'openssh':
+                    sConn.exitMaster()
+
+    log.info("DONE")
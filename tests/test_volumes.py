@@ -0,0 +1,69 @@
+# Check data volumes, offline.
+# Exercises:
+#    makeDroplet(volumes=...) against the fake API (see offline.py):
+#    an empty volume's size and filesystem, and one from a snapshot
+#    (snapshotVolume), sized from it, as sent to the API; an existing
+#    volume; the mounts and runcmd added to the user data; a bad
+#    snapshot leaving no volumes behind; and destroyVolumes destroying
+#    just the volumes made for the droplet.
+
+import yaml
+import logging
+import offline
+import digitalocean
+import doUtils
+from doUtils.cloudConfig import CloudConfigHdr, MountOptions
+from doUtils.volumes import volumeDevice, destroyVolumes, snapshotVolume, VolumeTag
+
+logging.basicConfig(level=logging.INFO)
+
+
+def test_volumes():
+
+    log = logging.getLogger('test_volumes')
+
+    with offline.offline(sshServer=False) as (api, _sshd):
+        log.info("an empty volume is made with its size and filesystem, and attached...")
+        first = doUtils.makeDroplet('1001', volumes=[{'sizeGb': 10, 'mountPoint': '/data', 'fsType': 'xfs'}])
+        empty = first['volumes'][0]
+        sent = api.state.volumes[empty['id']]
+        assert sent['size_gigabytes'] == 10 and sent['filesystem_type'] == 'xfs' and sent['snapshot_id'] is None
+        assert VolumeTag in sent['tags'] and sent['region']['slug'] == first['droplet'].region['slug']
+        assert empty['made'] and empty['device'] == volumeDevice(sent['name'])
+        assert api.state.droplets[first['droplet'].id]['volumes'] == [empty['id']]
+
+        log.info("...and mounted by cloud-init...")
+        cc = yaml.safe_load(first['userData'][len(CloudConfigHdr):])
+        assert [empty['device'], '/data', 'xfs', MountOptions, '0', '2'] in cc['mounts']
+        assert cc['runcmd'][0].endswith("mountpoint -q /data || mount /data") and empty['device'] in cc['runcmd'][0]
+
+        log.info("one from a snapshot gets the snapshot's size; an existing one's just attached...")
+        snapshotId = snapshotVolume(empty, 'dataset')
+        first['droplet'].destroy()
+        second = doUtils.makeDroplet('1001', volumes=[{'snapshot': snapshotId, 'mountPoint': '/ro', 'readOnly': True},
+                                                      {'volume': empty['id'], 'mountPoint': '/old'}])
+        fromSnapshot, existing = second['volumes']
+        sent = api.state.volumes[fromSnapshot['id']]
+        assert sent['snapshot_id'] == snapshotId and sent['size_gigabytes'] == 10 and sent['filesystem_type'] == 'xfs'
+        assert fromSnapshot['made'] and not existing['made'] and existing['id'] == empty['id']
+        assert api.state.droplets[second['droplet'].id]['volumes'] == [fromSnapshot['id'], empty['id']]
+        mounts = yaml.safe_load(second['userData'][len(CloudConfigHdr):])['mounts']
+        assert [fromSnapshot['device'], '/ro', 'ext4', MountOptions + ',ro', '0', '2'] in mounts
+
+        log.info("a bad snapshot fails the launch, and the volumes made for it are destroyed...")
+        nVolumes = len(api.state.volumes)
+        try:
+            doUtils.makeDroplet('1001', volumes=[{'sizeGb': 5, 'mountPoint': '/a'}, {'snapshot': 'nosuch', 'sizeGb': 5, 'mountPoint': '/b'}])
+            assert False, "should have raised"
+        except digitalocean.DataReadError as e:
+            assert 'nosuch' in str(e)
+        assert len(api.state.volumes) == nVolumes
+
+        log.info("destroyVolumes destroys just the volumes made for the droplet...")
+        second['droplet'].destroy()
+        destroyVolumes(second)
+        assert set(api.state.volumes) == {empty['id']}
+        destroyVolumes(first)
+        assert api.state.volumes == {}
+
+    log.info("DONE")